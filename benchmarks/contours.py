@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Compare contour extraction with the former matplotlib based implementation.
+
+A synthetic elevation model with a nodata area is contoured by both
+implementations. Run time, number of lines and total line length are printed.
+
+Usage: python benchmarks/contours.py [--size <int>] [--interval <int>]
+
+Requires matplotlib for the reference implementation.
+"""
+
+import argparse
+import numpy as np
+import numpy.ma as ma
+from shapely.geometry import LineString, mapping, shape
+import time
+
+from mapchete.commons.contours import extract_contours, _get_contour_values
+from mapchete.tile import BufferedTilePyramid
+
+
+def matplotlib_contours(array, tile, interval=100, field='elev', base=0):
+    """Former implementation using pyplot."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    levels = _get_contour_values(
+        array.min(), array.max(), interval=interval, base=base)
+    if not levels:
+        return []
+    contours = plt.contour(array, levels)
+    out_contours = []
+    # allsegs holds the vertices of all lines per level as (col, row) arrays
+    for level, segments in zip(levels, contours.allsegs):
+        for vertices in segments:
+            out_coords = [
+                (
+                    tile.left + (y * tile.pixel_x_size),
+                    tile.top - (x * tile.pixel_y_size),
+                )
+                for x, y in zip(vertices[:, 1], vertices[:, 0])
+            ]
+            if len(out_coords) >= 2:
+                out_contours.append(
+                    dict(
+                        properties={field: level},
+                        geometry=mapping(LineString(out_coords))
+                    )
+                )
+    plt.close("all")
+    return out_contours
+
+
+def _elevation(size):
+    y, x = np.mgrid[0:size, 0:size] / float(size) * 4 * np.pi
+    elevation = 1000 + 500 * np.sin(x) * np.cos(y) + 200 * np.sin(3 * x + y)
+    elevation += np.random.RandomState(0).normal(0, 5, (size, size))
+    mask = np.zeros((size, size), dtype=bool)
+    mask[size // 4:size // 2, size // 4:size // 2] = True
+    return ma.masked_array(elevation.astype("float32"), mask=mask)
+
+
+def _run(func, array, tile, interval, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.time()
+        contours = func(array, tile, interval=interval)
+        timings.append(time.time() - start)
+    length = sum(shape(c["geometry"]).length for c in contours)
+    return min(timings), len(contours), length
+
+
+def main():
+    """Run benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--interval", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=3)
+    parsed = parser.parse_args()
+    tile = BufferedTilePyramid(
+        "geodetic", tile_size=parsed.size).tile(5, 5, 5)
+    array = _elevation(parsed.size)
+    for name, func in [
+        ("marching squares", extract_contours),
+        ("matplotlib", matplotlib_contours)
+    ]:
+        try:
+            seconds, count, length = _run(
+                func, array, tile, parsed.interval, parsed.runs)
+        except ImportError as e:
+            print("%-20s skipped: %s" % (name, e))
+            continue
+        print("%-20s %.3fs  %s lines, total length %.4f" % (
+            name, seconds, count, length))
+
+
+if __name__ == "__main__":
+    main()
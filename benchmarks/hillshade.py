@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Compare hillshade kernel with the former float64 implementation.
+
+Run time and peak memory allocated while shading one metatile of synthetic
+elevation data are printed as well as the maximum difference of both
+outputs.
+
+Usage: python benchmarks/hillshade.py [--metatiling <int>] [--pixelbuffer <int>]
+
+Requires Python >= 3.4 for tracemalloc.
+"""
+
+import argparse
+from itertools import product
+import math
+import numpy as np
+import numpy.ma as ma
+import time
+import tracemalloc
+
+from mapchete.commons.hillshade import hillshade
+from mapchete.tile import BufferedTilePyramid
+
+
+def former_hillshade(
+    elevation, tile, azimuth=315.0, altitude=45.0, z=1.0, scale=1.0
+):
+    """Former implementation using nine shifted windows in float64."""
+    xres = tile.tile.pixel_x_size
+    yres = -tile.tile.pixel_y_size
+    height, width = elevation.shape[0] - 2, elevation.shape[1] - 2
+    window = [
+        z * elevation[row:(row + height), col:(col + width)]
+        for (row, col) in product(range(3), range(3))
+    ]
+    x = (
+        (window[0] + window[3] + window[3] + window[6])
+        - (window[2] + window[5] + window[5] + window[8])
+        ) / (8.0 * xres * scale)
+    y = (
+        (window[6] + window[7] + window[7] + window[8])
+        - (window[0] + window[1] + window[1] + window[2])
+        ) / (8.0 * yres * scale)
+    slope = math.pi/2 - np.arctan(np.sqrt(x*x + y*y))
+    aspect = np.arctan2(x, y)
+    deg2rad = math.pi / 180.0
+    shaded = np.sin(altitude * deg2rad) * np.sin(slope) \
+        + np.cos(altitude * deg2rad) * np.cos(slope) \
+        * np.cos((azimuth - 90.0) * deg2rad - aspect)
+    shaded = (((shaded+1.0)/2)*-255.0).astype("uint8")
+    return ma.masked_array(
+        data=np.pad(shaded, 1, mode='edge'), mask=elevation.mask
+    )
+
+
+class _Process(object):
+    """Minimal stand-in for MapcheteProcess providing the tile."""
+
+    def __init__(self, tile):
+        self.tile = tile
+
+
+def _elevation(shape):
+    rows, cols = np.mgrid[0:shape[0], 0:shape[1]] / 100.
+    elevation = 1000 + 400 * np.sin(cols) * np.cos(rows)
+    elevation += np.random.RandomState(0).normal(0, 2, shape)
+    return ma.masked_array(
+        elevation.astype("float32"), mask=np.zeros(shape, dtype=bool))
+
+
+def _run(func, elevation, process, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.time()
+        func(elevation, process)
+        timings.append(time.time() - start)
+    tracemalloc.start()
+    result = func(elevation, process)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(timings), peak, result
+
+
+def main():
+    """Run benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--metatiling", type=int, default=8)
+    parser.add_argument("--pixelbuffer", type=int, default=1)
+    parser.add_argument("--runs", type=int, default=3)
+    parsed = parser.parse_args()
+    tile = BufferedTilePyramid(
+        "geodetic", metatiling=parsed.metatiling,
+        pixelbuffer=parsed.pixelbuffer
+    ).tile(10, 0, 0)
+    process = _Process(tile)
+    elevation = _elevation(tile.shape)
+    print("metatile shape: %s, input size %.1f MB" % (
+        tile.shape, elevation.nbytes / 1e6))
+    results = []
+    for name, func in [("kernel", hillshade), ("former", former_hillshade)]:
+        seconds, peak, result = _run(func, elevation, process, parsed.runs)
+        results.append(result)
+        print("%-8s %.3fs  peak memory %.1f MB" % (name, seconds, peak / 1e6))
+    print("maximum difference: %s" % np.abs(
+        results[0].data.astype("int16") - results[1].data.astype("int16")
+    ).max())
+
+
+if __name__ == "__main__":
+    main()
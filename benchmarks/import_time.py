@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""
+Check import time of ``mapchete`` against a budget using ``-X importtime``.
+
+Exits with status 1 if the cumulative import time exceeds the budget or if
+modules which should only be imported on demand got imported.
+
+Usage: python benchmarks/import_time.py [--budget <seconds>] [--runs <int>]
+
+Requires Python >= 3.7.
+"""
+
+import argparse
+import subprocess
+import sys
+
+# modules which must not be imported by "import mapchete"
+LAZY_MODULES = ["matplotlib", "flask", "pkg_resources"]
+
+
+def _import_times(module):
+    """Return cumulative import times in seconds per module."""
+    output = subprocess.check_output(
+        [sys.executable, "-X", "importtime", "-c", "import %s" % module],
+        stderr=subprocess.STDOUT, universal_newlines=True)
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def main():
+    """Run benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--module", type=str, default="mapchete")
+    parser.add_argument("--budget", type=float, default=1.)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parsed = parser.parse_args()
+    if sys.version_info < (3, 7):
+        sys.exit("-X importtime requires Python 3.7 or newer")
+    # take fastest run to reduce noise
+    runs = [_import_times(parsed.module) for _ in range(parsed.runs)]
+    times = min(runs, key=lambda t: t[parsed.module])
+    total = times[parsed.module]
+    print("import %s: %.3fs (budget %.3fs)" % (
+        parsed.module, total, parsed.budget))
+    print("slowest imports:")
+    for name, seconds in sorted(
+        times.items(), key=lambda i: i[1], reverse=True
+    )[1:parsed.top + 1]:
+        print("  %-40s %.3fs" % (name, seconds))
+    failed = False
+    for name in LAZY_MODULES:
+        if name in times:
+            print("%s should not be imported" % name)
+            failed = True
+    if total > parsed.budget:
+        print("import time exceeds budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
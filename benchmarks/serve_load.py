@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+Load test mapchete serve using concurrent HTTP clients.
+
+All web tiles of one zoom level are requested by concurrent clients, first
+without and then with warm caches. Throughput and latency percentiles per
+round are printed.
+
+By default, the app is created using ``create_app()`` and served on a local
+port by the threaded Werkzeug server. To test a production setup, start e.g.
+gunicorn separately and pass its address using ``--url``.
+
+Usage: python benchmarks/serve_load.py <mapchete_file> [--zoom <int>]
+    [--clients <int>] [--rounds <int>] [--url <url>] [--mode <mode>]
+    [--workers <int>]
+"""
+
+import argparse
+import logging
+from multiprocessing.pool import ThreadPool
+import os
+import threading
+import time
+
+from six.moves.urllib.request import urlopen
+from six.moves.urllib.error import HTTPError
+
+import mapchete
+from mapchete.tile import BufferedTilePyramid
+
+
+def _serve(parsed):
+    """Start app in background thread and return its URL."""
+    from werkzeug.serving import make_server
+    from mapchete.cli.serve import create_app
+    app = create_app(
+        mapchete_files=[parsed.mapchete_file], mode=parsed.mode,
+        workers=parsed.workers)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return "http://127.0.0.1:%s" % server.server_port
+
+
+def _tile_urls(parsed, url):
+    with mapchete.open(parsed.mapchete_file, mode="readonly") as mp:
+        pyramid = mp.config.process_pyramid
+        bounds = mp.config.bounds_at_zoom(parsed.zoom)
+    grid = "g" if pyramid.srid == 3857 else "WGS84"
+    name = os.path.splitext(os.path.basename(parsed.mapchete_file))[0]
+    return [
+        "%s/wmts_simple/1.0.0/%s/default/%s/%s/%s/%s.png" % (
+            url, name, grid, tile.zoom, tile.row, tile.col)
+        for tile in BufferedTilePyramid(pyramid.grid).tiles_from_bounds(
+            bounds, parsed.zoom)
+    ]
+
+
+def _request(url):
+    start = time.time()
+    try:
+        response = urlopen(url)
+        response.read()
+        status = response.getcode()
+    except HTTPError as e:
+        status = e.code
+    return time.time() - start, status
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100.))]
+
+
+def main():
+    """Run benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("mapchete_file")
+    parser.add_argument("--zoom", type=int, default=5)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=2)
+    parser.add_argument("--url", type=str, default=None)
+    parser.add_argument("--mode", type=str, default="memory")
+    parser.add_argument("--workers", type=int, default=None)
+    parsed = parser.parse_args()
+    url = parsed.url or _serve(parsed)
+    tile_urls = _tile_urls(parsed, url)
+    print("%s tiles, %s clients, serving from %s" % (
+        len(tile_urls), parsed.clients, url))
+    pool = ThreadPool(parsed.clients)
+    for i in range(parsed.rounds):
+        start = time.time()
+        results = pool.map(_request, tile_urls)
+        elapsed = time.time() - start
+        latencies = [latency for latency, _ in results]
+        errors = len([status for _, status in results if status != 200])
+        print(
+            "round %s: %.1f requests/s, latency p50 %.3fs p90 %.3fs "
+            "max %.3fs, %s errors" % (
+                i + 1, len(results) / elapsed, _percentile(latencies, 50),
+                _percentile(latencies, 90), max(latencies), errors))
+    pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""
+Measure startup time of ``mapchete --help`` and ``mapchete.open()``.
+
+Every command runs in a fresh interpreter so import costs are included.
+
+Usage: python benchmarks/startup.py [<mapchete_file>] [--runs <int>]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+DEFAULT_MAPCHETE_FILE = os.path.join(
+    SCRIPT_DIR, "..", "test", "testdata", "cleantopo_br.mapchete")
+
+COMMANDS = [
+    ("import mapchete", "import mapchete", []),
+    (
+        "mapchete --help",
+        "from mapchete.cli.main import main; main()",
+        ["--help"]
+    ),
+    (
+        "mapchete.open()",
+        "import sys, mapchete; mapchete.open(sys.argv[1], mode='readonly')",
+        None
+    ),
+]
+
+
+def _run(code, args):
+    start = time.time()
+    subprocess.check_call(
+        [sys.executable, "-c", code] + args, stdout=open(os.devnull, "w"))
+    return time.time() - start
+
+
+def main():
+    """Run benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "mapchete_file", nargs="?", default=DEFAULT_MAPCHETE_FILE)
+    parser.add_argument("--runs", type=int, default=5)
+    parsed = parser.parse_args()
+    for name, code, args in COMMANDS:
+        args = [parsed.mapchete_file] if args is None else args
+        # first run warms up file system caches
+        _run(code, args)
+        timings = sorted(_run(code, args) for _ in range(parsed.runs))
+        print("%-20s min %.3fs  median %.3fs" % (
+            name, timings[0], timings[len(timings) // 2]))
+
+
+if __name__ == "__main__":
+    main()
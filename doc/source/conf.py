@@ -184,9 +184,7 @@ MOCK_MODULES = [
     'rasterio.warp.Resampling',
     'rasterio.windows',
     'rasterio.crs',
-    'rasterio.io'
-    'matplotlib',
-    'matplotlib.pyplot',
+    'rasterio.io',
     'numpy',
     'numpy.ma',
     'cached_property',
@@ -1,6 +1,7 @@
 import logging
 
 from mapchete._core import open, count_tiles, Mapchete, MapcheteProcess
+from mapchete._graph import ProcessGraph
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.NullHandler())
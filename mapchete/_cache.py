@@ -0,0 +1,643 @@
+"""Cache for process output used in memory mode and by mapchete serve."""
+
+from cachetools import LRUCache
+from collections import OrderedDict
+from contextlib import contextmanager
+import errno
+import hashlib
+import logging
+import numpy as np
+import numpy.ma as ma
+import os
+import shutil
+from six.moves import cPickle as pickle
+import socket
+import tempfile
+import threading
+import time
+import uuid
+import yaml
+
+logger = logging.getLogger(__name__)
+
+# default limits if not configured otherwise in the Mapchete file
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+DEFAULT_MAX_FEATURES = 1000000
+
+
+class ProcessTileCache(LRUCache):
+    """
+    Thread-safe LRU cache of process tile output limited by total data size.
+
+    The size of raster output is measured in bytes, the size of vector output
+    in number of features. Output larger than the whole cache is not cached.
+
+    If a disk cache size is given, entries evicted from memory are moved to
+    a ``DiskCache`` and looked up there before the process tile has to be
+    executed again.
+
+    Parameters
+    ----------
+    data_type : string
+        output data type (``raster`` or ``vector``)
+    max_bytes : integer
+        maximum total size of cached raster output in bytes
+    max_features : integer
+        maximum total number of cached vector features
+    disk_max_bytes : integer
+        maximum total size of output spilled to disk in bytes (default: None,
+        no disk cache)
+    disk_path : string
+        directory where a temporary disk cache directory is created (default:
+        system temporary directory)
+    disk_shared : bool
+        use ``disk_path`` as ``SharedDiskCache`` which is kept after closing
+        and can be used by multiple processes at the same time; all output is
+        written through to disk (default: False)
+
+    Attributes
+    ----------
+    hits : integer
+        number of successful lookups
+    misses : integer
+        number of failed lookups
+    evictions : integer
+        number of entries removed to free space
+    disk : DiskCache
+        disk cache or None
+    """
+
+    def __init__(
+        self, data_type="raster", max_bytes=DEFAULT_MAX_BYTES,
+        max_features=DEFAULT_MAX_FEATURES, disk_max_bytes=None, disk_path=None,
+        disk_shared=False
+    ):
+        """Initialize cache."""
+        if data_type == "raster":
+            super(ProcessTileCache, self).__init__(
+                maxsize=max_bytes, getsizeof=_nbytes)
+        elif data_type == "vector":
+            super(ProcessTileCache, self).__init__(
+                maxsize=max_features, getsizeof=_num_features)
+        else:
+            raise ValueError("invalid data type: %s" % data_type)
+        self.data_type = data_type
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._evicting = False
+        self._lock = threading.RLock()
+        if disk_shared:
+            self.disk = SharedDiskCache(max_bytes=disk_max_bytes, path=disk_path)
+        elif disk_max_bytes:
+            self.disk = DiskCache(max_bytes=disk_max_bytes, path=disk_path)
+        else:
+            self.disk = None
+
+    def __getitem__(self, key):
+        """Return cached output and count hit or miss."""
+        with self._lock:
+            try:
+                value = super(ProcessTileCache, self).__getitem__(key)
+            except KeyError:
+                self.misses += 1
+                if self.disk is None:
+                    raise
+                # move output back from disk into memory
+                value = self.disk[key]
+                self[key] = value
+                return value
+            # evicting an entry also reads it
+            if not self._evicting:
+                self.hits += 1
+            return value
+
+    def __setitem__(self, key, value):
+        """Cache output, evicting least recently used entries if necessary."""
+        with self._lock:
+            if isinstance(self.disk, SharedDiskCache):
+                self.disk[key] = value
+            try:
+                super(ProcessTileCache, self).__setitem__(key, value)
+            except ValueError:
+                logger.debug(
+                    "output of %s too large for process tile cache", key)
+                if self.disk is not None:
+                    self.disk[key] = value
+
+    def __delitem__(self, key):
+        """Remove output from cache."""
+        with self._lock:
+            super(ProcessTileCache, self).__delitem__(key)
+
+    def __contains__(self, key):
+        """Return whether output is cached without counting a lookup."""
+        with self._lock:
+            return super(ProcessTileCache, self).__contains__(key) or (
+                self.disk is not None and key in self.disk)
+
+    def popitem(self):
+        """Remove and return least recently used entry."""
+        with self._lock:
+            self._evicting = True
+            try:
+                item = super(ProcessTileCache, self).popitem()
+            finally:
+                self._evicting = False
+            self.evictions += 1
+            logger.debug("evicted %s from process tile cache", item[0])
+            if self.disk is not None:
+                self.disk[item[0]] = item[1]
+            return item
+
+    @contextmanager
+    def lock(self, key):
+        """
+        Lock entry for other processes using the same shared disk cache.
+
+        Without a ``SharedDiskCache`` this does nothing.
+        """
+        if isinstance(self.disk, SharedDiskCache):
+            with self.disk.lock(key):
+                yield
+        else:
+            yield
+
+    def close(self):
+        """Remove all cached output from memory and disk."""
+        with self._lock:
+            self.clear()
+            if self.disk is not None:
+                self.disk.close()
+
+    def stats(self):
+        """
+        Return cache statistics.
+
+        Returns
+        -------
+        statistics : dictionary
+            hits, misses, evictions, number of cached tiles, current and
+            maximum size (in bytes for raster, in features for vector) and
+            statistics of disk cache if available
+        """
+        with self._lock:
+            stats = dict(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                tiles=len(self),
+                currsize=self.currsize,
+                maxsize=self.maxsize,
+            )
+            if self.disk is not None:
+                stats.update(disk=self.disk.stats())
+            return stats
+
+
+class DiskCache(object):
+    """
+    Thread-safe LRU cache of process tile output in a temporary directory.
+
+    Arrays are stored as ``.npy`` files and read back as copy-on-write memory
+    maps, all other output (e.g. vector features) is pickled.
+
+    Parameters
+    ----------
+    max_bytes : integer
+        maximum total size of cached files in bytes
+    path : string
+        directory where the temporary cache directory is created (default:
+        system temporary directory)
+
+    Attributes
+    ----------
+    path : string
+        cache directory
+    hits : integer
+        number of successful lookups
+    misses : integer
+        number of failed lookups
+    evictions : integer
+        number of files removed to free space
+    """
+
+    def __init__(self, max_bytes, path=None):
+        """Initialize cache."""
+        if path is not None and not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = tempfile.mkdtemp(prefix="mapchete_cache_", dir=path)
+        self.max_bytes = max_bytes
+        self.currsize = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key: (file paths, size), least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __contains__(self, key):
+        """Return whether output is cached without counting a lookup."""
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        """Return number of cached entries."""
+        with self._lock:
+            return len(self._entries)
+
+    def __getitem__(self, key):
+        """Read cached output and count hit or miss."""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                raise KeyError(key)
+            self.hits += 1
+            self._touch(key)
+            paths, _ = self._entries[key]
+            return _read(paths)
+
+    def __setitem__(self, key, value):
+        """Write output, removing least recently used files if necessary."""
+        with self._lock:
+            if key in self._entries:
+                # output read from disk before is unchanged
+                self._touch(key)
+                return
+            paths = _write(os.path.join(self.path, _file_name(key)), value)
+            size = sum(os.path.getsize(p) for p in paths)
+            if size > self.max_bytes:
+                logger.debug("output of %s too large for disk cache", key)
+                _remove(paths)
+                return
+            self._entries[key] = (paths, size)
+            self.currsize += size
+            while self.currsize > self.max_bytes:
+                old_key, (old_paths, old_size) = self._entries.popitem(
+                    last=False)
+                # memory maps of removed files stay valid on POSIX systems
+                _remove(old_paths)
+                self.currsize -= old_size
+                self.evictions += 1
+                logger.debug("evicted %s from disk cache", old_key)
+
+    def close(self):
+        """Remove cache directory."""
+        with self._lock:
+            self._entries.clear()
+            self.currsize = 0
+            shutil.rmtree(self.path, ignore_errors=True)
+
+    def stats(self):
+        """
+        Return cache statistics.
+
+        Returns
+        -------
+        statistics : dictionary
+            hits, misses, evictions, number of cached tiles, current and
+            maximum size in bytes
+        """
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                tiles=len(self._entries),
+                currsize=self.currsize,
+                maxsize=self.max_bytes,
+            )
+
+    def _touch(self, key):
+        self._entries[key] = self._entries.pop(key)
+
+
+class SharedDiskCache(DiskCache):
+    """
+    LRU cache of process tile output in a directory shared by processes.
+
+    Other than ``DiskCache``, the directory is not removed when closing and
+    the cache state is read from the directory itself, so multiple processes
+    (e.g. preforked WSGI workers) can use it concurrently. Files are written
+    to a temporary location and moved into place atomically. Least recently
+    used entries are removed if the total size of the directory exceeds
+    ``max_bytes``. As this requires scanning the directory, it is only checked
+    after each process wrote another ``1 / TRIM_FRACTION`` of ``max_bytes``
+    and on the first write, so the directory can temporarily exceed
+    ``max_bytes`` by this amount per process.
+
+    Parameters
+    ----------
+    max_bytes : integer
+        maximum total size of cached files in bytes
+    path : string
+        cache directory
+
+    Attributes
+    ----------
+    path : string
+        cache directory
+    hits : integer
+        number of successful lookups in this process
+    misses : integer
+        number of failed lookups in this process
+    evictions : integer
+        number of entries removed by this process to free space
+    """
+
+    # fraction of max_bytes written by a process between directory scans
+    TRIM_FRACTION = 16
+
+    def __init__(self, max_bytes, path):
+        """Initialize cache."""
+        self.path = path
+        self._tmp_path = os.path.join(path, ".tmp")
+        if not os.path.isdir(self._tmp_path):
+            try:
+                os.makedirs(self._tmp_path)
+            except OSError as e:
+                # created by another process in the meantime
+                if e.errno != errno.EEXIST:
+                    raise
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+        # bytes written since the directory was scanned; None triggers a scan
+        self._written = None
+
+    @property
+    def currsize(self):
+        """Return total size of cached files in bytes."""
+        return sum(size for _, size, _ in self._scan().values())
+
+    def __contains__(self, key):
+        """Return whether output is cached without counting a lookup."""
+        return self._paths(key) is not None
+
+    def __len__(self):
+        """Return number of cached entries."""
+        return len(self._scan())
+
+    def __getitem__(self, key):
+        """Read cached output and count hit or miss."""
+        paths = self._paths(key)
+        try:
+            if paths is None:
+                raise KeyError(key)
+            value = _read(paths)
+            # modification time is used to determine least recently used
+            os.utime(paths[0], None)
+        except (KeyError, IOError, OSError, ValueError, EOFError):
+            # files can be removed by other processes at any time
+            with self._lock:
+                self.misses += 1
+            raise KeyError(key)
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        """Write output, removing least recently used files if necessary."""
+        paths = self._paths(key)
+        if paths is not None:
+            try:
+                os.utime(paths[0], None)
+                return
+            except OSError:
+                pass
+        tmp_paths = _write(
+            os.path.join(
+                self._tmp_path, "%s.%s" % (uuid.uuid4().hex, _file_name(key))),
+            value)
+        size = sum(os.path.getsize(path) for path in tmp_paths)
+        # data file is moved last as it marks the entry as complete
+        for tmp_path in reversed(tmp_paths):
+            os.rename(tmp_path, os.path.join(
+                self.path, os.path.basename(tmp_path).split(".", 1)[1]))
+        with self._lock:
+            # scanning the whole directory after every write is too slow
+            if self._written is not None and (
+                self._written + size < self.max_bytes // self.TRIM_FRACTION
+            ):
+                self._written += size
+                return
+            self._written = 0
+        self._trim()
+
+    @contextmanager
+    def lock(self, key, timeout=600):
+        """
+        Lock entry for all processes, e.g. while output is being generated.
+
+        Locks of processes which died on this host are removed. Locks of other
+        hosts are considered stale and removed after timeout seconds.
+        """
+        lock_path = os.path.join(self.path, _file_name(key) + ".lock")
+        while True:
+            try:
+                lock_file = os.open(
+                    lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            else:
+                try:
+                    os.write(lock_file, _lock_owner().encode("utf-8"))
+                finally:
+                    os.close(lock_file)
+                break
+            if _stale_lock(lock_path, timeout):
+                logger.debug("remove stale lock %s", lock_path)
+                _remove([lock_path])
+                continue
+            time.sleep(0.05)
+        try:
+            yield
+        finally:
+            _remove([lock_path])
+
+    def close(self):
+        """Keep cache directory for other processes."""
+
+    def stats(self):
+        """
+        Return cache statistics.
+
+        Returns
+        -------
+        statistics : dictionary
+            hits, misses, evictions of this process, number of cached tiles,
+            current and maximum size in bytes
+        """
+        entries = self._scan()
+        with self._lock:
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                tiles=len(entries),
+                currsize=sum(size for _, size, _ in entries.values()),
+                maxsize=self.max_bytes,
+            )
+
+    def _paths(self, key):
+        base_path = os.path.join(self.path, _file_name(key))
+        for paths in [
+            [base_path + ".masked.npy", base_path + ".mask.npy"],
+            [base_path + ".npy"],
+            [base_path + ".pickle"]
+        ]:
+            if all(os.path.isfile(path) for path in paths):
+                return paths
+        return None
+
+    def _scan(self):
+        """Return files, total size and last modification per entry."""
+        entries = {}
+        for name in os.listdir(self.path):
+            if name.startswith(".") or name.endswith(".lock"):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            paths, size, mtime = entries.get(name.split(".", 1)[0], ([], 0, 0))
+            entries[name.split(".", 1)[0]] = (
+                paths + [path], size + stat.st_size, max(mtime, stat.st_mtime))
+        return entries
+
+    def _trim(self):
+        entries = self._scan()
+        currsize = sum(size for _, size, _ in entries.values())
+        for paths, size, _ in sorted(entries.values(), key=lambda e: e[2]):
+            if currsize <= self.max_bytes:
+                break
+            _remove(paths)
+            currsize -= size
+            with self._lock:
+                self.evictions += 1
+
+
+def process_checksum(config):
+    """
+    Return checksum of process configuration and process code.
+
+    Parameters
+    ----------
+    config : MapcheteConfig
+
+    Returns
+    -------
+    checksum : string
+    """
+    checksum = hashlib.md5(
+        yaml.dump(config._raw, default_flow_style=False).encode("utf-8"))
+    with open(config.process_file, "rb") as src:
+        checksum.update(src.read())
+    return checksum.hexdigest()
+
+
+def _file_name(key):
+    if isinstance(key, tuple):
+        return "_".join(map(str, key))
+    return str(key)
+
+
+def _write(base_path, value):
+    """Write output and return list of written files."""
+    if isinstance(value, ma.MaskedArray) and not value.dtype.hasobject:
+        paths = [base_path + ".masked.npy", base_path + ".mask.npy"]
+        np.save(paths[0], ma.getdata(value))
+        np.save(paths[1], ma.getmaskarray(value))
+        return paths
+    elif isinstance(value, np.ndarray) and not value.dtype.hasobject:
+        paths = [base_path + ".npy"]
+        np.save(paths[0], value)
+        return paths
+    paths = [base_path + ".pickle"]
+    with open(paths[0], "wb") as dst:
+        pickle.dump(value, dst, protocol=pickle.HIGHEST_PROTOCOL)
+    return paths
+
+
+def _read(paths):
+    """Read output written by _write()."""
+    if paths[0].endswith(".pickle"):
+        with open(paths[0], "rb") as src:
+            return pickle.load(src)
+    # copy-on-write memory maps can be modified without changing the files
+    data = np.load(paths[0], mmap_mode="c")
+    if len(paths) == 2:
+        return ma.masked_array(data, mask=np.load(paths[1], mmap_mode="c"))
+    return data
+
+
+def _lock_owner():
+    return "%s %s" % (socket.gethostname(), os.getpid())
+
+
+def _stale_lock(lock_path, timeout):
+    """Return whether lock owner died or lock is older than timeout."""
+    try:
+        with open(lock_path) as src:
+            host, pid = src.read().split()
+        if host == socket.gethostname() and not _pid_exists(int(pid)):
+            return True
+    except (IOError, OSError, ValueError):
+        # removed or not written yet
+        pass
+    try:
+        return time.time() - os.path.getmtime(lock_path) > timeout
+    except OSError:
+        return False
+
+
+def _pid_exists(pid):
+    if os.name != "posix":
+        # cannot be checked without side effects
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+
+def _remove(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _nbytes(data):
+    """Return size of raster process output in bytes."""
+    if isinstance(data, ma.MaskedArray):
+        mask = ma.getmask(data)
+        return data.data.nbytes + (
+            mask.nbytes if mask is not ma.nomask else 0)
+    elif isinstance(data, np.ndarray):
+        return data.nbytes
+    # output with metadata
+    elif isinstance(data, tuple) and len(data) == 2 and (
+        isinstance(data[1], dict)
+    ):
+        return _nbytes(data[0])
+    # list of bands
+    elif isinstance(data, (list, tuple)):
+        return sum(_nbytes(band) for band in data)
+    return 0
+
+
+def _num_features(data):
+    """Return number of features of vector process output."""
+    # output with metadata
+    if isinstance(data, tuple) and len(data) == 2 and (
+        isinstance(data[1], dict)
+    ):
+        return _num_features(data[0])
+    return len(data)
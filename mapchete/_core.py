@@ -1,30 +1,33 @@
 """Main module managing processes."""
 
 from cachetools import LRUCache
+from collections import namedtuple
 from functools import partial
 import inspect
-from itertools import chain, product
+from itertools import chain, islice, product
 import logging
-from multiprocessing import cpu_count, current_process
+from multiprocessing import Manager, cpu_count, current_process
 from multiprocessing.pool import Pool
 import numpy as np
 import numpy.ma as ma
 import os
-from shapely.geometry import shape
+from shapely.geometry import mapping, shape
+from shapely.prepared import prep
 import signal
 import six
+from six.moves import queue
 import threading
 from tilematrix import TilePyramid
 import time
 from traceback import format_exc
 import types
 
-from mapchete.commons import clip as commons_clip
-from mapchete.commons import contours as commons_contours
-from mapchete.commons import hillshade as commons_hillshade
+from mapchete._cache import ProcessTileCache, process_checksum, _nbytes
+from mapchete._prefetch import PREFETCH_TILES, prefetched
 from mapchete.config import MapcheteConfig
 from mapchete.tile import BufferedTile
 from mapchete.io import raster
+from mapchete.io.vector import reproject_geometry, to_shape
 from mapchete.errors import (
     MapcheteProcessException, MapcheteProcessOutputError, MapcheteNodataTile
 )
@@ -35,6 +38,36 @@ logger.addHandler(logging.NullHandler())
 # suppress rasterio logging
 logging.getLogger("rasterio").setLevel(logging.ERROR)
 
+# maximum number of cached warp grids for reprojected output
+WARP_GRID_CACHE_SIZE = 256
+
+# process zoom level, source bounds and source coordinates of a tile in
+# another CRS
+_WarpGrid = namedtuple("_WarpGrid", ("zoom", "bounds", "coordinates"))
+# module level, as Mapchete objects have to stay picklable
+_warp_grids_lock = threading.Lock()
+
+# maximum total size of written output kept in memory to interpolate lower
+# zoom levels from baselevels
+BASELEVEL_CHILDREN_MAX_BYTES = 256 * 1024 * 1024
+# module level and keyed by output path and tile index, as Mapchete objects
+# are pickled anew for every pool task; emptied by the pool initializer
+_baselevel_children = LRUCache(
+    maxsize=BASELEVEL_CHILDREN_MAX_BYTES, getsizeof=_nbytes)
+_baselevel_children_lock = threading.Lock()
+# disabled in workers which end before lower zoom levels are built
+_keep_baselevel_children = True
+
+# maximum total size of decoded output tiles read from disk to interpolate
+# other zoom levels from baselevels, cached like _baselevel_children
+BASELEVEL_SOURCES_MAX_BYTES = 128 * 1024 * 1024
+_baselevel_sources = LRUCache(
+    maxsize=BASELEVEL_SOURCES_MAX_BYTES, getsizeof=_nbytes)
+_baselevel_sources_lock = threading.Lock()
+
+# minimum number of subtrees per worker when choosing the subtree root zoom
+SUBTREES_PER_WORKER = 4
+
 
 def open(
     config, mode="continue", zoom=None, bounds=None, single_input_file=None,
@@ -93,6 +126,12 @@ class Mapchete(object):
         Mapchete process configuration
     with_cache : bool
         process output data cached in memory
+    process_tile_cache : ProcessTileCache
+        process output cache limited by total size, providing hit, miss and
+        eviction counters (only if with_cache is activated)
+    executor : callable
+        function executing a process tile when its output is not cached,
+        e.g. in another process (default: None, use ``execute()``)
     """
 
     def __init__(self, config, with_cache=False):
@@ -117,10 +156,30 @@ class Mapchete(object):
         else:
             self.with_cache = with_cache
         if self.with_cache:
-            self.process_tile_cache = LRUCache(maxsize=512)
+            process_cache = dict(self.config.process_cache)
+            if process_cache["disk_shared"]:
+                # separate shared cache directory per process configuration
+                process_cache.update(disk_path=os.path.join(
+                    process_cache["disk_path"], "%s_%s" % (
+                        self.process_name, process_checksum(self.config))))
+            self.process_tile_cache = ProcessTileCache(
+                data_type=self.config.output.METADATA["data_type"],
+                **process_cache)
             self.current_processes = {}
             self.process_lock = threading.Lock()
+        self.executor = None
         self._count_tiles_cache = {}
+        self._warp_grids = LRUCache(maxsize=WARP_GRID_CACHE_SIZE)
+        # output may have been changed since it was kept or read by an
+        # earlier process
+        output_path = getattr(self.config.output, "path", None)
+        for cache, lock in [
+            (_baselevel_children, _baselevel_children_lock),
+            (_baselevel_sources, _baselevel_sources_lock)
+        ]:
+            with lock:
+                for key in [k for k in cache if k[0] == output_path]:
+                    del cache[key]
 
     def get_process_tiles(self, zoom=None):
         """
@@ -153,7 +212,8 @@ class Mapchete(object):
                     yield tile
 
     def batch_process(
-        self, zoom=None, tile=None, multi=cpu_count(), max_chunksize=1
+        self, zoom=None, tile=None, multi=cpu_count(), max_chunksize=1,
+        subtrees=False, prefetch=False
     ):
         """
         Process a large batch of tiles.
@@ -173,11 +233,19 @@ class Mapchete(object):
         max_chunksize : int
             maximum number of process tiles to be queued for each worker;
             (default: 1)
+        subtrees : bool
+            hand each worker a tile and all of its descendants down to the
+            maximum zoom level (default: False)
+        prefetch : bool
+            read input of the next tiles queued for a worker in a background
+            thread (default: False)
         """
-        list(self.batch_processor(zoom, tile, multi, max_chunksize))
+        list(self.batch_processor(
+            zoom, tile, multi, max_chunksize, subtrees, prefetch))
 
     def batch_processor(
-        self, zoom=None, tile=None, multi=cpu_count(), max_chunksize=1
+        self, zoom=None, tile=None, multi=cpu_count(), max_chunksize=1,
+        subtrees=False, prefetch=False
     ):
         """
         Process a large batch of tiles and yield report messages per tile.
@@ -195,6 +263,16 @@ class Mapchete(object):
         max_chunksize : int
             maximum number of process tiles to be queued for each worker;
             (default: 1)
+        subtrees : bool
+            hand each worker a tile and all of its descendants down to the
+            maximum zoom level, processed from the bottom up, so lower zoom
+            levels interpolated from baselevels use children output from
+            memory instead of reading it from disk (default: False)
+        prefetch : bool
+            read input of the next tiles queued for a worker in a background
+            thread while the current tile is processed; with multiple workers,
+            at least PREFETCH_TILES + 1 process tiles are queued for each
+            worker (default: False)
         """
         if zoom and tile:
             raise ValueError("use either zoom or tile")
@@ -202,16 +280,23 @@ class Mapchete(object):
         # run single tile
         if tile:
             yield _run_on_single_tile(self, tile)
+        # run subtrees of tiles
+        elif subtrees:
+            for result in _run_subtrees(
+                self, list(_get_zoom_level(zoom, self)), multi, prefetch
+            ):
+                yield result
         # run using multiprocessing
         elif multi > 1:
             for result in _run_with_multiprocessing(
-                self, list(_get_zoom_level(zoom, self)), multi, max_chunksize
+                self, list(_get_zoom_level(zoom, self)), multi, max_chunksize,
+                prefetch
             ):
                 yield result
         # run without multiprocessing
         elif multi == 1:
             for result in _run_without_multiprocessing(
-                self, list(_get_zoom_level(zoom, self))
+                self, list(_get_zoom_level(zoom, self)), prefetch
             ):
                 yield result
 
@@ -319,6 +404,11 @@ class Mapchete(object):
             logger.debug((process_tile.id, message))
             return message
         else:
+            # output read before is outdated
+            with _baselevel_sources_lock:
+                _baselevel_sources.pop(
+                    self._baselevel_key(process_tile), None)
+            self._keep_baselevel_child(process_tile, data)
             if data is None:
                 message = "output empty, nothing written"
                 logger.debug((process_tile.id, message))
@@ -340,7 +430,8 @@ class Mapchete(object):
         ----------
         tile : tuple, Tile or BufferedTile
             If a tile index is given, a tile from the output pyramid will be
-            assumed. Tile cannot be bigger than process tile!
+            assumed. Tile cannot be bigger than process tile! Tiles of a
+            pyramid with another CRS are reprojected on the fly.
 
         Returns
         -------
@@ -351,6 +442,10 @@ class Mapchete(object):
             raise TypeError("'tile' must be a tuple or BufferedTile")
         if isinstance(tile, tuple):
             tile = self.config.output_pyramid.tile(*tile)
+
+        if tile.crs != self.config.process_pyramid.crs:
+            return self._get_reprojected_output(tile, _baselevel_readonly)
+
         if _baselevel_readonly:
             tile = self.config.baselevels["tile_pyramid"].tile(*tile.id)
 
@@ -358,19 +453,22 @@ class Mapchete(object):
         if tile.zoom not in self.config.zoom_levels:
             return self.config.output.empty(tile)
 
-        # TODO implement reprojection
-        if tile.crs != self.config.process_pyramid.crs:
-            raise NotImplementedError(
-                "reprojection between processes not yet implemented")
-
         if self.config.mode == "memory":
             # Determine affected process Tile and check whether it is already
             # cached.
             process_tile = self.config.process_pyramid.intersecting(tile)[0]
-            return self._extract(
-                in_tile=process_tile,
-                in_data=self._execute_using_cache(process_tile),
-                out_tile=tile
+            if process_tile.bbox.contains(tile.bbox):
+                return self._extract(
+                    in_tile=process_tile,
+                    in_data=self._execute_using_cache(process_tile),
+                    out_tile=tile
+                )
+            # tile is bigger than one process tile, e.g. if it is requested
+            # from another process with a bigger pixelbuffer or metatiling
+            return self._extract_from_process_tiles(
+                list(self.config.process_pyramid.tiles_from_bounds(
+                    tile.bounds, tile.zoom)),
+                tile
             )
 
         # TODO: cases where tile intersects with multiple process tiles
@@ -397,6 +495,81 @@ class Mapchete(object):
         elif self.config.mode == "overwrite" and not _baselevel_readonly:
             return self._process_and_overwrite_output(tile, process_tile)
 
+    def _get_reprojected_output(self, tile, _baselevel_readonly=False):
+        warp_grid = self._warp_grid(tile)
+        if warp_grid is None:
+            return self.config.output.empty(tile)
+        output_tiles = self.config.output_pyramid.tiles_from_bounds(
+            warp_grid.bounds, warp_grid.zoom)
+        if self.config.output.METADATA["data_type"] == "raster":
+            nodata = self.config.output.nodata
+            dtype = self.config.output.output_params["dtype"]
+            mosaic = raster.create_mosaic([
+                (
+                    output_tile,
+                    raster.prepare_array(
+                        self.get_raw_output(
+                            output_tile,
+                            _baselevel_readonly=_baselevel_readonly),
+                        nodata=nodata, dtype=dtype)
+                )
+                for output_tile in output_tiles
+            ], nodata=nodata)
+            return raster.sample_from_array(
+                mosaic, coordinates=warp_grid.coordinates)
+        elif self.config.output.METADATA["data_type"] == "vector":
+            features = []
+            for feature in chain.from_iterable([
+                self.get_raw_output(
+                    output_tile, _baselevel_readonly=_baselevel_readonly)
+                for output_tile in output_tiles
+            ]):
+                geometry = reproject_geometry(
+                    to_shape(feature["geometry"]),
+                    src_crs=self.config.process_pyramid.crs,
+                    dst_crs=tile.crs)
+                if geometry.intersects(tile.bbox):
+                    features.append(dict(feature, geometry=mapping(geometry)))
+            return features
+
+    def _warp_grid(self, tile):
+        """
+        Return cached process zoom, bounds and pixel coordinates of tile.
+
+        Transforming the pixel coordinates is the expensive part of
+        reprojecting, so they are kept per destination tile and reused by
+        all bands and subsequent requests. None is returned if the tile has
+        no matching process zoom level or does not intersect with the
+        process pyramid.
+        """
+        key = (tile.crs.to_string(), tuple(tile.affine), tile.shape)
+        with _warp_grids_lock:
+            if key in self._warp_grids:
+                return self._warp_grids[key]
+        pyramid = self.config.process_pyramid
+        xs, ys = raster.tile_coordinates(tile, pyramid.crs)
+        warp_grid = None
+        if not np.isnan(xs).all():
+            # use lowest process zoom level at least as fine as the tile
+            resolution = np.nanmedian(np.abs(np.diff(xs, axis=-1)))
+            zoom = next((
+                z for z in range(max(self.config.zoom_levels) + 1)
+                if pyramid.pixel_x_size(z) <= resolution * (1 + 1e-6)
+            ), None)
+            if zoom in self.config.zoom_levels:
+                half_pixel = pyramid.pixel_x_size(zoom) / 2
+                bounds = (
+                    max(np.nanmin(xs) - half_pixel, pyramid.left),
+                    max(np.nanmin(ys) - half_pixel, pyramid.bottom),
+                    min(np.nanmax(xs) + half_pixel, pyramid.right),
+                    min(np.nanmax(ys) + half_pixel, pyramid.top)
+                )
+                if bounds[0] < bounds[2] and bounds[1] < bounds[3]:
+                    warp_grid = _WarpGrid(zoom, bounds, (xs, ys))
+        with _warp_grids_lock:
+            self._warp_grids[key] = warp_grid
+        return warp_grid
+
     def _process_and_overwrite_output(self, tile, process_tile):
         if self.with_cache:
             output = self._execute_using_cache(process_tile)
@@ -421,8 +594,32 @@ class Mapchete(object):
                 self.read(output_tile) for output_tile in output_tiles
             ]))
 
+    def _extract_from_process_tiles(self, process_tiles, tile):
+        if self.config.output.METADATA["data_type"] == "raster":
+            nodata = self.config.output.nodata
+            dtype = self.config.output.output_params["dtype"]
+            mosaic = raster.create_mosaic([
+                (
+                    process_tile,
+                    raster.prepare_array(
+                        self._execute_using_cache(process_tile),
+                        nodata=nodata, dtype=dtype)
+                )
+                for process_tile in process_tiles
+            ], nodata=nodata)
+            return raster.extract_from_array(mosaic, out_tile=tile)
+        elif self.config.output.METADATA["data_type"] == "vector":
+            return list(chain.from_iterable([
+                self._extract(
+                    in_tile=process_tile,
+                    in_data=self._execute_using_cache(process_tile),
+                    out_tile=tile)
+                for process_tile in process_tiles
+            ]))
+
     def _execute_using_cache(self, process_tile):
-        # Extract Tile subset from process Tile and return.
+        # Look up output in memory and, if configured, on disk before
+        # executing process tile.
         try:
             return self.process_tile_cache[process_tile.id]
         except KeyError:
@@ -434,14 +631,21 @@ class Mapchete(object):
             # Wait and return.
             if process_event:
                 process_event.wait()
-                return self.process_tile_cache[process_tile.id]
+                if process_tile.id in self.process_tile_cache:
+                    return self.process_tile_cache[process_tile.id]
+                # output was not cached or already evicted
+                return self._execute_using_cache(process_tile)
             else:
                 try:
-                    output = self.execute(process_tile)
-                    self.process_tile_cache[process_tile.id] = output
-                    if self.config.mode in ["continue", "overwrite"]:
-                        self.write(process_tile, output)
-                    return self.process_tile_cache[process_tile.id]
+                    # wait for other processes sharing the disk cache
+                    with self.process_tile_cache.lock(process_tile.id):
+                        if process_tile.id in self.process_tile_cache:
+                            return self.process_tile_cache[process_tile.id]
+                        output = (self.executor or self.execute)(process_tile)
+                        self.process_tile_cache[process_tile.id] = output
+                        if self.config.mode in ["continue", "overwrite"]:
+                            self.write(process_tile, output)
+                        return output
                 finally:
                     with self.process_lock:
                         process_event = self.current_processes.get(
@@ -548,9 +752,7 @@ class Mapchete(object):
         if baselevel == "higher":
             parent_tile = tile.get_parent()
             process_data = raster.resample_from_array(
-                in_raster=self.get_raw_output(
-                    parent_tile, _baselevel_readonly=True
-                ),
+                in_raster=self._read_baselevel_source(parent_tile),
                 in_affine=parent_tile.affine,
                 out_tile=tile,
                 resampling=self.config.baselevels["higher"],
@@ -558,16 +760,9 @@ class Mapchete(object):
             )
         # resample from children tiles
         elif baselevel == "lower":
-            mosaic, mosaic_affine = raster.create_mosaic([
-                (
-                    child_tile,
-                    self.get_raw_output(child_tile, _baselevel_readonly=True)
-                )
-                for child_tile in self.config.baselevels["tile_pyramid"].tile(
-                    *tile.id
-                ).get_children()
-            ])
-            process_data = raster.resample_from_array(
+            mosaic, mosaic_affine = raster.create_mosaic(
+                self._get_baselevel_children(tile))
+            process_data = raster.downsample_from_array(
                 in_raster=mosaic,
                 in_affine=mosaic_affine,
                 out_tile=tile,
@@ -578,6 +773,93 @@ class Mapchete(object):
         logger.debug((tile.id, "generated from baselevel", elapsed))
         return process_data
 
+    def _keep_baselevel_child(self, process_tile, data):
+        """Keep written output in memory if a lower zoom is built from it."""
+        zoom = process_tile.zoom
+        if not (
+            _keep_baselevel_children and
+            self.config.baselevels and
+            self.config.output.METADATA["data_type"] == "raster" and
+            zoom - 1 in self.config.zoom_levels and
+            zoom - 1 < min(self.config.baselevels["zooms"]) and
+            self.config.process_pyramid.pixelbuffer >=
+            self.config.output.pixelbuffer and
+            (data is None or isinstance(data, np.ndarray))
+        ):
+            return
+        if data is not None:
+            child_tile = self.config.baselevels["tile_pyramid"].tile(
+                *process_tile.id)
+            data = raster.prepare_array(
+                self._extract(
+                    in_tile=process_tile, in_data=data, out_tile=child_tile),
+                nodata=self.config.output.nodata,
+                dtype=self.config.output.output_params["dtype"])
+        with _baselevel_children_lock:
+            try:
+                _baselevel_children[self._baselevel_key(process_tile)] = data
+            except ValueError:
+                # too large to be kept
+                pass
+
+    def _get_baselevel_children(self, tile):
+        """
+        Return child tiles and their output.
+
+        Output written by this process before is taken from memory, other
+        children are read from the output.
+        """
+        children = self.config.baselevels["tile_pyramid"].tile(
+            *tile.id).get_children()
+        with _baselevel_children_lock:
+            cached = {
+                child.id: _baselevel_children.pop(self._baselevel_key(child))
+                for child in children
+                if self._baselevel_key(child) in _baselevel_children
+            }
+        for child in children:
+            if child.id in cached:
+                empty = self.config.output.empty(child)
+                if cached[child.id] is None:
+                    cached[child.id] = empty
+                # output format stores data differently than processed
+                elif cached[child.id].shape != empty.shape:
+                    cached = {}
+                    break
+        if cached:
+            logger.debug((tile.id, "%s children in memory" % len(cached)))
+        return [
+            (
+                child,
+                cached[child.id] if child.id in cached else
+                self._read_baselevel_source(child)
+            )
+            for child in children
+        ]
+
+    def _read_baselevel_source(self, tile):
+        """
+        Return existing output of a tile used to interpolate from baselevels.
+
+        Decoded output is cached per process by output path and tile index,
+        so e.g. a parent tile is only read once for all of its children.
+        """
+        key = self._baselevel_key(tile)
+        with _baselevel_sources_lock:
+            if key in _baselevel_sources:
+                return _baselevel_sources[key]
+        data = self.get_raw_output(tile, _baselevel_readonly=True)
+        with _baselevel_sources_lock:
+            try:
+                _baselevel_sources[key] = data
+            except ValueError:
+                # too large to be kept
+                pass
+        return data
+
+    def _baselevel_key(self, tile):
+        return (getattr(self.config.output, "path", None), tile.id)
+
     def __enter__(self):
         """Enable context manager."""
         return self
@@ -588,6 +870,10 @@ class Mapchete(object):
             if ip is not None:
                 ip.cleanup()
         if self.with_cache:
+            logger.debug(
+                "process tile cache statistics: %s",
+                self.process_tile_cache.stats())
+            self.process_tile_cache.close()
             self.process_tile_cache = None
             self.current_processes = None
             self.process_lock = None
@@ -719,9 +1005,78 @@ class MapcheteProcess(object):
         -------
         hillshade : array
         """
+        # commons modules are imported on demand as some of them are
+        # expensive to import (e.g. matplotlib for contours)
+        from mapchete.commons import hillshade as commons_hillshade
         return commons_hillshade.hillshade(
             elevation, self, azimuth, altitude, z, scale)
 
+    def hillshades(
+        self, elevation, azimuths=(315.0, ), altitude=45.0, z=1.0, scale=1.0
+    ):
+        """
+        Calculate hillshadings lit from multiple directions.
+
+        Slope and aspect are only calculated once for all light sources.
+
+        Parameters
+        ----------
+        elevation : array
+            input elevation data
+        azimuths : list
+            horizontal angles of light sources
+        altitude : float
+            vertical angle of light sources
+        z : float
+            vertical exaggeration factor
+        scale : float
+            scale factor of pixel size units versus height units (insert 112000
+            when having elevation values in meters in a geodetic projection)
+
+        Returns
+        -------
+        hillshades : list
+            one array per azimuth
+        """
+        from mapchete.commons import hillshade as commons_hillshade
+        return commons_hillshade.hillshades(
+            elevation, self, azimuths=azimuths, altitude=altitude, z=z,
+            scale=scale)
+
+    def multidirectional_hillshade(
+        self, elevation, azimuths=(225.0, 270.0, 315.0, 360.0), weights=None,
+        altitude=45.0, z=1.0, scale=1.0
+    ):
+        """
+        Calculate weighted blend of hillshadings from multiple directions.
+
+        Slope and aspect are only calculated once for all light sources.
+
+        Parameters
+        ----------
+        elevation : array
+            input elevation data
+        azimuths : list
+            horizontal angles of light sources
+        weights : list
+            weight per light source (default: equal weights)
+        altitude : float
+            vertical angle of light sources
+        z : float
+            vertical exaggeration factor
+        scale : float
+            scale factor of pixel size units versus height units (insert 112000
+            when having elevation values in meters in a geodetic projection)
+
+        Returns
+        -------
+        hillshade : array
+        """
+        from mapchete.commons import hillshade as commons_hillshade
+        return commons_hillshade.multidirectional_hillshade(
+            elevation, self, azimuths=azimuths, weights=weights,
+            altitude=altitude, z=z, scale=scale)
+
     def contours(
         self, elevation, interval=100, field='elev', base=0
     ):
@@ -744,9 +1099,82 @@ class MapcheteProcess(object):
         contours : iterable
             contours as GeoJSON-like pairs of properties and geometry
         """
+        from mapchete.commons import contours as commons_contours
         return commons_contours.extract_contours(
             elevation, self.tile, interval=interval, field=field, base=base)
 
+    def focal(self, array, operation="mean", size=3):
+        """
+        Apply neighbourhood operation on array.
+
+        Masked pixels are ignored. Pixels at the array border only use the part
+        of the window within the array. If the process pixelbuffer is at least
+        half the window size (size // 2), these pixels lie within the buffer
+        and results are seamless across tiles. Otherwise the outermost
+        size // 2 - pixelbuffer pixels of the tile differ from neighbouring
+        tiles and a warning is logged.
+
+        Parameters
+        ----------
+        array : array
+            2D or 3D input data
+        operation : string
+            one of "mean", "median", "min" (erosion), "max" (dilation) or
+            "tpi" (topographic position index)
+        size : integer
+            window size in pixels (odd)
+
+        Returns
+        -------
+        result : array
+        """
+        from mapchete.commons import focal as commons_focal
+        operations = dict(
+            mean=commons_focal.focal_mean,
+            median=commons_focal.focal_median,
+            min=commons_focal.focal_min,
+            max=commons_focal.focal_max,
+            tpi=commons_focal.tpi
+        )
+        if operation not in operations:
+            raise ValueError(
+                "operation must be one of %s" % ", ".join(sorted(operations)))
+        self._check_focal_pixelbuffer(size // 2)
+        return operations[operation](array, size=size)
+
+    def slope(self, elevation, z=1.0, scale=1.0):
+        """
+        Calculate slope in degrees from elevation data.
+
+        The slope of the outermost pixels is copied from their inner
+        neighbours. If the process pixelbuffer is 0, these pixels differ from
+        neighbouring tiles and a warning is logged.
+
+        Parameters
+        ----------
+        elevation : array
+            input elevation data
+        z : float
+            vertical exaggeration factor
+        scale : float
+            scale factor of pixel size units versus height units (insert 112000
+            when having elevation values in meters in a geodetic projection)
+
+        Returns
+        -------
+        slope : array
+        """
+        from mapchete.commons import focal as commons_focal
+        self._check_focal_pixelbuffer(1)
+        return commons_focal.slope(elevation, self.tile, z=z, scale=scale)
+
+    def _check_focal_pixelbuffer(self, radius):
+        if self.tile.pixelbuffer < radius:
+            logger.warning(
+                "pixelbuffer %s smaller than focal window radius %s, results "
+                "will differ along tile borders", self.tile.pixelbuffer,
+                radius)
+
     def clip(
         self, array, geometries, inverted=False, clip_buffer=0
     ):
@@ -757,17 +1185,28 @@ class MapcheteProcess(object):
         ----------
         array : array
             raster data to be clipped
-        geometries : iterable
-            geometries used to clip source array
+        geometries : iterable or ``VectorClipper``
+            geometries used to clip source array; for geometries used on
+            many tiles, a ``mapchete.commons.clip.VectorClipper`` prepares
+            them once and caches masks per tile
         inverted : bool
             invert clipping (default: False)
         clip_buffer : int
-            buffer (in pixels) geometries before applying clip
+            buffer (in pixels) geometries before applying clip; not available
+            for ``VectorClipper``
 
         Returns
         -------
         clipped array : array
         """
+        from mapchete.commons import clip as commons_clip
+        if isinstance(geometries, commons_clip.VectorClipper):
+            if clip_buffer:
+                raise ValueError(
+                    "clip_buffer has to be set when creating VectorClipper")
+            return geometries.clip(
+                array, self.tile.affine, inverted=inverted,
+                cache_key=self.tile.id)
         return commons_clip.clip_array_with_vector(
             array, self.tile.affine, geometries,
             inverted=inverted, clip_buffer=clip_buffer*self.tile.pixel_x_size)
@@ -847,22 +1286,40 @@ def _run_on_single_tile(process, tile):
     return dict(process_tile=tile, **message)
 
 
-def _run_with_multiprocessing(process, zoom_levels, multi, max_chunksize):
+def _run_with_multiprocessing(
+    process, zoom_levels, multi, max_chunksize, prefetch=False
+):
     logger.debug("run with multiprocessing")
     num_processed = 0
     total_tiles = process.count_tiles(min(zoom_levels), max(zoom_levels))
     logger.debug(
         "run process on %s tiles using %s workers", total_tiles, multi)
-    f = partial(_process_worker, process)
+    if prefetch:
+        # a chunk of tiles is one task, so the worker knows its next tiles
+        f = partial(_process_chunk_worker, process)
+        if max_chunksize <= PREFETCH_TILES:
+            logger.debug(
+                "queue %s instead of %s tiles per worker to prefetch input",
+                PREFETCH_TILES + 1, max_chunksize)
+            max_chunksize = PREFETCH_TILES + 1
+    else:
+        f = partial(_process_worker, process)
     for zoom in zoom_levels:
-        pool = Pool(multi, _worker_sigint_handler)
+        # workers end before the next zoom level is built from their output
+        pool = Pool(multi, _worker_initializer, (False, ))
         try:
-            for tile, message in pool.imap_unordered(
-                f,
-                process.get_process_tiles(zoom),
-                # set chunksize to between 1 and max_chunksize
-                chunksize=max_chunksize
-            ):
+            if prefetch:
+                results = chain.from_iterable(pool.imap_unordered(
+                    f, _chunks(process.get_process_tiles(zoom), max_chunksize)
+                ))
+            else:
+                results = pool.imap_unordered(
+                    f,
+                    process.get_process_tiles(zoom),
+                    # set chunksize to between 1 and max_chunksize
+                    chunksize=max_chunksize
+                )
+            for tile, message in results:
                 num_processed += 1
                 logger.debug("tile %s/%s finished", num_processed, total_tiles)
                 yield dict(process_tile=tile, **message)
@@ -879,13 +1336,16 @@ def _run_with_multiprocessing(process, zoom_levels, multi, max_chunksize):
     logger.debug("%s tile(s) iterated", (str(num_processed)))
 
 
-def _run_without_multiprocessing(process, zoom_levels):
+def _run_without_multiprocessing(process, zoom_levels, prefetch=False):
     logger.debug("run without multiprocessing")
     num_processed = 0
     total_tiles = process.count_tiles(min(zoom_levels), max(zoom_levels))
     logger.debug("run process on %s tiles using 1 worker", total_tiles)
     for zoom in zoom_levels:
-        for process_tile in process.get_process_tiles(zoom):
+        process_tiles = process.get_process_tiles(zoom)
+        if prefetch:
+            process_tiles = prefetched(process, process_tiles)
+        for process_tile in process_tiles:
             tile, message = _process_worker(process, process_tile)
             num_processed += 1
             logger.debug("tile %s/%s finished", num_processed, total_tiles)
@@ -893,6 +1353,130 @@ def _run_without_multiprocessing(process, zoom_levels):
     logger.debug("%s tile(s) iterated", (str(num_processed)))
 
 
+def _run_subtrees(process, zoom_levels, multi, prefetch=False):
+    logger.debug("run subtrees")
+    num_processed = 0
+    total_tiles = process.count_tiles(min(zoom_levels), max(zoom_levels))
+    zoom_levels = sorted(zoom_levels)
+    # use lowest zoom level providing enough subtrees for all workers
+    root_zoom = next((
+        zoom for zoom in zoom_levels
+        if process.count_tiles(zoom, zoom) >= multi * SUBTREES_PER_WORKER
+    ), max(zoom_levels))
+    logger.debug(
+        "run process on %s tiles in subtrees from zoom %s to %s using %s "
+        "workers", total_tiles, root_zoom, max(zoom_levels), multi)
+    roots = process.get_process_tiles(root_zoom)
+    if multi > 1:
+        # workers report each tile as soon as it is processed instead of
+        # returning all results after the whole subtree
+        manager = Manager()
+        results = manager.Queue()
+        pool = Pool(multi, _worker_initializer)
+        try:
+            subtrees = pool.map_async(
+                partial(
+                    _subtree_worker, process, max(zoom_levels), prefetch,
+                    results
+                ),
+                roots,
+                chunksize=1
+            )
+            while True:
+                done = subtrees.ready()
+                try:
+                    tile, message = results.get(timeout=0.1)
+                except queue.Empty:
+                    if done:
+                        break
+                    continue
+                num_processed += 1
+                logger.debug(
+                    "tile %s/%s finished", num_processed, total_tiles)
+                yield dict(process_tile=tile, **message)
+            # raise exception of failed subtree after reporting finished tiles
+            subtrees.get()
+        except KeyboardInterrupt:
+            logger.error("Caught KeyboardInterrupt, terminating workers")
+            pool.terminate()
+            raise
+        except Exception:
+            pool.terminate()
+            raise
+        finally:
+            pool.close()
+            pool.join()
+            manager.shutdown()
+    else:
+        for root in roots:
+            for tile, message in _process_subtree(
+                process, max(zoom_levels), prefetch, root
+            ):
+                num_processed += 1
+                logger.debug("tile %s/%s finished", num_processed, total_tiles)
+                yield dict(process_tile=tile, **message)
+    # zoom levels above the subtrees are processed per zoom level
+    lower_zoom_levels = [
+        zoom for zoom in reversed(zoom_levels) if zoom < root_zoom]
+    if lower_zoom_levels:
+        if multi > 1:
+            results = _run_with_multiprocessing(
+                process, lower_zoom_levels, multi, 1, prefetch)
+        else:
+            results = _run_without_multiprocessing(
+                process, lower_zoom_levels, prefetch)
+        for result in results:
+            yield result
+
+
+def _subtree_worker(process, max_zoom, prefetch, results, root):
+    """Process subtree and put result of each tile into results queue."""
+    for result in _process_subtree(process, max_zoom, prefetch, root):
+        results.put(result)
+
+
+def _process_subtree(process, max_zoom, prefetch, root):
+    """Process tile and all of its descendants, children first."""
+    areas = {}
+
+    def _descendants(tile):
+        if tile.zoom < max_zoom:
+            zoom = tile.zoom + 1
+            if zoom not in areas:
+                areas[zoom] = prep(process.config.area_at_zoom(zoom))
+            for child in tile.get_children():
+                if areas[zoom].intersects(
+                    process.config.process_pyramid.tile_pyramid.tile(
+                        *child.id).bbox()
+                ):
+                    for descendant in _descendants(child):
+                        yield descendant
+        yield tile
+
+    process_tiles = _descendants(root)
+    if prefetch:
+        process_tiles = prefetched(process, process_tiles)
+    for process_tile in process_tiles:
+        yield _process_worker(process, process_tile)
+
+
+def _process_chunk_worker(process, process_tiles):
+    """Process tiles while reading input of the next tiles in advance."""
+    return [
+        _process_worker(process, process_tile)
+        for process_tile in prefetched(process, process_tiles)
+    ]
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
 def _get_zoom_level(zoom, process):
     """Determine zoom levels."""
     if zoom is None:
@@ -936,3 +1520,16 @@ def _process_worker(process, process_tile):
 def _worker_sigint_handler():
     # ignore SIGINT and let everything be handled by parent process
     signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _worker_initializer(keep_baselevel_children=True):
+    _worker_sigint_handler()
+    # do not use output cached by the parent process before forking
+    global _baselevel_children, _baselevel_sources, _keep_baselevel_children
+    with _baselevel_children_lock:
+        _baselevel_children = LRUCache(
+            maxsize=BASELEVEL_CHILDREN_MAX_BYTES, getsizeof=_nbytes)
+        _keep_baselevel_children = keep_baselevel_children
+    with _baselevel_sources_lock:
+        _baselevel_sources = LRUCache(
+            maxsize=BASELEVEL_SOURCES_MAX_BYTES, getsizeof=_nbytes)
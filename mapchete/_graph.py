@@ -0,0 +1,260 @@
+"""Execute multiple chained processes using one worker pool."""
+
+from collections import defaultdict
+import logging
+from multiprocessing import cpu_count
+from multiprocessing.pool import Pool
+import os
+from six.moves import queue
+import threading
+
+from mapchete._core import _process_worker, _worker_initializer
+from mapchete.errors import MapcheteConfigError
+from mapchete.formats.default import mapchete_input
+
+logger = logging.getLogger(__name__)
+
+# sorts after all tile priorities and stops the task generator
+_DONE = (float("inf"), )
+
+
+class ProcessGraph(object):
+    """
+    Tile dependency graph of multiple processes.
+
+    Processes can be chained by using the output of one process as
+    ``Mapchete`` input of another process. Instead of running each process
+    over the whole area one after another, all process tiles are scheduled on
+    one worker pool. A process tile is executed as soon as all tiles it
+    depends on are processed, i.e. the intersecting tiles of all input
+    processes which are part of the graph and, if baselevels are configured,
+    the tiles of the same process from which its output is interpolated.
+
+    Parameters
+    ----------
+    processes : list
+        ``Mapchete`` objects opened in ``continue`` or ``overwrite`` mode
+
+    Attributes
+    ----------
+    processes : list
+        ``Mapchete`` objects
+    process_names : list
+        names of processes derived from their Mapchete files
+    dependencies : dictionary
+        mapping of (process index, tile index) to the set of process tiles
+        which have to be processed before
+    """
+
+    def __init__(self, processes):
+        """Initialize graph."""
+        if not processes:
+            raise ValueError("no processes given")
+        for process in processes:
+            if process.config.mode not in ["continue", "overwrite"]:
+                raise ValueError(
+                    "process mode must be continue or overwrite")
+        self.processes = list(processes)
+        self.process_names = [_process_name(p) for p in self.processes]
+        self._tiles = {}
+        self._order = []
+        self._upstream = _upstream_processes(self.processes)
+        self._depth = _process_depths(self._upstream)
+        logger.debug("collect process tiles")
+        for index, process in enumerate(self.processes):
+            for tile in process.get_process_tiles():
+                self._tiles[(index, tile.id)] = tile
+                self._order.append((index, tile.id))
+        logger.debug("determine tile dependencies")
+        self.dependencies = {
+            node: self._tile_dependencies(node) for node in self._order
+        }
+
+    def batch_process(self, multi=cpu_count()):
+        """
+        Process all tiles of all processes.
+
+        Parameters
+        ----------
+        multi : int
+            number of workers (default: number of CPU cores)
+        """
+        list(self.batch_processor(multi=multi))
+
+    def batch_processor(self, multi=cpu_count()):
+        """
+        Process all tiles of all processes and yield report messages per tile.
+
+        Parameters
+        ----------
+        multi : int
+            number of workers (default: number of CPU cores)
+        """
+        remaining = {
+            node: len(dependencies)
+            for node, dependencies in self.dependencies.items()
+        }
+        dependents = defaultdict(list)
+        for node, dependencies in self.dependencies.items():
+            for dependency in dependencies:
+                dependents[dependency].append(node)
+        positions = {node: i for i, node in enumerate(self._order)}
+        # tiles of downstream processes are preferred when ready, so their
+        # input tiles do not have to wait for the whole upstream area
+        ready = queue.PriorityQueue()
+        for node in self._order:
+            if not remaining[node]:
+                ready.put(self._priority(node, positions[node]))
+
+        def _release(node):
+            for dependent in dependents.pop(node, []):
+                remaining[dependent] -= 1
+                if not remaining[dependent]:
+                    ready.put(self._priority(dependent, positions[dependent]))
+
+        num_processed = 0
+        total_tiles = len(self._order)
+        logger.debug(
+            "run %s processes on %s tiles using %s workers",
+            len(self.processes), total_tiles, multi)
+        if multi == 1:
+            while not ready.empty():
+                node = ready.get()[-1]
+                tile, message = _process_worker(
+                    self.processes[node[0]], self._tiles[node])
+                num_processed += 1
+                logger.debug("tile %s/%s finished", num_processed, total_tiles)
+                _release(node)
+                yield self._result(node, tile, message)
+        elif total_tiles:
+            # limit number of scheduled tasks so tiles getting ready later
+            # can still be preferred
+            slots = threading.Semaphore(multi * 2)
+
+            def _tasks():
+                while True:
+                    slots.acquire()
+                    item = ready.get()
+                    if item == _DONE:
+                        return
+                    node = item[-1]
+                    yield node, self.processes[node[0]], self._tiles[node]
+
+            pool = Pool(multi, _worker_initializer)
+            finished = False
+            try:
+                for node, (tile, message) in pool.imap_unordered(
+                    _graph_worker, _tasks()
+                ):
+                    slots.release()
+                    num_processed += 1
+                    logger.debug(
+                        "tile %s/%s finished", num_processed, total_tiles)
+                    _release(node)
+                    if num_processed == total_tiles:
+                        ready.put(_DONE)
+                    yield self._result(node, tile, message)
+                finished = True
+            except KeyboardInterrupt:
+                logger.error("Caught KeyboardInterrupt, terminating workers")
+                raise
+            finally:
+                if not finished:
+                    # unblock task generator before terminating workers
+                    ready.put(_DONE)
+                    slots.release()
+                    pool.terminate()
+                pool.close()
+                pool.join()
+        if num_processed != total_tiles:
+            raise RuntimeError("not all tiles could be scheduled")
+        logger.debug("%s tile(s) iterated", (str(num_processed)))
+
+    def _tile_dependencies(self, node):
+        index, tile_id = node
+        tile = self._tiles[node]
+        process = self.processes[index]
+        dependencies = set()
+        # tiles of input processes intersecting with the process tile
+        for upstream_index in self._upstream[index]:
+            upstream = self.processes[upstream_index]
+            if tile.zoom not in upstream.config.init_zoom_levels:
+                continue
+            for upstream_tile in upstream.config.process_pyramid.tiles_from_bounds(
+                tile.bounds, tile.zoom
+            ):
+                if (upstream_index, upstream_tile.id) in self._tiles:
+                    dependencies.add((upstream_index, upstream_tile.id))
+        # tiles the process tile gets interpolated from
+        baselevels = process.config.baselevels
+        if baselevels:
+            if tile.zoom < min(baselevels["zooms"]):
+                source_tiles = tile.get_children()
+            elif tile.zoom > max(baselevels["zooms"]):
+                source_tiles = [tile.get_parent()]
+            else:
+                source_tiles = []
+            for source_tile in source_tiles:
+                if (index, source_tile.id) in self._tiles:
+                    dependencies.add((index, source_tile.id))
+        return dependencies
+
+    def _priority(self, node, position):
+        return (-self._depth[node[0]], position, node)
+
+    def _result(self, node, tile, message):
+        return dict(
+            process_name=self.process_names[node[0]], process_tile=tile,
+            **message)
+
+
+def _graph_worker(task):
+    """Worker function processing one tile of the graph."""
+    node, process, process_tile = task
+    return node, _process_worker(process, process_tile)
+
+
+def _process_name(process):
+    mapchete_file = process.config._raw.get("mapchete_file")
+    if mapchete_file:
+        return os.path.splitext(os.path.basename(mapchete_file))[0]
+    return process.process_name
+
+
+def _upstream_processes(processes):
+    """Return indexes of input processes for every process."""
+    paths = {
+        os.path.realpath(p.config._raw["mapchete_file"]): index
+        for index, p in enumerate(processes)
+        if p.config._raw.get("mapchete_file")
+    }
+    upstream = []
+    for process in processes:
+        indexes = set()
+        for reader in process.config.input.values():
+            # input processes in memory mode are run within the worker
+            if isinstance(reader, mapchete_input.InputData) and (
+                reader.mode == "readonly"
+            ):
+                indexes.add(paths.get(os.path.realpath(reader.path)))
+        indexes.discard(None)
+        upstream.append(indexes)
+    return upstream
+
+
+def _process_depths(upstream):
+    """Return number of preceding processes in chain for every process."""
+    depths = {}
+
+    def _depth(index, visited):
+        if index in visited:
+            raise MapcheteConfigError("processes depend on each other")
+        if index not in depths:
+            depths[index] = max(
+                [_depth(i, visited | {index}) + 1 for i in upstream[index]] +
+                [0])
+        return depths[index]
+
+    for index in range(len(upstream)):
+        _depth(index, set())
+    return depths
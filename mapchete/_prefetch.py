@@ -0,0 +1,218 @@
+"""Read input of upcoming process tiles in a background thread."""
+
+from collections import OrderedDict
+from itertools import islice
+import logging
+from six.moves import queue
+import threading
+
+from mapchete.config import _flatten_tree
+
+logger = logging.getLogger(__name__)
+
+# number of process tiles read in advance
+PREFETCH_TILES = 2
+
+
+class PrefetchStore(object):
+    """
+    Thread-safe store of input data read in advance.
+
+    Input drivers add data using ``add()`` from the prefetching thread and take
+    it using ``get()`` when a tile is actually read. Data not taken is dropped
+    after ``maxsize`` newer entries. The store is emptied when pickled.
+
+    Parameters
+    ----------
+    maxsize : integer
+        maximum number of entries kept
+    """
+
+    def __init__(self, maxsize=PREFETCH_TILES * 2):
+        """Initialize."""
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self._pending = {}
+
+    def add(self, key, func):
+        """
+        Store result of function under key unless already stored.
+
+        Errors are only logged, as reading the data again when it is requested
+        will raise them properly.
+
+        Parameters
+        ----------
+        key : hashable
+            key used to get the data
+        func : callable
+            function returning the data
+        """
+        with self._lock:
+            if key in self._data or key in self._pending:
+                return
+            event = self._pending[key] = threading.Event()
+        try:
+            self._store(key, func())
+        except Exception as e:
+            logger.debug("prefetching %s failed: %s", key, e)
+        finally:
+            with self._lock:
+                del self._pending[key]
+            event.set()
+
+    def _store(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get(self, key, func):
+        """
+        Return and remove stored data or return result of function.
+
+        If the data is currently being read, wait for it.
+
+        Parameters
+        ----------
+        key : hashable
+            key used to store the data
+        func : callable
+            function returning the data if it was not stored
+
+        Returns
+        -------
+        data
+        """
+        with self._lock:
+            event = self._pending.get(key)
+        if event is not None:
+            event.wait()
+        with self._lock:
+            if key in self._data:
+                logger.debug("use prefetched %s", key)
+                return self._data.pop(key)
+        return func()
+
+    def __len__(self):
+        """Return number of stored entries."""
+        with self._lock:
+            return len(self._data)
+
+    def __getstate__(self):
+        """Drop stored data and locks when pickled."""
+        return dict(maxsize=self.maxsize)
+
+    def __setstate__(self, state):
+        """Initialize empty store when unpickled."""
+        self.__init__(**state)
+
+
+class InputPrefetcher(object):
+    """
+    Read input of process tiles in a background thread.
+
+    Calls ``prefetch()`` of all inputs active at the tile zoom level. Tiles
+    interpolated from baselevels do not read input and are skipped, as well as
+    existing tiles in ``continue`` mode, which are not processed again.
+
+    Parameters
+    ----------
+    config : ``MapcheteConfig``
+        process configuration
+    """
+
+    def __init__(self, config):
+        """Start background thread."""
+        self.config = config
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add(self, process_tile):
+        """
+        Queue process tile to be read in advance.
+
+        Parameters
+        ----------
+        process_tile : ``BufferedTile``
+            process tile
+        """
+        self._queue.put(process_tile)
+
+    def close(self):
+        """Stop background thread after queued tiles are read."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            process_tile = self._queue.get()
+            if process_tile is None:
+                return
+            for input_data in self._inputs(process_tile):
+                try:
+                    input_data.prefetch(process_tile)
+                except Exception as e:
+                    logger.debug(
+                        (process_tile.id, "prefetching input failed", e))
+
+    def _inputs(self, process_tile):
+        baselevels = self.config.baselevels
+        if baselevels and not (
+            min(baselevels["zooms"]) <= process_tile.zoom <=
+            max(baselevels["zooms"])
+        ):
+            return []
+        if self.config.mode == "continue" and (
+            self.config.output.tiles_exist(process_tile)
+        ):
+            return []
+        params = self.config.params_at_zoom(process_tile.zoom)
+        return [v for _, v in _flatten_tree(params["input"]) if v is not None]
+
+    def __enter__(self):
+        """Enable context manager."""
+        return self
+
+    def __exit__(self, t, v, tb):
+        """Stop background thread."""
+        self.close()
+
+
+def prefetched(process, process_tiles):
+    """
+    Yield process tiles while input of the next tiles is read in advance.
+
+    Reading starts after the first tile was processed, so input drivers can
+    read upcoming tiles the same way.
+
+    Parameters
+    ----------
+    process : ``Mapchete``
+        process
+    process_tiles : iterable
+        process tiles in processing order
+
+    Yields
+    ------
+    process tile : ``BufferedTile``
+    """
+    upcoming = []
+    process_tiles = iter(process_tiles)
+    with InputPrefetcher(process.config) as prefetcher:
+        while True:
+            if not upcoming:
+                try:
+                    upcoming.append(next(process_tiles))
+                except StopIteration:
+                    return
+            yield upcoming.pop(0)
+            # inputs know how they are read after the first tile was processed
+            for process_tile in islice(
+                process_tiles, PREFETCH_TILES - len(upcoming)
+            ):
+                prefetcher.add(process_tile)
+                upcoming.append(process_tile)
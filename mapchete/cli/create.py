@@ -4,7 +4,6 @@ import os
 from string import Template
 from shutil import copyfile
 from yaml import dump
-import pkg_resources
 
 FORMAT_MANDATORY = {
     "GTiff": {
@@ -52,6 +51,7 @@ def create_empty_process(args):
     ----------
     args : argparse.Namespace
     """
+    import pkg_resources
     if os.path.isfile(args.process_file) or os.path.isfile(args.mapchete_file):
         if not args.force:
             raise IOError("file(s) already exists")
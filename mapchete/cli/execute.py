@@ -9,6 +9,7 @@ import tqdm
 import yaml
 
 import mapchete
+from mapchete._graph import ProcessGraph
 from mapchete.config import get_zoom_levels, _map_to_new_config
 from mapchete.tile import BufferedTilePyramid
 
@@ -45,10 +46,11 @@ def main(args=None):
         stream_handler.setLevel(logging.DEBUG)
 
     tqdm.tqdm.write("preparing process", file=verbose_dst)
+    mapchete_file = parsed.mapchete_files[0]
 
     def _raw_conf():
         return _map_to_new_config(
-            yaml.load(open(parsed.mapchete_file, "r").read())
+            yaml.load(open(mapchete_file, "r").read())
         )
 
     def _tp():
@@ -58,11 +60,30 @@ def main(args=None):
             pixelbuffer=_raw_conf()["pyramid"].get("pixelbuffer", 0)
         )
 
+    if len(parsed.mapchete_files) > 1:
+        # these options refer to the pyramid, zoom levels or input of a single
+        # process or are not supported when processing a process graph
+        single_process_options = [
+            option for option, used in [
+                ("--tile", parsed.tile),
+                ("--point", parsed.point),
+                ("--input_file", parsed.input_file),
+                ("--max_chunksize", parsed.max_chunksize != 1),
+                ("--subtrees", parsed.subtrees),
+                ("--prefetch_input", parsed.prefetch_input)
+            ]
+            if used
+        ]
+        if single_process_options:
+            raise ValueError(
+                "%s can only be used with one process" % ", ".join(
+                    single_process_options))
+
     # process single tile
     if parsed.tile:
         tile = _tp().tile(*parsed.tile)
         with mapchete.open(
-            parsed.mapchete_file, mode=mode, bounds=tile.bounds,
+            mapchete_file, mode=mode, bounds=tile.bounds,
             zoom=tile.zoom, single_input_file=parsed.input_file
         ) as mp:
             tqdm.tqdm.write("processing 1 tile", file=verbose_dst)
@@ -83,31 +104,61 @@ def main(args=None):
             bounds = _tp().tile_from_xy(x, y, max(zoom_levels)).bounds
         else:
             bounds = parsed.bounds
-        with mapchete.open(
-            parsed.mapchete_file, bounds=bounds, zoom=parsed.zoom,
-            mode=mode, single_input_file=parsed.input_file
-        ) as mp:
-            tiles_count = mp.count_tiles(
-                min(mp.config.init_zoom_levels),
-                max(mp.config.init_zoom_levels))
-            tqdm.tqdm.write("processing %s tile(s) on %s worker(s)" % (
-                tiles_count, multi
-            ), file=verbose_dst)
-            for result in tqdm.tqdm(
-                mp.batch_processor(
-                    multi=multi, zoom=parsed.zoom,
-                    max_chunksize=parsed.max_chunksize),
-                total=tiles_count,
-                unit="tile",
-                disable=parsed.debug or parsed.no_pbar
-            ):
-                _write_verbose_msg(result, dst=verbose_dst)
+        if len(parsed.mapchete_files) > 1:
+            _run_graph(parsed, bounds, mode, multi, verbose_dst)
+        else:
+            with mapchete.open(
+                mapchete_file, bounds=bounds, zoom=parsed.zoom,
+                mode=mode, single_input_file=parsed.input_file
+            ) as mp:
+                tiles_count = mp.count_tiles(
+                    min(mp.config.init_zoom_levels),
+                    max(mp.config.init_zoom_levels))
+                tqdm.tqdm.write("processing %s tile(s) on %s worker(s)" % (
+                    tiles_count, multi
+                ), file=verbose_dst)
+                for result in tqdm.tqdm(
+                    mp.batch_processor(
+                        multi=multi, zoom=parsed.zoom,
+                        max_chunksize=parsed.max_chunksize,
+                        subtrees=parsed.subtrees,
+                        prefetch=parsed.prefetch_input),
+                    total=tiles_count,
+                    unit="tile",
+                    disable=parsed.debug or parsed.no_pbar
+                ):
+                    _write_verbose_msg(result, dst=verbose_dst)
 
     tqdm.tqdm.write("process finished", file=verbose_dst)
 
 
+def _run_graph(parsed, bounds, mode, multi, verbose_dst):
+    processes = []
+    try:
+        for mapchete_file in parsed.mapchete_files:
+            processes.append(mapchete.open(
+                mapchete_file, bounds=bounds, zoom=parsed.zoom, mode=mode))
+        graph = ProcessGraph(processes)
+        tqdm.tqdm.write(
+            "processing %s tile(s) of %s processes on %s worker(s)" % (
+                len(graph.dependencies), len(processes), multi
+            ), file=verbose_dst)
+        for result in tqdm.tqdm(
+            graph.batch_processor(multi=multi),
+            total=len(graph.dependencies),
+            unit="tile",
+            disable=parsed.debug or parsed.no_pbar
+        ):
+            _write_verbose_msg(result, dst=verbose_dst)
+    finally:
+        for process in processes:
+            process.__exit__(None, None, None)
+
+
 def _write_verbose_msg(result, dst):
     msg = "Tile %s: %s, %s" % (
         tuple(result["process_tile"].id), result["process"],
         result["write"])
+    if "process_name" in result:
+        msg = "%s %s" % (result["process_name"], msg)
     tqdm.tqdm.write(msg, file=dst)
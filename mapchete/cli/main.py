@@ -10,13 +10,6 @@ import sys
 import tilematrix
 
 import mapchete
-from mapchete.cli.create import create_empty_process
-from mapchete.cli.execute import main as execute
-from mapchete.cli.formats import list_formats
-from mapchete.cli.index import index
-from mapchete.cli.pyramid import main as pyramid
-from mapchete.cli.serve import main as serve
-from mapchete.formats import available_output_formats
 
 
 def main(args=None, _test_serve=False):
@@ -63,11 +56,14 @@ class MapcheteCLI(object):
         # if given command has no corresponding function, throw error
         if not hasattr(self, args.command):
             parser.error('unrecognized command "%s"' % args.command)
-        # use dispatch pattern to invoke method with same name
+        # use dispatch pattern to invoke method with same name; subcommand
+        # modules are only imported there to keep startup fast
         getattr(self, args.command)()
 
     def create(self):
         """Parse params and run create command."""
+        from mapchete.cli.create import create_empty_process
+        from mapchete.formats import available_output_formats
         parser = argparse.ArgumentParser(
             description="Create an empty process and configuration file.",
             formatter_class=argparse.ArgumentDefaultsHelpFormatter,
@@ -95,6 +91,7 @@ class MapcheteCLI(object):
 
     def serve(self):
         """Parse params and run serve command."""
+        from mapchete.cli.serve import main as serve
         parser = argparse.ArgumentParser(
             description="Serve a process on localhost.",
             formatter_class=argparse.ArgumentDefaultsHelpFormatter,
@@ -114,6 +111,15 @@ class MapcheteCLI(object):
             "--internal_cache", "-c", type=int,
             help="number of web tiles to be cached in RAM",
             metavar="<int>", default=1024)
+        parser.add_argument(
+            "--prefetch", action="store_true",
+            help="generate parent and neighbor tiles while idle")
+        parser.add_argument(
+            "--workers", "-w", type=int,
+            help=(
+                """number of worker processes executing process tiles """
+                """(default: execute in server threads)"""),
+            metavar="<int>")
         parser.add_argument(
             "--zoom", "-z", type=int, nargs='*',
             help="either minimum and maximum zoom level or just one zoom level",
@@ -141,11 +147,15 @@ class MapcheteCLI(object):
 
     def execute(self):
         """Parse params and run execute command."""
+        from mapchete.cli.execute import main as execute
         parser = argparse.ArgumentParser(
             description="Execute a process.",
             formatter_class=argparse.ArgumentDefaultsHelpFormatter,
-            usage="mapchete execute <mapchete_file>")
-        parser.add_argument("mapchete_file", type=str, help="Mapchete file")
+            usage="mapchete execute <mapchete_file> [<mapchete_file> ...]")
+        parser.add_argument(
+            "mapchete_files", type=str, nargs="+", metavar="mapchete_file",
+            help="Mapchete file(s); processes using the output of another "
+            "process are executed together")
         parser.add_argument(
             "--zoom", "-z", type=int, nargs='*',
             help="either minimum and maximum zoom level or just one zoom level",
@@ -191,10 +201,19 @@ class MapcheteCLI(object):
             "--max_chunksize", "-c", type=int, metavar="<int>", default=1,
             help="maximum number of process tiles to be queued for each \
                 worker; (default: 1)")
+        parser.add_argument(
+            "--subtrees", action="store_true",
+            help="process tiles together with their descendants so lower \
+                zoom levels are interpolated from children in memory")
+        parser.add_argument(
+            "--prefetch_input", action="store_true",
+            help="read input of the next tiles queued for a worker in a \
+                background thread, queueing at least 3 tiles per worker")
         execute(parser.parse_args(self.args[2:]))
 
     def pyramid(self):
         """Parse params and run pyramid command."""
+        from mapchete.cli.pyramid import main as pyramid
         parser = argparse.ArgumentParser(
             description="Create a tile pyramid from an input raster dataset.",
             formatter_class=argparse.ArgumentDefaultsHelpFormatter,
@@ -236,6 +255,7 @@ class MapcheteCLI(object):
 
     def formats(self):
         """Parse arguments and run formats command."""
+        from mapchete.cli.formats import list_formats
         parser = argparse.ArgumentParser(
             description="List available input and/or outpup formats.",
             formatter_class=argparse.ArgumentDefaultsHelpFormatter,
@@ -250,6 +270,7 @@ class MapcheteCLI(object):
 
     def index(self):
         """Parse params and run index command."""
+        from mapchete.cli.index import index
         parser = argparse.ArgumentParser(
             description="Create index of output tiles.",
             formatter_class=argparse.ArgumentDefaultsHelpFormatter,
@@ -4,12 +4,18 @@ Utility to create tile pyramids out of an input raster.
 Also provides various options to rescale data if necessary
 """
 
+import json
+import logging
+import numpy as np
 import os
 import rasterio
+from rasterio.windows import Window
 
 import mapchete
 from mapchete.io import get_best_zoom_level
 
+logger = logging.getLogger(__name__)
+
 # ranges from rasterio
 # https://github.com/mapbox/rasterio/blob/master/rasterio/dtypes.py#L61
 DTYPE_RANGES = {
@@ -21,6 +27,10 @@ DTYPE_RANGES = {
     'float32': (-3.4028235e+38, 3.4028235e+38),
     'float64': (-1.7976931348623157e+308, 1.7976931348623157e+308)
 }
+# maximum size of one chunk read when computing band statistics
+STATS_CHUNK_BYTES = 64 * 1024 * 1024
+# band statistics are cached in a file next to the input raster
+STATS_SIDECAR_SUFFIX = ".mapchete_stats.json"
 
 
 def main(args=None):
@@ -66,9 +76,8 @@ def raster2pyramid(input_file, output_dir, options):
             for index in range(1, output_bands+1):
                 scales_minmax += (DTYPE_RANGES[input_dtype], )
         elif scale_method == "minmax_scale":
-            for index in range(1, output_bands+1):
-                band = input_raster.read(index)
-                scales_minmax += ((band.min(), band.max()), )
+            scales_minmax = band_minmax(
+                input_raster, range(1, output_bands+1))
         elif scale_method == "crop":
             for index in range(1, output_bands+1):
                 scales_minmax += ((0, 255), )
@@ -96,7 +105,9 @@ def raster2pyramid(input_file, output_dir, options):
         nodataval=nodataval,
         resampling=resampling,
         bounds=bounds,
-        baselevel={"zoom": maxzoom, "resampling": resampling},
+        # only the maximum zoom level is read from the input raster, lower
+        # zoom levels are built from the zoom level below
+        baselevels={"min": maxzoom, "max": maxzoom, "lower": resampling},
         mode=mode
     )
 
@@ -106,7 +117,7 @@ def raster2pyramid(input_file, output_dir, options):
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
         # run process
-        mp.batch_process(zoom=[minzoom, maxzoom])
+        mp.batch_process(zoom=[minzoom, maxzoom], subtrees=True)
 
 
 def _get_zoom(zoom, input_raster, pyramid_type):
@@ -125,3 +136,116 @@ def _get_zoom(zoom, input_raster, pyramid_type):
             minzoom = zoom[1]
             maxzoom = zoom[0]
     return minzoom, maxzoom
+
+
+def band_minmax(src, indexes):
+    """
+    Return minimum and maximum of valid pixels per band in bounded memory.
+
+    Values are taken from exact GDAL statistics stored in the dataset if
+    available, otherwise the band is read in chunks. Overviews and approximate
+    statistics are not used, as they can miss the extremes. Bands without
+    valid pixels get the data type range, or (0, 1) for floating point types.
+    Results are cached in a sidecar file next to local input files and reused
+    as long as the file does not change.
+
+    Parameters
+    ----------
+    src : rasterio dataset
+        opened input raster
+    indexes : list
+        band indexes
+
+    Returns
+    -------
+    minmax : tuple
+        (min, max) tuple per band
+    """
+    sidecar = src.name + STATS_SIDECAR_SUFFIX
+    file_key = _file_key(src.name)
+    cached = _read_sidecar(sidecar, file_key)
+    minmax = tuple(
+        tuple(cached[str(index)]) if str(index) in cached
+        else _compute_minmax(src, index)
+        for index in indexes
+    )
+    if file_key and any(str(index) not in cached for index in indexes):
+        cached.update({
+            str(index): list(values) for index, values in zip(indexes, minmax)
+        })
+        _write_sidecar(sidecar, file_key, cached)
+    return minmax
+
+
+def _compute_minmax(src, index):
+    tags = src.tags(index)
+    if (
+        "STATISTICS_MINIMUM" in tags and "STATISTICS_MAXIMUM" in tags and
+        tags.get("STATISTICS_APPROXIMATE", "").upper() != "YES"
+    ):
+        logger.debug("band %s: use GDAL statistics", index)
+        return _cast(src, index, (
+            float(tags["STATISTICS_MINIMUM"]),
+            float(tags["STATISTICS_MAXIMUM"])))
+    logger.debug("band %s: read in chunks", index)
+    rows = max(1, STATS_CHUNK_BYTES // (
+        src.width * np.dtype(src.dtypes[index - 1]).itemsize))
+    return _cast(src, index, _valid_minmax(
+        src.read(index, masked=True, window=Window(
+            0, row, src.width, min(rows, src.height - row)))
+        for row in range(0, src.height, rows)
+    ))
+
+
+def _valid_minmax(chunks):
+    minimum, maximum = None, None
+    for chunk in chunks:
+        if chunk.count():
+            minimum = chunk.min() if minimum is None else min(
+                minimum, chunk.min())
+            maximum = chunk.max() if maximum is None else max(
+                maximum, chunk.max())
+    return minimum, maximum
+
+
+def _cast(src, index, minmax):
+    """Return values as Python numbers of band data type."""
+    if src.dtypes[index - 1].startswith(("int", "uint")):
+        if None in minmax:
+            # no valid pixels
+            return DTYPE_RANGES[src.dtypes[index - 1]]
+        return tuple(int(round(value)) for value in minmax)
+    if None in minmax:
+        # no valid pixels; floating point ranges would overflow when scaling
+        return 0., 1.
+    return tuple(float(value) for value in minmax)
+
+
+def _file_key(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        # e.g. remote files
+        return None
+    return dict(size=stat.st_size, mtime=stat.st_mtime)
+
+
+def _read_sidecar(path, file_key):
+    if not file_key:
+        return {}
+    try:
+        with open(path) as src:
+            content = json.load(src)
+    except (IOError, OSError, ValueError):
+        return {}
+    if content.get("file") != file_key:
+        return {}
+    return content.get("bands", {})
+
+
+def _write_sidecar(path, file_key, bands):
+    try:
+        with open(path, "w") as dst:
+            json.dump(dict(file=file_key, bands=bands), dst)
+    except (IOError, OSError):
+        logger.warning("could not write band statistics to %s", path)
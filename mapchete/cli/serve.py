@@ -1,16 +1,31 @@
 #!/usr/bin/env python
 """Command line utility to serve a Mapchete process."""
 
+import atexit
+from cachetools import LRUCache
+from collections import deque
+import hashlib
+import io
+from itertools import count
 import logging
 import logging.config
+from multiprocessing import cpu_count
+from multiprocessing.pool import Pool
 import os
 import pkgutil
 from rasterio.io import MemoryFile
+import select
 import six
+import socket
+import threading
+import time
 from flask import (
-    Flask, send_file, make_response, render_template_string, abort, jsonify)
+    Flask, send_file, make_response, render_template_string, abort, jsonify,
+    request)
 
 import mapchete
+from mapchete._cache import process_checksum
+from mapchete._core import _worker_initializer
 from mapchete.tile import BufferedTilePyramid
 
 formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s %(message)s')
@@ -21,6 +36,9 @@ logging.getLogger().addHandler(stream_handler)
 
 logger = logging.getLogger(__name__)
 
+# processes opened in pool worker
+_worker_processes = {}
+
 
 def main(args=None, _test=False):
     """
@@ -32,30 +50,121 @@ def main(args=None, _test=False):
     app = create_app(
         mapchete_files=[args.mapchete_file], zoom=args.zoom,
         bounds=args.bounds, single_input_file=args.input_file,
-        mode=_get_mode(args), debug=args.debug)
-    if not _test:
-        app.run(
-            threaded=True, debug=True, port=args.port, host='0.0.0.0',
-            extra_files=[args.mapchete_file])
+        mode=_get_mode(args), debug=args.debug,
+        internal_cache=args.internal_cache, workers=args.workers,
+        prefetch=args.prefetch)
+    try:
+        if not _test:
+            # debugger and reloader only in debug mode
+            app.run(
+                threaded=True, debug=args.debug, port=args.port,
+                host='0.0.0.0', extra_files=[args.mapchete_file])
+    finally:
+        close_app(app)
 
 
 def create_app(
     mapchete_files=None, zoom=None, bounds=None, single_input_file=None,
-    mode="continue", debug=None
+    mode="continue", debug=None, internal_cache=1024, workers=None,
+    max_queued=256, prefetch=False
 ):
-    """Configure and create Flask app."""
+    """
+    Configure and create Flask app.
+
+    This is also the application factory for WSGI servers, e.g.::
+
+        gunicorn -w 4 \\
+            "mapchete.cli.serve:create_app(mapchete_files=['a.mapchete'])"
+
+    To let preforked workers share processed tiles, configure a shared disk
+    cache in the Mapchete file (``process_cache`` with ``disk_shared``).
+
+    Encoded web tiles are cached in memory. Tile responses carry an ``ETag``
+    derived from process configuration, tile and format and, in ``readonly``
+    and ``continue`` mode, from modification times of stored output tiles, so
+    conditional requests of unchanged tiles are answered with ``304 Not
+    Modified`` without reading or processing any data. Output rewritten by
+    another run changes the ``ETag``.
+
+    In ``readonly`` mode, existing PNG output tiles within the process zoom
+    levels and bounds are sent directly from disk if the output pyramid
+    matches the web tiles, i.e. same grid and tile size, no metatiling and no
+    pixelbuffer.
+
+    If workers are given, process tiles are executed in a pool of worker
+    processes. Caching, writing output and waiting for process tiles already
+    requested by other requests stays in the server process. The pool is
+    stopped by ``close_app()`` or when the server process exits.
+
+    Tiles which are not cached are generated by a limited number of requests
+    at a time (number of workers or CPU cores). Waiting requests for the zoom
+    level requested last are preferred, newer requests before older ones, as
+    these are most likely still visible on the map. Waiting requests are
+    dropped if the client disconnected (if the WSGI server exposes the client
+    socket, e.g. gunicorn) or if too many requests are waiting.
+
+    Parameters
+    ----------
+    mapchete_files : list
+        Mapchete files to be served
+    zoom : list or integer
+        process zoom level or a pair of minimum and maximum zoom level
+    bounds : tuple
+        left, bottom, right, top process boundaries
+    single_input_file : string
+        single input file if supported by process
+    mode : string
+        process mode
+    debug : bool
+        print debug messages and return stack traces
+    internal_cache : integer
+        number of encoded web tiles cached in memory (default: 1024)
+    workers : integer
+        number of worker processes executing process tiles (default: None,
+        execute in server threads)
+    max_queued : integer
+        maximum number of requests waiting to be processed (default: 256)
+    prefetch : bool
+        generate parent and neighbor tiles of requested tiles while no
+        requests are waiting (default: False)
+    """
     if debug:
         logging.getLogger("mapchete").setLevel(logging.DEBUG)
         stream_handler.setLevel(logging.DEBUG)
 
     app = Flask(__name__)
+    open_kwargs = dict(
+        zoom=zoom, bounds=bounds, single_input_file=single_input_file,
+        mode=mode, debug=debug)
     mapchete_processes = {
-        os.path.splitext(os.path.basename(mapchete_file))[0]: mapchete.open(
-            mapchete_file, zoom=zoom, bounds=bounds,
-            single_input_file=single_input_file, mode=mode, with_cache=True,
-            debug=debug)
+        _process_name(mapchete_file): mapchete.open(
+            mapchete_file, with_cache=True, **open_kwargs)
         for mapchete_file in mapchete_files
     }
+    # processes are not executed in readonly mode
+    pool = None
+    if workers and mode != "readonly":
+        pool = Pool(
+            workers, _init_worker, (
+                {
+                    _process_name(mapchete_file): mapchete_file
+                    for mapchete_file in mapchete_files
+                },
+                open_kwargs
+            )
+        )
+        # at the latest, workers are stopped when the server process exits
+        atexit.register(pool.terminate)
+        for mp_name, mp in six.iteritems(mapchete_processes):
+            mp.executor = _PoolExecutor(pool, mp_name)
+    app.extensions["mapchete_pool"] = pool
+    config_hashes = {
+        mp_name: process_checksum(mp.config)
+        for mp_name, mp in six.iteritems(mapchete_processes)
+    }
+    web_cache = _WebTileCache(internal_cache)
+    scheduler = _TileScheduler(
+        slots=workers or cpu_count(), max_queued=max_queued)
 
     mp = next(six.iteritems(mapchete_processes))[1]
     pyramid_type = mp.config.process_pyramid.grid
@@ -63,6 +172,11 @@ def create_app(
     process_bounds = ",".join([str(i) for i in mp.config.bounds_at_zoom()])
     grid = "g" if pyramid_srid == 3857 else "WGS84"
     web_pyramid = BufferedTilePyramid(pyramid_type)
+    # stored PNG tiles of these processes can be sent as they are
+    passthrough_processes = set(
+        mp_name for mp_name, mp in six.iteritems(mapchete_processes)
+        if _passthrough_available(mp, web_pyramid)
+    )
 
     @app.route('/', methods=['GET'])
     def index():
@@ -86,14 +200,85 @@ def create_app(
         logger.debug(
             "received tile (%s, %s, %s) for process %s", zoom, row, col,
             mp_name)
+        if mp_name not in mapchete_processes:
+            abort(404)
+        if mp_name in passthrough_processes and file_ext == "png" and (
+            _within_process_area(
+                mapchete_processes[mp_name], web_pyramid.tile(zoom, row, col))
+        ):
+            path = mapchete_processes[mp_name].config.output.get_path(
+                web_pyramid.tile(zoom, row, col))
+            if os.path.isfile(path):
+                logger.debug("send existing file %s", path)
+                return _file_response(path)
         # convert zoom, row, col into tile object using web pyramid
-        return _tile_response(
-            mapchete_processes[mp_name], web_pyramid.tile(zoom, row, col),
-            debug)
+        web_tile = web_pyramid.tile(zoom, row, col)
+        etag = _tile_etag(mp_name, web_tile, file_ext)
+        if etag in request.if_none_match:
+            return _not_modified_response(etag)
+        try:
+            content, mime_type = web_cache[etag]
+        except KeyError:
+            environ = request.environ
+            try:
+                content, mime_type = scheduler.run(
+                    zoom,
+                    lambda: _tile_content(
+                        mapchete_processes[mp_name], web_tile, debug),
+                    is_disconnected=lambda: _client_disconnected(environ)
+                )
+            except _Cancelled:
+                logger.debug("request for tile %s cancelled", web_tile.id)
+                abort(503)
+            web_cache[etag] = (content, mime_type)
+            if prefetcher:
+                prefetcher.add(mp_name, web_tile, file_ext)
+        return _tile_response(content, mime_type, etag)
+
+    def _tile_etag(mp_name, web_tile, file_ext):
+        return _etag(
+            config_hashes[mp_name], web_tile.id, file_ext,
+            _output_version(mapchete_processes[mp_name], web_tile))
+
+    def _prefetch(mp_name, web_tile, file_ext):
+        etag = _tile_etag(mp_name, web_tile, file_ext)
+        if etag not in web_cache:
+            mp = mapchete_processes[mp_name]
+            # runs outside of requests: errors are raised and logged by the
+            # prefetcher and encoding JSON needs an application context
+            with app.app_context():
+                web_cache[etag] = scheduler.run(
+                    web_tile.zoom,
+                    lambda: _encode(mp, mp.get_raw_output(web_tile)),
+                    prefetch=True
+                )
+
+    prefetcher = _Prefetcher(
+        scheduler, web_pyramid, _prefetch) if prefetch else None
 
     return app
 
 
+def close_app(app):
+    """
+    Stop worker processes of an app created by ``create_app()``.
+
+    Parameters
+    ----------
+    app : ``Flask``
+        app created by ``create_app()``
+    """
+    pool = app.extensions.get("mapchete_pool")
+    if pool is not None:
+        pool.close()
+        pool.join()
+        app.extensions["mapchete_pool"] = None
+
+
+def _process_name(mapchete_file):
+    return os.path.splitext(os.path.basename(mapchete_file))[0]
+
+
 def _get_mode(parsed):
     if parsed.memory:
         return "memory"
@@ -105,10 +290,226 @@ def _get_mode(parsed):
         return "continue"
 
 
-def _tile_response(mp, web_tile, debug):
+class _Cancelled(Exception):
+    """Request was dropped while waiting."""
+
+
+class _Ticket(object):
+    """Request waiting for a slot."""
+
+    def __init__(self, zoom, number, prefetch):
+        self.zoom = zoom
+        self.number = number
+        self.prefetch = prefetch
+        self.cancelled = False
+
+
+class _TileScheduler(object):
+    """Run tile requests in a limited number of slots ordered by priority."""
+
+    def __init__(self, slots, max_queued=256):
+        self.slots = slots
+        self.max_queued = max_queued
+        self.running = 0
+        self.queued = []
+        self._zoom = None
+        self._numbers = count()
+        self._condition = threading.Condition()
+
+    def run(self, zoom, func, is_disconnected=None, prefetch=False):
+        """Wait for a free slot, then run func and return its result."""
+        with self._condition:
+            ticket = _Ticket(zoom, next(self._numbers), prefetch)
+            if not prefetch:
+                self._zoom = zoom
+                # speculative requests are dropped as soon as others wait
+                for queued in self.queued:
+                    if queued.prefetch:
+                        self._cancel(queued)
+            self.queued.append(ticket)
+            while len(self.queued) > self.max_queued:
+                self._cancel(max(self.queued, key=self._priority))
+            while True:
+                if ticket.cancelled:
+                    raise _Cancelled()
+                if self.running < self.slots and (
+                    min(self.queued, key=self._priority) is ticket
+                ):
+                    self.queued.remove(ticket)
+                    self.running += 1
+                    break
+                self._condition.wait(0.5)
+                if is_disconnected is not None and is_disconnected():
+                    self._cancel(ticket)
+        try:
+            return func()
+        finally:
+            with self._condition:
+                self.running -= 1
+                self._condition.notify_all()
+
+    def idle(self):
+        """Return whether no request is running or waiting."""
+        with self._condition:
+            return not self.running and not self.queued
+
+    def _priority(self, ticket):
+        # lower is better: real requests, current zoom, most recent
+        return (ticket.prefetch, ticket.zoom != self._zoom, -ticket.number)
+
+    def _cancel(self, ticket):
+        ticket.cancelled = True
+        # ticket may have been cancelled already
+        if ticket in self.queued:
+            self.queued.remove(ticket)
+        self._condition.notify_all()
+
+
+class _Prefetcher(object):
+    """Generate parent and neighbor tiles of requested tiles while idle."""
+
+    def __init__(self, scheduler, web_pyramid, prefetch_func, maxlen=64):
+        self.scheduler = scheduler
+        self.web_pyramid = web_pyramid
+        self.prefetch_func = prefetch_func
+        self.candidates = deque(maxlen=maxlen)
+        self._event = threading.Event()
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def add(self, mp_name, web_tile, file_ext):
+        """Add parent and neighbors of tile as candidates."""
+        for candidate in self._related(web_tile):
+            self.candidates.appendleft((mp_name, candidate, file_ext))
+        self._event.set()
+
+    def _related(self, web_tile):
+        zoom, row, col = web_tile.id
+        if zoom:
+            yield web_tile.get_parent()
+        matrix_height = self.web_pyramid.tile_pyramid.matrix_height(zoom)
+        matrix_width = self.web_pyramid.tile_pyramid.matrix_width(zoom)
+        for r in range(row - 1, row + 2):
+            for c in range(col - 1, col + 2):
+                if (r, c) != (row, col) and 0 <= r < matrix_height:
+                    yield self.web_pyramid.tile(zoom, r, c % matrix_width)
+
+    def _run(self):
+        while True:
+            self._event.wait()
+            self._event.clear()
+            while self.candidates:
+                if not self.scheduler.idle():
+                    time.sleep(0.1)
+                    continue
+                try:
+                    self.prefetch_func(*self.candidates.popleft())
+                except IndexError:
+                    break
+                except _Cancelled:
+                    pass
+                except Exception:
+                    logger.exception("prefetching tile failed")
+
+
+def _client_disconnected(environ):
+    """Return whether client closed the connection, if socket is known."""
+    client = environ.get("gunicorn.socket")
+    if client is None:
+        return False
+    try:
+        readable, _, _ = select.select([client], [], [], 0)
+        # readable but no data means connection closed
+        return bool(readable) and not client.recv(1, socket.MSG_PEEK)
+    except (socket.error, ValueError):
+        return True
+
+
+class _WebTileCache(LRUCache):
+    """Thread-safe LRU cache of encoded web tiles."""
+
+    def __init__(self, maxsize):
+        super(_WebTileCache, self).__init__(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key):
+        with self._lock:
+            return super(_WebTileCache, self).__getitem__(key)
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            super(_WebTileCache, self).__setitem__(key, value)
+
+
+class _PoolExecutor(object):
+    """Execute process tiles of one process in pool workers."""
+
+    def __init__(self, pool, mp_name):
+        self.pool = pool
+        self.mp_name = mp_name
+
+    def __call__(self, process_tile):
+        return self.pool.apply(_execute_worker, (self.mp_name, process_tile.id))
+
+
+def _init_worker(mapchete_files, open_kwargs):
+    _worker_initializer()
+    for mp_name, mapchete_file in six.iteritems(mapchete_files):
+        _worker_processes[mp_name] = mapchete.open(
+            mapchete_file, **open_kwargs)
+
+
+def _execute_worker(mp_name, tile_id):
+    return _worker_processes[mp_name].execute(tile_id)
+
+
+def _passthrough_available(mp, web_pyramid):
+    """Return whether stored output tiles match web tiles exactly."""
+    output_pyramid = mp.config.output_pyramid
+    return (
+        mp.config.mode == "readonly" and
+        mp.config.output.METADATA["driver_name"] == "PNG" and
+        output_pyramid.grid == web_pyramid.grid and
+        output_pyramid.tile_size == web_pyramid.tile_size and
+        output_pyramid.metatiling == web_pyramid.metatiling and
+        mp.config.output.pixelbuffer == web_pyramid.pixelbuffer
+    )
+
+
+def _within_process_area(mp, web_tile):
+    """Return whether web tile is within process zoom levels and bounds."""
+    return web_tile.zoom in mp.config.init_zoom_levels and (
+        mp.config.area_at_zoom(web_tile.zoom).intersects(web_tile.bbox))
+
+
+def _etag(config_hash, tile_id, file_ext, output_version=""):
+    return hashlib.md5(
+        ("%s/%s/%s/%s" % (
+            config_hash, "/".join(map(str, tile_id)), file_ext, output_version
+        )).encode("utf-8")).hexdigest()
+
+
+def _output_version(mp, web_tile):
+    """Return modification times of stored output tiles of a web tile."""
+    # other modes process tiles, which only depend on configuration and code
+    if mp.config.mode not in ["readonly", "continue"]:
+        return ""
+    mtimes = []
+    for output_tile in mp.config.output_pyramid.intersecting(web_tile):
+        try:
+            mtimes.append(
+                os.path.getmtime(mp.config.output.get_path(output_tile)))
+        except (AttributeError, OSError):
+            # not stored (yet) or not a local file
+            mtimes.append(None)
+    return ",".join("%r" % mtime for mtime in mtimes)
+
+
+def _tile_content(mp, web_tile, debug):
     try:
         logger.debug("getting web tile %s", str(web_tile.id))
-        return _valid_tile_response(mp, mp.get_raw_output(web_tile))
+        return _encode(mp, mp.get_raw_output(web_tile))
     except Exception:
         logger.exception("getting web tile %s failed", str(web_tile.id))
         if debug:
@@ -117,15 +518,38 @@ def _tile_response(mp, web_tile, debug):
             abort(500)
 
 
-def _valid_tile_response(mp, data):
+def _encode(mp, data):
     out_data, mime_type = mp.config.output.for_web(data)
-    logger.debug("create tile response %s", mime_type)
+    logger.debug("encode tile %s", mime_type)
     if isinstance(out_data, MemoryFile):
-        response = make_response(send_file(out_data, mime_type))
+        out_data.seek(0)
+        return out_data.read(), mime_type
     elif isinstance(out_data, list):
-        response = make_response(jsonify(data))
+        return jsonify(data).get_data(), mime_type
     else:
         raise TypeError("invalid response type for web")
+
+
+def _tile_response(content, mime_type, etag):
+    response = make_response(send_file(io.BytesIO(content), mime_type))
     response.headers['Content-Type'] = mime_type
-    response.cache_control.no_write = True
+    return _cache_headers(response, etag)
+
+
+def _file_response(path):
+    # streamed from disk using the WSGI file wrapper; ETag from file
+    # modification time and size
+    response = send_file(path, "image/png", conditional=True)
+    response.cache_control.no_cache = True
+    return response
+
+
+def _not_modified_response(etag):
+    return _cache_headers(make_response("", 304), etag)
+
+
+def _cache_headers(response, etag):
+    response.set_etag(etag)
+    # clients have to revalidate, which is cheap using the ETag
+    response.cache_control.no_cache = True
     return response
@@ -1,8 +1,13 @@
 """Clip array using vector data."""
+from cachetools import LRUCache
 import numpy as np
 import numpy.ma as ma
-from shapely.ops import unary_union
 from rasterio.features import geometry_mask
+from shapely.geometry import box
+from shapely.ops import unary_union
+from shapely.prepared import prep
+from shapely.strtree import STRtree
+import threading
 
 from mapchete.io.vector import to_shape
 
@@ -31,7 +36,156 @@ def clip_array_with_vector(
     -------
     clipped array : array
     """
-    # buffer input geometries and clean up
+    buffered_geometries = _buffered_geometries(geometries, clip_buffer)
+
+    # mask raster by buffered geometries
+    if buffered_geometries:
+        return _apply_mask(
+            array, geometry_mask(
+                buffered_geometries, array.shape[-2:], array_affine,
+                invert=inverted))
+
+    # if no geometries, return unmasked array
+    else:
+        fill = False if inverted else True
+        return ma.masked_array(
+            array, mask=np.full(array.shape, fill, dtype=bool))
+
+
+class VectorClipper(object):
+    """
+    Clip arrays of many tiles with the same geometries.
+
+    Geometries are converted and buffered only once. Per tile, only geometries
+    intersecting with the tile are rasterized and tiles completely inside or
+    outside of the geometries are not rasterized at all. Masks are cached per
+    tile.
+
+    Parameters
+    ----------
+    geometries : iterable
+        iterable of dictionaries, where every entry has a 'geometry' and
+        'properties' key.
+    clip_buffer : float
+        buffer (in CRS units) geometries before clipping
+    cache_size : integer
+        maximum number of cached masks (default: 64)
+
+    Attributes
+    ----------
+    geometries : list
+        buffered shapely geometries
+    """
+
+    def __init__(self, geometries, clip_buffer=0, cache_size=64):
+        """Initialize."""
+        self.geometries = _buffered_geometries(geometries, clip_buffer)
+        self._cache_size = cache_size
+        self._init_index()
+
+    def _init_index(self):
+        self._tree = STRtree(self.geometries) if self.geometries else None
+        self._prepared = {id(g): prep(g) for g in self.geometries}
+        self._cache = LRUCache(maxsize=self._cache_size)
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        """Index, prepared geometries and cache cannot be pickled."""
+        return dict(
+            geometries=self.geometries, _cache_size=self._cache_size)
+
+    def __setstate__(self, state):
+        """Rebuild index after unpickling."""
+        self.__dict__.update(state)
+        self._init_index()
+
+    def mask(self, shape, affine, inverted=False, cache_key=None):
+        """
+        Return mask for array.
+
+        Parameters
+        ----------
+        shape : tuple
+            height and width of array
+        affine : Affine
+            Affine object describing the array's geolocation
+        inverted : bool
+            invert mask (default: False)
+        cache_key : hashable
+            identifier of array location, e.g. the tile ID; masks are only
+            cached if provided
+
+        Returns
+        -------
+        mask : array
+            True for pixels outside of geometries or inside if inverted
+        """
+        shape = tuple(shape[-2:])
+        key = (cache_key, shape, tuple(affine))
+        if cache_key is not None:
+            with self._lock:
+                mask = self._cache.get(key)
+        else:
+            mask = None
+        if mask is None:
+            mask = self._mask(shape, affine)
+            if cache_key is not None:
+                with self._lock:
+                    self._cache[key] = mask
+        # short-circuited tiles are cached as boolean
+        if isinstance(mask, bool):
+            return np.full(shape, mask != inverted, dtype=bool)
+        return ~mask if inverted else mask.copy()
+
+    def clip(self, array, affine, inverted=False, cache_key=None):
+        """
+        Clip input array.
+
+        Parameters
+        ----------
+        array : array
+            input raster data
+        affine : Affine
+            Affine object describing the raster's geolocation
+        inverted : bool
+            invert clip (default: False)
+        cache_key : hashable
+            identifier of array location, e.g. the tile ID; masks are only
+            cached if provided
+
+        Returns
+        -------
+        clipped array : array
+        """
+        return _apply_mask(
+            array, self.mask(
+                array.shape, affine, inverted=inverted, cache_key=cache_key))
+
+    def _mask(self, shape, affine):
+        height, width = shape
+        left, top = affine * (0, 0)
+        right, bottom = affine * (width, height)
+        bbox = box(left, bottom, right, top)
+        candidates = []
+        if self._tree is not None:
+            for geometry in self._tree.query(bbox):
+                # shapely >= 2.0 returns indexes instead of geometries
+                if not hasattr(geometry, "geom_type"):
+                    geometry = self.geometries[geometry]
+                prepared = self._prepared[id(geometry)]
+                if prepared.contains(bbox):
+                    # tile completely inside
+                    return False
+                if prepared.intersects(bbox):
+                    candidates.append(geometry)
+        if not candidates:
+            # tile completely outside
+            return True
+        return geometry_mask(candidates, shape, affine)
+
+
+def _buffered_geometries(geometries, clip_buffer):
+    """Convert, buffer and clean up input geometries."""
     buffered_geometries = []
     for feature in geometries:
         feature_geom = to_shape(feature["geometry"])
@@ -46,23 +200,14 @@ def clip_array_with_vector(
             buffered_geom = feature_geom.buffer(clip_buffer)
         if not buffered_geom.is_empty:
             buffered_geometries.append(buffered_geom)
+    return buffered_geometries
 
-    # mask raster by buffered geometries
-    if buffered_geometries:
-        if array.ndim == 2:
-            return ma.masked_array(
-                array, geometry_mask(
-                    buffered_geometries, array.shape, array_affine,
-                    invert=inverted))
-        elif array.ndim == 3:
-            mask = geometry_mask(
-                buffered_geometries, (array.shape[1], array.shape[2]),
-                array_affine, invert=inverted)
-            return ma.masked_array(
-                array, mask=np.stack((mask for band in array)))
 
-    # if no geometries, return unmasked array
+def _apply_mask(array, mask):
+    """Apply 2D mask to 2D or 3D array."""
+    if array.ndim == 2:
+        return ma.masked_array(array, mask)
+    elif array.ndim == 3:
+        return ma.masked_array(array, mask=np.stack((mask for band in array)))
     else:
-        fill = False if inverted else True
-        return ma.masked_array(
-            array, mask=np.full(array.shape, fill, dtype=bool))
+        raise ValueError("array must be 2D or 3D")
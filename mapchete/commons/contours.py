@@ -1,11 +1,39 @@
-"""Contour line extraction using matplotlib."""
+"""Contour line extraction using marching squares."""
 
-import matplotlib
-from shapely.geometry import LineString, mapping
+import numpy as np
+import numpy.ma as ma
 
-# Must be called before pyplot otherwise Travis fails
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+# Cell corners are encoded as bits: top left 8, top right 4, bottom right 2,
+# bottom left 1. A bit is set if the corner value is above the contour level.
+# Cell edges are encoded as 0: top, 1: right, 2: bottom, 3: left.
+# For every case the (up to two) segments are given as pairs of start and end
+# edge; -1 marks a missing segment. Segments are oriented so that values above
+# the level are on the same side, therefore segments of neighboring cells join
+# end to start. Saddle cases (5 and 10) are listed here for a center value
+# below the level and get resolved separately.
+_SEGMENTS = np.array([
+    [[-1, -1], [-1, -1]],  # 0
+    [[3, 2], [-1, -1]],    # 1
+    [[2, 1], [-1, -1]],    # 2
+    [[3, 1], [-1, -1]],    # 3
+    [[1, 0], [-1, -1]],    # 4
+    [[1, 0], [3, 2]],      # 5
+    [[2, 0], [-1, -1]],    # 6
+    [[3, 0], [-1, -1]],    # 7
+    [[0, 3], [-1, -1]],    # 8
+    [[0, 2], [-1, -1]],    # 9
+    [[0, 3], [2, 1]],      # 10
+    [[0, 1], [-1, -1]],    # 11
+    [[1, 3], [-1, -1]],    # 12
+    [[1, 2], [-1, -1]],    # 13
+    [[2, 3], [-1, -1]],    # 14
+    [[-1, -1], [-1, -1]],  # 15
+])
+# segments of saddle cases if the center value is above the level
+_SADDLE_SEGMENTS = {
+    5: [[3, 0], [1, 2]],
+    10: [[0, 1], [2, 3]],
+}
 
 
 def extract_contours(array, tile, interval=100, field='elev', base=0):
@@ -30,35 +58,197 @@ def extract_contours(array, tile, interval=100, field='elev', base=0):
     contours : iterable
         contours as GeoJSON-like pairs of properties and geometry
     """
+    values = ma.masked_invalid(array, copy=False).astype("float64")
+    if values.ndim == 3 and values.shape[0] == 1:
+        values = values[0]
+    if values.ndim != 2:
+        raise ValueError("array must be two dimensional")
+    mask = ma.getmaskarray(values)
+    if mask.all() or min(values.shape) < 2:
+        return []
     levels = _get_contour_values(
-        array.min(), array.max(), interval=interval, base=base)
+        values.min(), values.max(), interval=interval, base=base)
     if not levels:
         return []
-    contours = plt.contour(array, levels)
-    index = 0
+    data = values.filled(0)
+    # only cells with four valid corners are contoured
+    corners = (
+        data[:-1, :-1], data[:-1, 1:], data[1:, 1:], data[1:, :-1]
+    )
+    cell_min = np.minimum(
+        np.minimum(corners[0], corners[1]), np.minimum(corners[2], corners[3]))
+    cell_max = np.maximum(
+        np.maximum(corners[0], corners[1]), np.maximum(corners[2], corners[3]))
+    cell_rows, cell_cols = np.nonzero(
+        ~(mask[:-1, :-1] | mask[:-1, 1:] | mask[1:, 1:] | mask[1:, :-1]) &
+        (cell_min < cell_max)
+    )
+    # a cell is crossed by all levels between its minimum (inclusive) and its
+    # maximum (exclusive) value, so every cell is only visited for the levels
+    # actually crossing it
+    level_values = np.array(levels, dtype="float64")
+    first_level = np.searchsorted(
+        level_values, cell_min[cell_rows, cell_cols], side="left")
+    last_level = np.searchsorted(
+        level_values, cell_max[cell_rows, cell_cols], side="left")
+    num_levels = last_level - first_level
+    crossing = np.repeat(np.arange(len(cell_rows)), num_levels)
+    crossing_levels = (
+        np.repeat(first_level, num_levels) + np.arange(len(crossing)) -
+        np.repeat(np.cumsum(num_levels) - num_levels, num_levels)
+    )
+    order = np.argsort(crossing_levels, kind="mergesort")
+    crossing, crossing_levels = crossing[order], crossing_levels[order]
+    level_offsets = np.searchsorted(
+        crossing_levels, np.arange(len(levels) + 1), side="left")
+    affine = tile.affine
+    a, b, c, d, e, f = (
+        affine.a, affine.b, affine.c, affine.d, affine.e, affine.f)
     out_contours = []
-    for level in range(len(contours.collections)):
-        elevation = levels[index]
-        index += 1
-        paths = contours.collections[level].get_paths()
-        for path in paths:
-            out_coords = [
-                (
-                    tile.left + (y * tile.pixel_x_size),
-                    tile.top - (x * tile.pixel_y_size),
-                )
-                for x, y in zip(path.vertices[:, 1], path.vertices[:, 0])
-            ]
-            if len(out_coords) >= 2:
+    for index, level in enumerate(levels):
+        cells = crossing[level_offsets[index]:level_offsets[index + 1]]
+        if not len(cells):
+            continue
+        rows, cols, offsets = _contour_lines(
+            data, cell_rows[cells], cell_cols[cells], level)
+        # transform all vertices of this level at once and create GeoJSON-like
+        # geometries directly instead of going through shapely objects; tuples
+        # of floats are not tracked by the garbage collector, lists would be
+        coords = tuple(zip(
+            (a * cols + b * rows + c).tolist(),
+            (d * cols + e * rows + f).tolist()
+        ))
+        offsets = offsets.tolist()
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            if end - start >= 2:
                 out_contours.append(
                     dict(
-                        properties={field: elevation},
-                        geometry=mapping(LineString(out_coords))
+                        properties={field: level},
+                        geometry=dict(
+                            type="LineString", coordinates=coords[start:end])
                     )
                 )
     return out_contours
 
 
+def _contour_lines(data, cell_rows, cell_cols, level):
+    """
+    Return vertex rows, vertex columns and line offsets of one level.
+
+    Only the given cells are contoured. Vertices of all lines are
+    concatenated, line i consists of the vertices between offsets[i] and
+    offsets[i + 1].
+    """
+    height, width = data.shape
+    r, c = cell_rows, cell_cols
+    cell_cases = (
+        (data[r, c] > level) * 8 + (data[r, c + 1] > level) * 4 +
+        (data[r + 1, c + 1] > level) * 2 + (data[r + 1, c] > level) * 1
+    )
+    segments = _SEGMENTS[cell_cases]
+    # resolve saddles using the mean of the four corners as center value
+    for case, saddle_segments in _SADDLE_SEGMENTS.items():
+        saddles = np.flatnonzero(cell_cases == case)
+        if len(saddles):
+            r, c = cell_rows[saddles], cell_cols[saddles]
+            center = (
+                data[r, c] + data[r, c + 1] + data[r + 1, c + 1] +
+                data[r + 1, c]
+            ) / 4.
+            segments[saddles[center > level]] = saddle_segments
+
+    # global edge IDs: horizontal edges first, then vertical edges
+    num_horizontal = height * (width - 1)
+    cell_edges = np.stack([
+        cell_rows * (width - 1) + cell_cols,
+        num_horizontal + cell_rows * width + cell_cols + 1,
+        (cell_rows + 1) * (width - 1) + cell_cols,
+        num_horizontal + cell_rows * width + cell_cols,
+    ])
+    segments = segments.reshape(-1, 2)
+    segment_cells = np.repeat(np.arange(len(cell_rows)), 2)
+    existing = segments[:, 0] >= 0
+    segments, segment_cells = segments[existing], segment_cells[existing]
+    starts = cell_edges[segments[:, 0], segment_cells]
+    ends = cell_edges[segments[:, 1], segment_cells]
+
+    # every edge starts and ends at most one segment, so the segments form
+    # independent paths and rings
+    order = np.argsort(starts)
+    position = np.minimum(np.searchsorted(starts[order], ends), len(order) - 1)
+    following = np.where(starts[order][position] == ends, order[position], -1)
+    line_segments, segment_offsets = _join(following)
+
+    # line vertices are the start edges of all segments plus the end edge of
+    # the last segment, which closes rings
+    num_lines = len(segment_offsets) - 1
+    offsets = segment_offsets + np.arange(num_lines + 1)
+    line_edges = np.empty(offsets[-1], dtype="int64")
+    line_edges[
+        np.arange(len(line_segments)) +
+        np.repeat(np.arange(num_lines), np.diff(segment_offsets))
+    ] = starts[line_segments]
+    line_edges[offsets[1:] - 1] = ends[line_segments[segment_offsets[1:] - 1]]
+
+    # interpolate vertex positions along their edges
+    vertical = line_edges >= num_horizontal
+    local = np.where(vertical, line_edges - num_horizontal, line_edges)
+    rows = np.where(vertical, local // width, local // (width - 1))
+    cols = np.where(vertical, local % width, local % (width - 1))
+    next_rows = rows + vertical
+    next_cols = cols + ~vertical
+    start = data[rows, cols]
+    end = data[next_rows, next_cols]
+    t = (level - start) / (end - start)
+    return rows + vertical * t, cols + ~vertical * t, offsets
+
+
+def _join(following):
+    """
+    Return order and offsets of segments joined to paths and rings.
+
+    Segments are ranked within their lines by pointer jumping, which needs a
+    logarithmic number of array operations instead of a Python loop over all
+    segments. Rings are opened at their lowest segment.
+    """
+    num_segments = len(following)
+    segments = np.arange(num_segments)
+    previous = np.full(num_segments, -1, dtype="int64")
+    joined = following >= 0
+    previous[following[joined]] = segments[joined]
+    steps = max(1, int(num_segments).bit_length())
+    head, rank = _rank(previous, steps)
+    ring = previous[head] >= 0
+    if ring.any():
+        # propagate lowest segment index along rings
+        lowest = segments.copy()
+        jump = np.where(joined, following, segments)
+        for _ in range(steps):
+            np.minimum(lowest, lowest[jump], out=lowest)
+            jump = jump[jump]
+        previous[ring & (lowest == segments)] = -1
+        head, rank = _rank(previous, steps)
+    # lines are ordered by their first segment
+    first = previous < 0
+    line = (np.cumsum(first) - 1)[head]
+    offsets = np.zeros(np.count_nonzero(first) + 1, dtype="int64")
+    np.cumsum(np.bincount(line, minlength=len(offsets) - 1), out=offsets[1:])
+    order = np.empty(num_segments, dtype="int64")
+    order[offsets[line] + rank] = segments
+    return order, offsets
+
+
+def _rank(previous, steps):
+    """Return first segment and position in line for all segments."""
+    segments = np.arange(len(previous))
+    head = np.where(previous >= 0, previous, segments)
+    rank = (previous >= 0).astype("int64")
+    for _ in range(steps):
+        rank += rank[head]
+        head = head[head]
+    return head, rank
+
+
 def _get_contour_values(min_val, max_val, base=0, interval=100):
     """Return a list of values between min and max within an interval."""
     i = base
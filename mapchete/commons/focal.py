@@ -0,0 +1,225 @@
+"""
+Neighbourhood (focal) operations on raster arrays.
+
+All operations use square windows of odd size centered on each pixel. Masked
+pixels and pixels outside of the array are ignored, i.e. windows at array
+borders and next to nodata only use the valid pixels within the window. To get
+seamless results across tiles, use a process pixelbuffer of at least half the
+window size.
+"""
+
+import math
+import numpy as np
+import numpy.ma as ma
+from numpy.lib.stride_tricks import as_strided
+import warnings
+
+from mapchete.commons.hillshade import calculate_slope_aspect, _pad_edge
+
+
+def focal_mean(array, size=3):
+    """
+    Return mean of valid pixels within window.
+
+    The window sum is calculated separably using cumulative sums, so run time
+    does not depend on window size.
+
+    Parameters
+    ----------
+    array : array
+        2D or 3D input array
+    size : integer
+        window size in pixels (odd)
+
+    Returns
+    -------
+    focal mean : MaskedArray
+        float64 array masked where input is masked
+    """
+    return _per_band(_focal_mean, array, size)
+
+
+def focal_min(array, size=3):
+    """
+    Return minimum of valid pixels within window (morphological erosion).
+
+    Parameters
+    ----------
+    array : array
+        2D or 3D input array
+    size : integer
+        window size in pixels (odd)
+
+    Returns
+    -------
+    focal minimum : MaskedArray
+        array of input dtype masked where input is masked
+    """
+    return _per_band(_focal_extreme, array, size, np.minimum, np.inf)
+
+
+def focal_max(array, size=3):
+    """
+    Return maximum of valid pixels within window (morphological dilation).
+
+    Parameters
+    ----------
+    array : array
+        2D or 3D input array
+    size : integer
+        window size in pixels (odd)
+
+    Returns
+    -------
+    focal maximum : MaskedArray
+        array of input dtype masked where input is masked
+    """
+    return _per_band(_focal_extreme, array, size, np.maximum, -np.inf)
+
+
+def focal_median(array, size=3):
+    """
+    Return median of valid pixels within window.
+
+    Windows are views on the input created using stride tricks, but computing
+    the median temporarily needs size * size times the memory of the input.
+
+    Parameters
+    ----------
+    array : array
+        2D or 3D input array
+    size : integer
+        window size in pixels (odd)
+
+    Returns
+    -------
+    focal median : MaskedArray
+        float64 array masked where input is masked
+    """
+    return _per_band(_focal_median, array, size)
+
+
+def tpi(array, size=3):
+    """
+    Return topographic position index.
+
+    The TPI is the difference between a pixel value and the mean of the
+    valid pixels within the window.
+
+    Parameters
+    ----------
+    array : array
+        2D or 3D input elevation array
+    size : integer
+        window size in pixels (odd)
+
+    Returns
+    -------
+    TPI : MaskedArray
+        float64 array masked where input is masked
+    """
+    return ma.masked_invalid(array).astype("float64") - focal_mean(array, size)
+
+
+def slope(elevation, tile, z=1.0, scale=1.0):
+    """
+    Return slope in degrees.
+
+    Slope is calculated from the neighbouring pixels, so the values of the
+    outermost pixels are copied from their inner neighbours. To get seamless
+    results across tiles, use a process pixelbuffer of at least 1.
+
+    Parameters
+    ----------
+    elevation : array
+        input elevation data
+    tile : Tile
+        tile covering the array
+    z : float
+        vertical exaggeration factor
+    scale : float
+        scale factor of pixel size units versus height units (insert 112000
+        when having elevation values in meters in a geodetic projection)
+
+    Returns
+    -------
+    slope : MaskedArray
+        float32 array masked where input is masked
+    """
+    radians, _ = calculate_slope_aspect(
+        elevation, tile.pixel_x_size, -tile.pixel_y_size, z=z, scale=scale)
+    np.subtract(np.float32(math.pi / 2), radians, out=radians)
+    np.degrees(radians, out=radians)
+    return ma.masked_array(
+        _pad_edge(radians, "float32"), mask=ma.getmaskarray(elevation))
+
+
+def _per_band(func, array, size, *args):
+    if not isinstance(size, int) or size < 1 or not size % 2:
+        raise ValueError("size must be a positive odd integer")
+    array = ma.masked_invalid(array, copy=False)
+    if array.ndim == 2:
+        return func(array, size // 2, *args)
+    elif array.ndim == 3:
+        return ma.stack([func(band, size // 2, *args) for band in array])
+    else:
+        raise ValueError("array must be 2D or 3D")
+
+
+def _focal_mean(array, radius):
+    valid = ~ma.getmaskarray(array)
+    values = np.where(valid, ma.getdata(array), 0).astype("float64")
+    sums = _box_sum(_box_sum(values, radius, 0), radius, 1)
+    counts = _box_sum(_box_sum(valid.astype("float64"), radius, 0), radius, 1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sums /= counts
+    return ma.masked_array(sums, mask=~valid)
+
+
+def _box_sum(values, radius, axis):
+    """Sum values within radius along axis using cumulative sums."""
+    if not radius:
+        return values
+    pad = [(0, 0), (0, 0)]
+    pad[axis] = (radius + 1, radius)
+    cumulative = np.cumsum(np.pad(values, pad, mode="constant"), axis=axis)
+    size = 2 * radius + 1
+    if axis == 0:
+        return cumulative[size:] - cumulative[:-size]
+    return cumulative[:, size:] - cumulative[:, :-size]
+
+
+def _focal_extreme(array, radius, func, fill):
+    valid = ~ma.getmaskarray(array)
+    values = np.where(valid, ma.getdata(array), fill).astype("float64")
+    # minimum and maximum filters of square windows are separable
+    for axis in [0, 1]:
+        values = func.reduce(_windows(values, radius, axis, fill), axis=-1)
+    return ma.masked_array(
+        values.astype(array.dtype), mask=~valid)
+
+
+def _focal_median(array, radius):
+    valid = ~ma.getmaskarray(array)
+    values = np.where(valid, ma.getdata(array), np.nan).astype("float64")
+    padded = np.pad(values, radius, mode="constant", constant_values=np.nan)
+    size = 2 * radius + 1
+    windows = as_strided(
+        padded, shape=values.shape + (size, size),
+        strides=padded.strides + padded.strides, writeable=False)
+    with warnings.catch_warnings():
+        # windows without any valid pixel
+        warnings.simplefilter("ignore", RuntimeWarning)
+        median = np.nanmedian(
+            windows.reshape(values.shape + (size * size, )), axis=-1)
+    return ma.masked_array(median, mask=~valid)
+
+
+def _windows(values, radius, axis, fill):
+    """Return read-only view of all windows along axis in last dimension."""
+    pad = [(0, 0), (0, 0)]
+    pad[axis] = (radius, radius)
+    padded = np.pad(values, pad, mode="constant", constant_values=fill)
+    return as_strided(
+        padded, shape=values.shape + (2 * radius + 1, ),
+        strides=padded.strides + (padded.strides[axis], ), writeable=False)
@@ -35,7 +35,6 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 import numpy as np
 import numpy.ma as ma
-from itertools import product
 import math
 
 
@@ -52,6 +51,9 @@ def calculate_slope_aspect(elevation, xres, yres, z=1.0, scale=1.0):
     Logic here is borrowed from hillshade.cpp:
     http://www.perrygeo.net/wordpress/?p=7
 
+    The Sobel kernel is applied separably on slices of the input, computing
+    in float32 and reusing buffers where possible.
+
     Parameters
     ----------
     elevation : array
@@ -72,23 +74,32 @@ def calculate_slope_aspect(elevation, xres, yres, z=1.0, scale=1.0):
     """
     z = float(z)
     scale = float(scale)
+    elevation = np.asarray(ma.getdata(elevation), dtype="float32")
     height, width = elevation.shape[0] - 2, elevation.shape[1] - 2
-    window = [
-        z * elevation[row:(row + height), col:(col + width)]
-        for (row, col) in product(range(3), range(3))
-    ]
-    x = (
-        (window[0] + window[3] + window[3] + window[6])
-        - (window[2] + window[5] + window[5] + window[8])
-        ) / (8.0 * xres * scale)
-    y = (
-        (window[6] + window[7] + window[7] + window[8])
-        - (window[0] + window[1] + window[1] + window[2])
-        ) / (8.0 * yres * scale)
-    # in radians, from 0 to pi/2
-    slope = math.pi/2 - np.arctan(np.sqrt(x*x + y*y))
+    # x gradient: smooth along columns, then difference of left and right
+    smoothed = elevation[1:height + 1] * 2
+    smoothed += elevation[:height]
+    smoothed += elevation[2:]
+    x = smoothed[:, :width]
+    x -= smoothed[:, 2:]
+    # y gradient: smooth along rows, then difference of bottom and top
+    smoothed = elevation[:, 1:width + 1] * 2
+    smoothed += elevation[:, :width]
+    smoothed += elevation[:, 2:]
+    y = smoothed[2:]
+    y -= smoothed[:height]
+    x *= z / (8.0 * xres * scale)
+    y *= z / (8.0 * yres * scale)
     # in radians counterclockwise, from -pi at north back to pi
     aspect = np.arctan2(x, y)
+    # in radians, from 0 to pi/2
+    slope = x
+    slope *= x
+    y *= y
+    slope += y
+    np.sqrt(slope, out=slope)
+    np.arctan(slope, out=slope)
+    np.subtract(np.float32(math.pi / 2), slope, out=slope)
     return slope, aspect
 
 
@@ -108,22 +119,144 @@ def hillshade(elevation, tile, azimuth=315.0, altitude=45.0, z=1.0, scale=1.0):
         scale factor of pixel size units versus height units (insert 112000
         when having elevation values in meters in a geodetic projection)
     """
-    azimuth = float(azimuth)
+    return hillshades(
+        elevation, tile, azimuths=[azimuth], altitude=altitude, z=z,
+        scale=scale)[0]
+
+
+def hillshades(
+    elevation, tile, azimuths=(315.0, ), altitude=45.0, z=1.0, scale=1.0
+):
+    """
+    Return one hillshaded numpy array per azimuth.
+
+    Slope and aspect are only calculated once for all light sources.
+
+    Parameters
+    ----------
+    elevation : array
+        input elevation data
+    tile : Tile
+        tile covering the array
+    azimuths : list
+        horizontal angles of light sources
+    altitude : float
+        vertical angle of light sources
+    z : float
+        vertical exaggeration factor
+    scale : float
+        scale factor of pixel size units versus height units (insert 112000
+        when having elevation values in meters in a geodetic projection)
+
+    Returns
+    -------
+    hillshades : list
+    """
+    terms = _shading_terms(elevation, tile, altitude, z, scale)
+    return [
+        _stretch(_shade(terms, azimuth, last=i == len(azimuths) - 1), elevation)
+        for i, azimuth in enumerate(azimuths)
+    ]
+
+
+def multidirectional_hillshade(
+    elevation, tile, azimuths=(225.0, 270.0, 315.0, 360.0), weights=None,
+    altitude=45.0, z=1.0, scale=1.0
+):
+    """
+    Return weighted blend of hillshades lit from multiple directions.
+
+    Slope and aspect are only calculated once for all light sources.
+
+    Parameters
+    ----------
+    elevation : array
+        input elevation data
+    tile : Tile
+        tile covering the array
+    azimuths : list
+        horizontal angles of light sources
+    weights : list
+        weight per light source (default: equal weights)
+    altitude : float
+        vertical angle of light sources
+    z : float
+        vertical exaggeration factor
+    scale : float
+        scale factor of pixel size units versus height units (insert 112000
+        when having elevation values in meters in a geodetic projection)
+
+    Returns
+    -------
+    hillshade : array
+    """
+    if weights is None:
+        weights = [1.] * len(azimuths)
+    if len(weights) != len(azimuths) or not len(azimuths):
+        raise ValueError("one weight per azimuth required")
+    total = float(sum(weights))
+    if total <= 0:
+        raise ValueError("sum of weights must be positive")
+    terms = _shading_terms(elevation, tile, altitude, z, scale)
+    blended = None
+    for i, (azimuth, weight) in enumerate(zip(azimuths, weights)):
+        shaded = _shade(terms, azimuth, last=i == len(azimuths) - 1)
+        shaded *= np.float32(weight / total)
+        if blended is None:
+            blended = shaded
+        else:
+            blended += shaded
+    return _stretch(blended, elevation)
+
+
+def _shading_terms(elevation, tile, altitude, z, scale):
+    """
+    Return aspect and the slope terms of the shading formula.
+
+    sin(altitude) * sin(slope) +
+    cos(altitude) * cos(slope) * cos(azimuth - 90 - aspect)
+    """
     altitude = float(altitude)
-    z = float(z)
-    scale = float(scale)
     xres = tile.tile.pixel_x_size
     yres = -tile.tile.pixel_y_size
     slope, aspect = calculate_slope_aspect(
-        elevation, xres, yres, z=z, scale=scale)
-    deg2rad = math.pi / 180.0
-    shaded = np.sin(altitude * deg2rad) * np.sin(slope) \
-        + np.cos(altitude * deg2rad) * np.cos(slope) \
-        * np.cos((azimuth - 90.0) * deg2rad - aspect)
-    # shaded now has values between -1.0 and +1.0
-    # stretch to 0 - 255 and invert
-    shaded = (((shaded+1.0)/2)*-255.0).astype("uint8")
-    # add one pixel padding using the edge values
+        elevation, xres, yres, z=float(z), scale=float(scale))
+    cos_term = np.cos(slope)
+    cos_term *= np.float32(math.cos(math.radians(altitude)))
+    sin_term = slope
+    np.sin(sin_term, out=sin_term)
+    sin_term *= np.float32(math.sin(math.radians(altitude)))
+    return aspect, cos_term, sin_term
+
+
+def _shade(terms, azimuth, last=False):
+    """Return shading between -1.0 and +1.0 for one light source."""
+    aspect, cos_term, sin_term = terms
+    # the last light source can reuse the aspect array
+    shaded = aspect if last else np.empty_like(aspect)
+    np.subtract(
+        np.float32(math.radians(float(azimuth) - 90.0)), aspect, out=shaded)
+    np.cos(shaded, out=shaded)
+    shaded *= cos_term
+    shaded += sin_term
+    return shaded
+
+
+def _stretch(shaded, elevation):
+    """Stretch shading to 0 - 255, invert and add padding and mask."""
+    shaded += 1
+    shaded *= np.float32(-127.5)
     return ma.masked_array(
-        data=np.pad(shaded, 1, mode='edge'), mask=elevation.mask
+        data=_pad_edge(shaded, "uint8"), mask=ma.getmaskarray(elevation)
     )
+
+
+def _pad_edge(values, dtype):
+    """Cast to dtype and add one pixel padding using the edge values."""
+    out = np.empty((values.shape[0] + 2, values.shape[1] + 2), dtype=dtype)
+    np.copyto(out[1:-1, 1:-1], values, casting="unsafe")
+    out[0, 1:-1] = out[1, 1:-1]
+    out[-1, 1:-1] = out[-2, 1:-1]
+    out[:, 0] = out[:, 1]
+    out[:, -1] = out[:, -2]
+    return out
@@ -25,6 +25,7 @@ from tilematrix._funcs import Bounds
 import warnings
 import yaml
 
+from mapchete._cache import DEFAULT_MAX_BYTES, DEFAULT_MAX_FEATURES
 from mapchete.formats import (
     load_output_writer, available_output_formats, load_input_reader
 )
@@ -58,6 +59,7 @@ _RESERVED_PARAMETERS = [
     "process_bounds",   # process boundaries (deprecated)
     "metatiling",       # process metatile size (deprecated)
     "pixelbuffer",      # buffer around each tile in pixels (deprecated)
+    "process_cache",    # size limits of process tile cache
 ]
 
 
@@ -256,11 +258,16 @@ class MapcheteConfig(object):
             metatiling=self.output_pyramid.metatiling)
         if "format" not in output_params:
             raise MapcheteConfigError("output format not specified")
-        if output_params["format"] not in available_output_formats():
-            raise MapcheteConfigError(
-                "format %s not available in %s" % (
-                    output_params["format"], str(available_output_formats())))
-        writer = load_output_writer(output_params)
+        try:
+            writer = load_output_writer(output_params)
+        except MapcheteDriverError:
+            # only checked on errors as this imports all registered drivers
+            if output_params["format"] not in available_output_formats():
+                raise MapcheteConfigError(
+                    "format %s not available in %s" % (
+                        output_params["format"],
+                        str(available_output_formats())))
+            raise
         try:
             writer.is_valid_with_config(output_params)
         except Exception as e:
@@ -372,13 +379,54 @@ class MapcheteConfig(object):
                 pixelbuffer=self.output_pyramid.pixelbuffer,
                 metatiling=self.process_pyramid.metatiling))
 
+    @cached_property
+    def process_cache(self):
+        """
+        Optional size limits of process tile cache.
+
+        The cache is used in memory mode and by mapchete serve.
+
+        process_cache:
+            max_bytes: <total size of cached raster output in bytes>
+            max_features: <total number of cached vector features>
+            disk_max_bytes: <total size of output spilled to disk in bytes>
+            disk_path: <directory for disk cache>
+            disk_shared: <share disk cache with other processes>
+        """
+        process_cache = dict(
+            max_bytes=DEFAULT_MAX_BYTES, max_features=DEFAULT_MAX_FEATURES,
+            disk_max_bytes=None, disk_path=None, disk_shared=False)
+        config = self._raw.get("process_cache") or {}
+        if not isinstance(config, dict):
+            raise MapcheteConfigError("process_cache must be a dictionary")
+        for k, v in six.iteritems(config):
+            if k not in process_cache:
+                raise MapcheteConfigError(
+                    "invalid process_cache parameter given: %s" % k)
+            if k == "disk_path":
+                if not isinstance(v, six.string_types):
+                    raise MapcheteConfigError(
+                        "process_cache disk_path must be a string")
+                v = os.path.join(self.config_dir, v)
+            elif k == "disk_shared":
+                if not isinstance(v, bool):
+                    raise MapcheteConfigError(
+                        "process_cache disk_shared must be a boolean")
+            elif not isinstance(v, int) or isinstance(v, bool) or v < 1:
+                raise MapcheteConfigError(
+                    "process_cache %s must be a positive integer" % k)
+            process_cache[k] = v
+        if process_cache["disk_shared"] and not (
+            process_cache["disk_path"] and process_cache["disk_max_bytes"]
+        ):
+            raise MapcheteConfigError(
+                "shared process_cache requires disk_path and disk_max_bytes")
+        return process_cache
+
     @cached_property
     def process_func(self):
         try:
-            user_process_py = imp.load_source(
-                os.path.splitext(os.path.basename(self.process_file))[0],
-                self.process_file
-            )
+            user_process_py = _load_process_module(self.process_file, self)
             if hasattr(user_process_py, "Process"):
                 logger.error(
                     """instanciating MapcheteProcess is deprecated, """
@@ -584,6 +632,22 @@ def get_zoom_levels(process_zoom_levels=None, init_zoom_levels=None):
         return init_zoom_levels
 
 
+def _load_process_module(process_file, config):
+    """
+    Load process file as module of configuration.
+
+    Each configuration loads its own module under a unique name, otherwise
+    loading the same process file again for another configuration would
+    replace the functions of the first one, which then could not be pickled
+    anymore, e.g. for chained processes sharing one process file.
+    """
+    return imp.load_source(
+        "%s_%s" % (
+            os.path.splitext(os.path.basename(process_file))[0], id(config)),
+        process_file
+    )
+
+
 def _config_to_dict(input_config):
     if isinstance(input_config, dict):
         if "config_dir" not in input_config:
@@ -608,11 +672,8 @@ def _validate_process_file(config):
         raise MapcheteConfigError("%s is not available" % abs_path)
     try:
         py_compile.compile(abs_path, doraise=True)
-        imp.load_source(os.path.splitext(os.path.basename(abs_path))[0], abs_path)
     except py_compile.PyCompileError as e:
         raise MapcheteProcessSyntaxError(e)
-    except ImportError as e:
-        raise MapcheteProcessImportError(e)
     return abs_path
 
 
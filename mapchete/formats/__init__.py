@@ -5,13 +5,84 @@ This module deserves a cleaner rewrite some day.
 """
 
 import os
-import pkg_resources
 import warnings
 
 from mapchete import errors
 
 _DRIVERS_ENTRY_POINT = "mapchete.formats.drivers"
 _FILE_EXT_TO_DRIVER = {}
+# registered driver entry points, collected once per interpreter
+_ENTRY_POINTS = None
+# imported driver modules by entry point name (None if invalid)
+_LOADED_DRIVERS = {}
+
+
+def _iter_entry_points(group):
+    # importlib.metadata is much faster to import than pkg_resources but only
+    # available from Python 3.8 on
+    try:
+        from importlib import metadata
+    except ImportError:
+        import pkg_resources
+        return list(pkg_resources.iter_entry_points(group))
+    entry_points = metadata.entry_points()
+    if hasattr(entry_points, "select"):
+        return list(entry_points.select(group=group))
+    return list(entry_points.get(group, []))
+
+
+def _driver_entry_points():
+    global _ENTRY_POINTS
+    if _ENTRY_POINTS is None:
+        _ENTRY_POINTS = _iter_entry_points(_DRIVERS_ENTRY_POINT)
+    return _ENTRY_POINTS
+
+
+def _load_driver(entry_point):
+    """Import driver module once and return None if it is not valid."""
+    if entry_point.name not in _LOADED_DRIVERS:
+        driver = entry_point.load()
+        if not hasattr(driver, "METADATA"):
+            warnings.warn(
+                "driver %s cannot be loaded, METADATA is missing" % (
+                    entry_point.name
+                )
+            )
+            driver = None
+        _LOADED_DRIVERS[entry_point.name] = driver
+    return _LOADED_DRIVERS[entry_point.name]
+
+
+def _drivers(driver_name=None):
+    """
+    Yield driver modules.
+
+    If a driver name is given, entry points named like the driver are tried
+    first, so usually only the requested driver module gets imported.
+    """
+    entry_points = _driver_entry_points()
+    if driver_name is not None:
+        def _normalize(name):
+            return name.lower().replace("_", "")
+        entry_points = sorted(
+            entry_points,
+            key=lambda e: _normalize(e.name) != _normalize(driver_name)
+        )
+    for entry_point in entry_points:
+        driver = _load_driver(entry_point)
+        if driver is not None:
+            yield driver
+
+
+def _driver_by_name(driver_name, modes):
+    for driver in _drivers(driver_name):
+        if (
+            driver.METADATA["driver_name"] == driver_name and
+            driver.METADATA["mode"] in modes
+        ):
+            return driver
+    raise errors.MapcheteDriverError(
+        "no loader for driver '%s' could be found." % driver_name)
 
 
 def _file_ext_to_driver():
@@ -20,20 +91,12 @@ def _file_ext_to_driver():
         return _FILE_EXT_TO_DRIVER
     else:
         _FILE_EXT_TO_DRIVER = {}
-        for v in pkg_resources.iter_entry_points(_DRIVERS_ENTRY_POINT):
-            _driver = v.load()
-            if not hasattr(_driver, "METADATA"):
-                warnings.warn(
-                    "driver %s cannot be loaded, METADATA is missing" % (
-                        str(v).split(" ")[-1]
-                    )
-                )
-                continue
-            else:
-                metadata = v.load().METADATA
+        # file extensions are only known from driver METADATA, so all drivers
+        # have to be imported to guess the driver of an input file
+        for driver in _drivers():
             try:
-                driver_name = metadata["driver_name"]
-                for ext in metadata["file_extensions"]:
+                driver_name = driver.METADATA["driver_name"]
+                for ext in driver.METADATA["file_extensions"]:
                     if ext in _FILE_EXT_TO_DRIVER:
                         _FILE_EXT_TO_DRIVER[ext].append(driver_name)
                     else:
@@ -54,14 +117,10 @@ def available_output_formats():
     formats : list
         all available output formats
     """
-    output_formats = []
-    for v in pkg_resources.iter_entry_points(_DRIVERS_ENTRY_POINT):
-        driver_ = v.load()
-        if hasattr(driver_, "METADATA") and (
-            driver_.METADATA["mode"] in ["w", "rw"]
-        ):
-            output_formats.append(driver_.METADATA["driver_name"])
-    return output_formats
+    return [
+        driver.METADATA["driver_name"] for driver in _drivers()
+        if driver.METADATA["mode"] in ["w", "rw"]
+    ]
 
 
 def available_input_formats():
@@ -73,14 +132,10 @@ def available_input_formats():
     formats : list
         all available input formats
     """
-    input_formats = []
-    for v in pkg_resources.iter_entry_points(_DRIVERS_ENTRY_POINT):
-        driver_ = v.load()
-        if hasattr(driver_, "METADATA") and (
-            driver_.METADATA["mode"] in ["r", "rw"]
-        ):
-            input_formats.append(driver_.METADATA["driver_name"])
-    return input_formats
+    return [
+        driver.METADATA["driver_name"] for driver in _drivers()
+        if driver.METADATA["mode"] in ["r", "rw"]
+    ]
 
 
 def load_output_writer(output_params):
@@ -94,17 +149,12 @@ def load_output_writer(output_params):
     """
     if not isinstance(output_params, dict):
         raise TypeError("output_params must be a dictionary")
-    driver_name = output_params["format"]
-    for v in pkg_resources.iter_entry_points(_DRIVERS_ENTRY_POINT):
-        _driver = v.load()
-        if all(
-            [hasattr(_driver, attr) for attr in ["OutputData", "METADATA"]]
-            ) and (
-            _driver.METADATA["driver_name"] == driver_name
-        ):
-            return _driver.OutputData(output_params)
-    raise errors.MapcheteDriverError(
-        "no loader for driver '%s' could be found." % driver_name)
+    driver = _driver_by_name(output_params["format"], ["w", "rw"])
+    if not hasattr(driver, "OutputData"):
+        raise errors.MapcheteDriverError(
+            "no loader for driver '%s' could be found." % (
+                output_params["format"]))
+    return driver.OutputData(output_params)
 
 
 def load_input_reader(input_params, readonly=False):
@@ -126,14 +176,8 @@ def load_input_reader(input_params, readonly=False):
     else:
         raise errors.MapcheteDriverError(
             "invalid input parameters %s" % input_params)
-    for v in pkg_resources.iter_entry_points(_DRIVERS_ENTRY_POINT):
-        driver_ = v.load()
-        if hasattr(driver_, "METADATA") and (
-            driver_.METADATA["driver_name"] == driver_name
-        ):
-            return v.load().InputData(input_params, readonly=readonly)
-    raise errors.MapcheteDriverError(
-        "no loader for driver '%s' could be found." % driver_name)
+    return _driver_by_name(driver_name, ["r", "rw"]).InputData(
+        input_params, readonly=readonly)
 
 
 def driver_from_file(input_file):
@@ -84,6 +84,19 @@ class InputData(object):
         """
         raise NotImplementedError
 
+    def prefetch(self, tile):
+        """
+        Optional: read input of a tile in advance.
+
+        Called from a background thread before the tile is processed. Drivers
+        can keep the data and return it from ``InputTile.read()`` later.
+
+        Parameters
+        ----------
+        tile : ``Tile``
+        """
+        pass
+
     def cleanup(self):
         """Optional cleanup function called when Mapchete exits."""
         pass
@@ -1,7 +1,11 @@
 """Use another Mapchete process as input."""
 
+import os
+import six
+
 from mapchete import Mapchete
-from mapchete.config import MapcheteConfig
+from mapchete.config import MapcheteConfig, validate_values
+from mapchete.errors import MapcheteConfigError
 from mapchete.formats import base
 from mapchete.io.vector import reproject_geometry
 
@@ -27,6 +31,13 @@ class InputData(base.InputData):
     ----------
     path : string
         path to Mapchete file
+    mode : string
+        * ``readonly``: (default) read existing output of input process
+        * ``memory``: run input process on demand and cache its output in
+          memory; set via ``mode`` when defining the input with
+          ``format: Mapchete``
+    process : ``Mapchete``
+        input process
     pixelbuffer : integer
         buffer around output tiles
     pyramid : ``tilematrix.TilePyramid``
@@ -47,11 +58,26 @@ class InputData(base.InputData):
     def __init__(self, input_params, **kwargs):
         """Initialize."""
         super(InputData, self).__init__(input_params, **kwargs)
-        self.path = input_params["path"]
+        if "abstract" in input_params:
+            self._params = input_params["abstract"]
+            validate_values(self._params, [("path", six.string_types)])
+            self.path = os.path.normpath(os.path.join(
+                input_params["conf_dir"], self._params["path"]))
+            mode = self._params.get("mode", "readonly")
+            if mode not in ["readonly", "memory"]:
+                raise MapcheteConfigError(
+                    "input process mode must be readonly or memory: %s" % mode)
+        else:
+            self.path = input_params["path"]
+            mode = "readonly"
+        # in memory mode the input process is run on demand within the same
+        # worker and its output gets cached instead of being read from disk
+        self.mode = "readonly" if kwargs.get("readonly", False) else mode
+        zooms = input_params["delimiters"]["zoom"]
         self.process = Mapchete(MapcheteConfig(
-            self.path, mode="readonly",
+            self.path, mode=self.mode,
             bounds=input_params["delimiters"]["bounds"],
-            zoom=input_params["delimiters"]["zoom"]
+            zoom=[min(zooms), max(zooms)]
         ))
 
     def open(self, tile, **kwargs):
@@ -87,3 +113,7 @@ class InputData(base.InputData):
             self.process.config.area_at_zoom(),
             src_crs=self.process.config.process_pyramid.crs,
             dst_crs=self.pyramid.crs if out_crs is None else out_crs)
+
+    def cleanup(self):
+        """Clean up input process."""
+        self.process.__exit__(None, None, None)
@@ -228,13 +228,9 @@ class OutputData(base.OutputData):
         Returns
         -------
         empty data : array
-            empty array with data type given in output parameters
+            empty RGBA array like data read from existing PNG files
         """
-        bands = (
-            self.output_params["bands"]
-            if "bands" in self.output_params
-            else PNG_PROFILE["count"]
-        )
+        bands = PNG_PROFILE["count"]
         return ma.masked_array(
             data=ma.zeros((bands, ) + process_tile.shape),
             mask=ma.zeros((bands, ) + process_tile.shape),
@@ -7,12 +7,14 @@ extended easily.
 
 from cached_property import cached_property
 from copy import deepcopy
+from functools import partial
 import logging
 import os
 import rasterio
 from shapely.geometry import box
 import warnings
 
+from mapchete._prefetch import PrefetchStore
 from mapchete.formats import base
 from mapchete.io.vector import reproject_geometry, segmentize_geometry
 from mapchete.io.raster import read_raster_window
@@ -65,6 +67,10 @@ class InputData(base.InputData):
         """Initialize."""
         super(InputData, self).__init__(input_params, **kwargs)
         self.path = input_params["path"]
+        self._bboxes = {}
+        # parameters of last read used for prefetching
+        self._read_params = None
+        self._prefetched = PrefetchStore()
 
     @cached_property
     def profile(self):
@@ -102,6 +108,11 @@ class InputData(base.InputData):
             Shapely geometry object
         """
         out_crs = self.pyramid.crs if out_crs is None else out_crs
+        if out_crs.to_string() not in self._bboxes:
+            self._bboxes[out_crs.to_string()] = self._bbox(out_crs)
+        return self._bboxes[out_crs.to_string()]
+
+    def _bbox(self, out_crs):
         with rasterio.open(self.path) as inp:
             inp_crs = inp.crs
             out_bbox = bbox = box(*inp.bounds)
@@ -128,6 +139,29 @@ class InputData(base.InputData):
         """
         return os.path.isfile(self.path)
 
+    def prefetch(self, tile):
+        """
+        Read input of a tile in advance.
+
+        The warped window is read using the band indexes and resampling of the
+        last read and returned by ``InputTile.read()`` if it matches. Nothing
+        is read before the first read.
+
+        Parameters
+        ----------
+        tile : ``Tile``
+        """
+        if self._read_params is None:
+            return
+        input_tile = self.open(
+            tile, resampling=self._read_params["resampling"])
+        if input_tile.is_empty():
+            return
+        indexes = input_tile._get_band_indexes(self._read_params["indexes"])
+        self._prefetched.add(
+            input_tile._prefetch_key(indexes),
+            partial(input_tile._read, indexes))
+
 
 class InputTile(base.InputTile):
     """
@@ -169,14 +203,24 @@ class InputTile(base.InputTile):
         -------
         data : array
         """
+        self.raster_file._read_params = dict(
+            resampling=self.resampling, indexes=indexes)
+        indexes = self._get_band_indexes(indexes)
+        return self.raster_file._prefetched.get(
+            self._prefetch_key(indexes), partial(self._read, indexes))
+
+    def _read(self, indexes):
         return read_raster_window(
             self.raster_file.path,
             self.tile,
-            indexes=self._get_band_indexes(indexes),
+            indexes=indexes,
             resampling=self.resampling,
             gdal_opts=self.gdal_opts
         )
 
+    def _prefetch_key(self, indexes):
+        return self.tile.id, tuple(indexes), self.resampling
+
     def is_empty(self, indexes=None):
         """
         Check if there is data within this tile.
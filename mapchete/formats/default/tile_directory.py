@@ -20,7 +20,7 @@ from mapchete.formats import base
 from mapchete.io import path_is_remote
 from mapchete.io.vector import reproject_geometry, read_vector_window
 from mapchete.io.raster import (
-    read_raster_window, create_mosaic, resample_from_array)
+    read_aligned_raster_tiles, read_raster_mosaic, resample_from_array)
 
 
 METADATA = {
@@ -130,6 +130,7 @@ class InputData(base.InputData):
                 if _path_exists(_path)],
             file_type=self._file_type,
             profile=self._profile,
+            same_grid=_same_grid(self.td_pyramid, tile),
             **kwargs)
 
     def bbox(self, out_crs=None):
@@ -173,6 +174,7 @@ class InputTile(base.InputTile):
         self._tiles_paths = kwargs["tiles_paths"]
         self._file_type = kwargs["file_type"]
         self._profile = kwargs["profile"]
+        self._same_grid = kwargs.get("same_grid", False)
 
     def read(
         self, validity_check=False, indexes=None, resampling="nearest",
@@ -218,16 +220,21 @@ class InputTile(base.InputTile):
                         dtype=self._profile["dtype"]),
                     mask=True
                 )
-            tiles = [
-                (_tile, read_raster_window(
-                    _path, _tile, indexes=indexes, resampling=resampling,
-                    src_nodata=self._profile["nodata"], dst_nodata=dst_nodata,
-                    gdal_opts=gdal_opts))
-                for _tile, _path in self._tiles_paths
-            ]
+            # tiles are aligned with the pixel grid of this tile, so they can
+            # be copied into the output array without any resampling
+            if self._same_grid:
+                return read_aligned_raster_tiles(
+                    self._tiles_paths, self.tile,
+                    count=self._profile["count"], dtype=self._profile["dtype"],
+                    indexes=indexes, nodata=self._profile["nodata"],
+                    dst_nodata=dst_nodata, gdal_opts=gdal_opts)
             return resample_from_array(
-                in_raster=create_mosaic(
-                    tiles=tiles, nodata=self._profile["nodata"]),
+                in_raster=read_raster_mosaic(
+                    self._tiles_paths, count=self._profile["count"],
+                    dtype=self._profile["dtype"], indexes=indexes,
+                    resampling=resampling, src_nodata=self._profile["nodata"],
+                    dst_nodata=dst_nodata, gdal_opts=gdal_opts,
+                    nodata=self._profile["nodata"]),
                 out_tile=self.tile,
                 resampling=resampling,
                 nodataval=self._profile["nodata"])
@@ -243,6 +250,21 @@ class InputTile(base.InputTile):
         return len(self._tiles_paths) == 0
 
 
+def _same_grid(td_pyramid, tile):
+    """
+    Determine whether directory tiles share the pixel grid of the tile.
+
+    Tiles going over the antimeridian are excluded as their data is read from
+    the other side of the tile pyramid.
+    """
+    return all([
+        td_pyramid.grid == tile.tile_pyramid.grid,
+        td_pyramid.tile_size == tile.tile_pyramid.tile_size,
+        tile.left >= td_pyramid.left,
+        tile.right <= td_pyramid.right
+    ])
+
+
 def _absolute_path(directory, path):
     """Return absolute path if local."""
     return path if path_is_remote(path) else os.path.abspath(
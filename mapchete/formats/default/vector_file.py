@@ -5,9 +5,11 @@ Currently limited by extensions .shp and .geojson but could be extended easily.
 """
 
 import fiona
+from functools import partial
 from shapely.geometry import box
 from rasterio.crs import CRS
 
+from mapchete._prefetch import PrefetchStore
 from mapchete.formats import base
 from mapchete.io.vector import reproject_geometry, read_vector_window
 
@@ -54,6 +56,8 @@ class InputData(base.InputData):
         """Initialize."""
         super(InputData, self).__init__(input_params, **kwargs)
         self.path = input_params["path"]
+        self._bboxes = {}
+        self._prefetched = PrefetchStore()
 
     def open(self, tile, **kwargs):
         """
@@ -85,11 +89,27 @@ class InputData(base.InputData):
             Shapely geometry object
         """
         out_crs = self.pyramid.crs if out_crs is None else out_crs
-        with fiona.open(self.path) as inp:
-            inp_crs = CRS(inp.crs)
-            bbox = box(*inp.bounds)
-        # TODO find a way to get a good segmentize value in bbox source CRS
-        return reproject_geometry(bbox, src_crs=inp_crs, dst_crs=out_crs)
+        if out_crs.to_string() not in self._bboxes:
+            with fiona.open(self.path) as inp:
+                inp_crs = CRS(inp.crs)
+                bbox = box(*inp.bounds)
+            # TODO find a way to get a good segmentize value in bbox source CRS
+            self._bboxes[out_crs.to_string()] = reproject_geometry(
+                bbox, src_crs=inp_crs, dst_crs=out_crs)
+        return self._bboxes[out_crs.to_string()]
+
+    def prefetch(self, tile):
+        """
+        Read features of a tile in advance.
+
+        Parameters
+        ----------
+        tile : ``Tile``
+        """
+        if tile.bbox.intersects(self.bbox()):
+            input_tile = self.open(tile)
+            self._prefetched.add(
+                (tile.id, True), partial(input_tile._read, True))
 
 
 class InputTile(base.InputTile):
@@ -146,8 +166,11 @@ class InputTile(base.InputTile):
     def _read_from_cache(self, validity_check):
         checked = "checked" if validity_check else "not_checked"
         if checked not in self._cache:
-            self._cache[checked] = list(read_vector_window(
-                self.vector_file.path, self.tile,
-                validity_check=validity_check)
-            )
+            self._cache[checked] = self.vector_file._prefetched.get(
+                (self.tile.id, validity_check),
+                partial(self._read, validity_check))
         return self._cache[checked]
+
+    def _read(self, validity_check):
+        return list(read_vector_window(
+            self.vector_file.path, self.tile, validity_check=validity_check))
@@ -0,0 +1,9 @@
+"""Entry point of the range cache server subprocess."""
+
+import sys
+
+from mapchete.io.range_cache import serve
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1], int(sys.argv[2]))
@@ -0,0 +1,460 @@
+"""
+Persistent cache of byte ranges read from remote rasters.
+
+GDAL reads rasters over HTTP using ``/vsicurl/`` and range requests, so every
+run fetches the same byte ranges again. If the ``MAPCHETE_RANGE_CACHE_PATH``
+environment variable is set, ``read_raster_window()`` reads ``http://`` and
+``https://`` rasters through a local HTTP server started as subprocess by
+each process reading rasters (GDAL does not release the GIL while reading, so
+the server cannot run in a thread). It answers range requests from blocks
+cached in this directory and only requests missing blocks from the remote
+server. The server only answers requests for URLs registered by the process
+which started it.
+
+Remote files are read directly, if GDAL options for authentication, custom
+headers or proxies are set (see ``GDAL_HTTP_REQUEST_OPTS``), as the range
+cache server requests files without them.
+
+Blocks are keyed by URL, ETag (or last modification time and size if the
+server does not send an ETag) and byte range, so changed files are fetched
+again. Least recently used blocks are removed if the total size exceeds
+``MAPCHETE_RANGE_CACHE_MAX_BYTES`` (default: 1 GiB). Multiple processes can
+share the directory.
+"""
+
+import atexit
+import base64
+import hashlib
+import logging
+import os
+import rasterio
+import re
+import subprocess
+import sys
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+from six.moves.urllib.error import HTTPError
+from six.moves.urllib.parse import urlparse
+from six.moves.urllib.request import Request, urlopen
+import threading
+
+from mapchete._cache import SharedDiskCache
+
+logger = logging.getLogger(__name__)
+
+RANGE_CACHE_PATH_ENV = "MAPCHETE_RANGE_CACHE_PATH"
+RANGE_CACHE_MAX_BYTES_ENV = "MAPCHETE_RANGE_CACHE_MAX_BYTES"
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+# size of cached blocks, a multiple of the GDAL /vsicurl/ chunk size
+BLOCK_SIZE = 64 * 1024
+HTTP_TIMEOUT = 30
+# GDAL options changing requests to remote servers
+GDAL_HTTP_REQUEST_OPTS = (
+    "GDAL_HTTP_AUTH", "GDAL_HTTP_USERPWD", "GDAL_HTTP_HEADER_FILE",
+    "GDAL_HTTP_HEADERS", "GDAL_HTTP_COOKIE", "GDAL_HTTP_COOKIEFILE",
+    "GDAL_HTTP_PROXY", "GDAL_HTTPS_PROXY", "GDAL_HTTP_PROXYUSERPWD",
+    "GDAL_PROXY_AUTH", "GDAL_HTTP_SSLCERT", "GDAL_HTTP_SSLKEY",
+    "GDAL_HTTP_UNSAFESSL"
+)
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def cached_path(path, gdal_opts=None):
+    """
+    Return path to read a remote raster through the range cache.
+
+    Parameters
+    ----------
+    path : string
+        path or URL of raster file
+    gdal_opts : dict
+        GDAL options used to read the file
+
+    Returns
+    -------
+    path : string
+        URL of local range cache server if the range cache is enabled, the
+        path is an HTTP URL and no GDAL options changing requests are set,
+        otherwise the path itself
+    """
+    cache_path = os.environ.get(RANGE_CACHE_PATH_ENV)
+    if not cache_path or not path.startswith(("http://", "https://")):
+        return path
+    request_opts = _request_opts(gdal_opts)
+    if request_opts:
+        logger.debug(
+            "read %s directly, as range cache does not apply %s", path,
+            ", ".join(request_opts))
+        return path
+    max_bytes = int(
+        os.environ.get(RANGE_CACHE_MAX_BYTES_ENV, DEFAULT_MAX_BYTES))
+    return _get_server(cache_path, max_bytes).register(path)
+
+
+def _request_opts(gdal_opts):
+    """Return names of GDAL options set which change remote requests."""
+    opts = dict(os.environ)
+    if rasterio.env.hasenv():
+        opts.update(rasterio.env.getenv())
+    opts.update(gdal_opts or {})
+    return [
+        name for name in GDAL_HTTP_REQUEST_OPTS
+        if opts.get(name) not in (None, "")
+    ]
+
+
+def _get_server(path, max_bytes):
+    global _server
+    with _server_lock:
+        if _server is not None and _server.pid == os.getpid() and (
+            _server.path == path and _server.max_bytes == max_bytes
+        ):
+            return _server
+        # servers of parent processes are not used by forked processes
+        if _server is not None and _server.pid == os.getpid():
+            _server.close()
+        _server = RangeCacheServer(path, max_bytes)
+        return _server
+
+
+class RangeCache(SharedDiskCache):
+    """
+    LRU cache of byte ranges of remote files in a directory.
+
+    Files are split into blocks of ``block_size`` bytes. Missing blocks of a
+    requested range are fetched using one range request.
+
+    Parameters
+    ----------
+    max_bytes : integer
+        maximum total size of cached blocks in bytes
+    path : string
+        cache directory
+    block_size : integer
+        size of cached blocks in bytes
+
+    Attributes
+    ----------
+    path : string
+        cache directory
+    hits : integer
+        number of blocks read from cache by this process
+    misses : integer
+        number of blocks not found in cache by this process
+    evictions : integer
+        number of blocks removed by this process to free space
+    """
+
+    def __init__(self, max_bytes, path, block_size=BLOCK_SIZE):
+        """Initialize cache."""
+        super(RangeCache, self).__init__(max_bytes, path)
+        self.block_size = block_size
+        self._files = {}
+
+    def file_info(self, url):
+        """
+        Return size and version of a remote file.
+
+        The remote server is asked once per URL and process.
+
+        Parameters
+        ----------
+        url : string
+
+        Returns
+        -------
+        size, version : tuple
+            file size in bytes and ETag or last modification time and size
+        """
+        with self._lock:
+            if url in self._files:
+                return self._files[url]
+        headers = urlopen(_HeadRequest(url), timeout=HTTP_TIMEOUT).info()
+        size = int(headers["Content-Length"])
+        version = headers.get("ETag") or "%s %s" % (
+            headers.get("Last-Modified"), size)
+        with self._lock:
+            self._files[url] = (size, version)
+        return size, version
+
+    def read(self, url, start, end):
+        """
+        Return byte range of a remote file.
+
+        Parameters
+        ----------
+        url : string
+        start : integer
+            first byte
+        end : integer
+            last byte (inclusive)
+
+        Returns
+        -------
+        data : bytes
+        """
+        size, version = self.file_info(url)
+        end = min(end, size - 1)
+        prefix = hashlib.sha1(
+            ("%s %s" % (url, version)).encode("utf-8")).hexdigest()
+        first = start // self.block_size
+        indexes = range(first, end // self.block_size + 1)
+        blocks = {}
+        for index in indexes:
+            try:
+                blocks[index] = self[(prefix, index)]
+            except KeyError:
+                pass
+        missing = [index for index in indexes if index not in blocks]
+        if missing:
+            offset = missing[0] * self.block_size
+            data = _get_range(url, offset, min(
+                (missing[-1] + 1) * self.block_size, size) - 1)
+            for index in missing:
+                blocks[index] = data[
+                    index * self.block_size - offset:
+                    (index + 1) * self.block_size - offset
+                ]
+                self[(prefix, index)] = blocks[index]
+        data = b"".join(blocks[index] for index in indexes)
+        return data[start - first * self.block_size:
+                    end + 1 - first * self.block_size]
+
+
+class RangeCacheServer(object):
+    """
+    Local HTTP server subprocess answering range requests from cache.
+
+    The server stops when this object is closed or the process exits. If it
+    cannot be started or stops unexpectedly, remote files are read directly.
+
+    Parameters
+    ----------
+    path : string
+        cache directory
+    max_bytes : integer
+        maximum total size of cached blocks in bytes
+
+    Attributes
+    ----------
+    pid : integer
+        process which started the server
+    port : integer or None
+        local server port or None if the server is not running
+    """
+
+    def __init__(self, path, max_bytes):
+        """Start server."""
+        self.path = path
+        self.max_bytes = max_bytes
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._registered = set()
+        self._process = subprocess.Popen(
+            [
+                sys.executable, "-m", "mapchete.io._range_cache_server",
+                path, str(max_bytes)
+            ],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        atexit.register(self.close)
+        try:
+            self.port = int(self._process.stdout.readline())
+        except ValueError:
+            logger.error(
+                "range cache server for %s could not be started, read remote "
+                "files directly", path)
+            self.port = None
+            self.close()
+            return
+        logger.debug(
+            "range cache server for %s listening on port %s", path, self.port)
+
+    def register(self, url):
+        """
+        Return local URL for remote file.
+
+        Parameters
+        ----------
+        url : string
+            URL of remote file
+
+        Returns
+        -------
+        local URL : string
+            URL of local server or the URL itself if the server is not running
+        """
+        with self._lock:
+            if self.port is None or "\n" in url:
+                return url
+            if url not in self._registered:
+                # server only answers requests for URLs sent to it
+                try:
+                    self._process.stdin.write(
+                        ("%s\n" % url).encode("utf-8"))
+                    self._process.stdin.flush()
+                    registered = self._process.stdout.readline()
+                except (IOError, OSError) as e:
+                    registered = None
+                    logger.debug("registering %s failed: %s", url, e)
+                if not registered:
+                    logger.error(
+                        "range cache server for %s stopped, read remote files "
+                        "directly", self.path)
+                    self.port = None
+                    self.close()
+                    return url
+                self._registered.add(url)
+        # keep file name, as GDAL checks the file extension
+        return "http://127.0.0.1:%s/%s/%s" % (
+            self.port, _encode_url(url), os.path.basename(urlparse(url).path))
+
+    def close(self):
+        """Stop server."""
+        if self._process.poll() is None:
+            # server stops when its input is closed
+            try:
+                self._process.stdin.close()
+            except (IOError, OSError):
+                pass
+            self._process.wait()
+
+
+def serve(path, max_bytes):
+    """
+    Run range cache server until standard input is closed.
+
+    The server port is written to standard output. Every line read from
+    standard input is a remote URL the server answers requests for and is
+    acknowledged by writing a line to standard output.
+
+    Parameters
+    ----------
+    path : string
+        cache directory
+    max_bytes : integer
+        maximum total size of cached blocks in bytes
+    """
+    server = _ThreadingHTTPServer(("127.0.0.1", 0), _RangeHandler)
+    server.cache = RangeCache(max_bytes, path)
+    server.urls = set()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    sys.stdout.write("%s\n" % server.server_port)
+    sys.stdout.flush()
+    # also stops if the process which started the server died
+    for line in iter(sys.stdin.readline, ""):
+        url = line.strip()
+        if url.startswith(("http://", "https://")):
+            server.urls.add(url)
+        sys.stdout.write("\n")
+        sys.stdout.flush()
+    server.shutdown()
+    server.server_close()
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    # keep connections open for subsequent range requests of GDAL
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def _respond(self, send_body=True):
+        cache = self.server.cache
+        url = _decode_url(self.path)
+        # do not act as proxy for anything not registered, e.g. local files
+        if url not in self.server.urls:
+            self.send_error(404)
+            return
+        try:
+            size, version = cache.file_info(url)
+            byte_range = _parse_range(self.headers.get("Range"), size)
+            if byte_range is None:
+                self.send_error(416)
+                return
+            start, end = byte_range
+            data = cache.read(url, start, end) if (
+                send_body and size) else b""
+        except HTTPError as e:
+            self.send_error(e.code)
+            return
+        except Exception as e:
+            logger.exception("reading %s from range cache failed: %s", url, e)
+            self.send_error(502)
+            return
+        if self.headers.get("Range"):
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", "bytes %s-%s/%s" % (start, end, size))
+        else:
+            self.send_response(200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("ETag", version)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class _HeadRequest(Request):
+    def get_method(self):
+        return "HEAD"
+
+
+def _encode_url(url):
+    return base64.urlsafe_b64encode(
+        url.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_url(path):
+    """Return remote URL from local URL path or None."""
+    encoded = path.lstrip("/").split("/")[0]
+    try:
+        return base64.urlsafe_b64decode(
+            (encoded + "=" * (-len(encoded) % 4)).encode("ascii")
+        ).decode("utf-8")
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_range(header, size):
+    """Return first and last byte of a single range or None."""
+    if not header:
+        return 0, size - 1
+    match = re.match(r"^bytes=(\d*)-(\d*)$", header.strip())
+    if match is None or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first == "":
+        # suffix range
+        return max(size - int(last), 0), size - 1
+    first = int(first)
+    last = size - 1 if last == "" else min(int(last), size - 1)
+    if first > last:
+        return None
+    return first, last
+
+
+def _get_range(url, start, end):
+    response = urlopen(
+        Request(url, headers={"Range": "bytes=%s-%s" % (start, end)}),
+        timeout=HTTP_TIMEOUT)
+    data = response.read()
+    if response.getcode() == 200:
+        # server ignored the range request
+        data = data[start:end + 1]
+    return data
+
@@ -3,15 +3,17 @@
 import itertools
 import rasterio
 import logging
+import os
 import six
 import numpy as np
 import numpy.ma as ma
 from affine import Affine
 from collections import namedtuple
+from multiprocessing.pool import ThreadPool
 from rasterio.enums import Resampling
 from rasterio.io import MemoryFile
 from rasterio.vrt import WarpedVRT
-from rasterio.warp import reproject
+from rasterio.warp import reproject, transform
 from rasterio.windows import from_bounds
 from shapely.ops import cascaded_union
 from tilematrix import clip_geometry_to_srs_bounds
@@ -27,6 +29,10 @@ ReferencedRaster = namedtuple("ReferencedRaster", ("data", "affine"))
 GDAL_HTTP_OPTS = dict(
     GDAL_DISABLE_READDIR_ON_OPEN=True,
     GDAL_HTTP_TIMEOUT=30)
+# maximum number of concurrent reads when mosaicking tiles from files
+READ_THREADS = 8
+# resampling methods supported by downsample_from_array()
+BLOCK_REDUCE_METHODS = ("nearest", "average", "min", "max")
 
 
 def read_raster_window(
@@ -39,7 +45,8 @@ def read_raster_window(
     NumPy arrays are reprojected and resampled to tile properties from input
     raster. If tile boundaries cross the antimeridian, data on the other side
     of the antimeridian will be read and concatenated to the numpy array
-    accordingly.
+    accordingly. Remote rasters are read through the range cache if enabled
+    (see ``mapchete.io.range_cache``).
 
     Parameters
     ----------
@@ -63,12 +70,12 @@ def read_raster_window(
     raster : MaskedArray
     """
     dst_shape = tile.shape
-    user_opts = {} if gdal_opts is None else dict(**gdal_opts)
-    if path_is_remote(input_file, s3=True):
-        gdal_opts = dict(**GDAL_HTTP_OPTS)
-        gdal_opts.update(**user_opts)
-    else:
-        gdal_opts = user_opts
+    gdal_opts = _get_gdal_opts(input_file, gdal_opts)
+    # see mapchete.io.range_cache.RANGE_CACHE_PATH_ENV
+    if os.environ.get("MAPCHETE_RANGE_CACHE_PATH"):
+        # only imported if enabled, as it starts an HTTP server
+        from mapchete.io.range_cache import cached_path
+        input_file = cached_path(input_file, gdal_opts)
 
     if not isinstance(indexes, int):
         if indexes is None:
@@ -96,6 +103,17 @@ def read_raster_window(
         )
 
 
+def _get_gdal_opts(input_file, gdal_opts):
+    """Add default GDAL HTTP options to user options for remote files."""
+    user_opts = {} if gdal_opts is None else dict(**gdal_opts)
+    if path_is_remote(input_file, s3=True):
+        gdal_opts = dict(**GDAL_HTTP_OPTS)
+        gdal_opts.update(**user_opts)
+        return gdal_opts
+    else:
+        return user_opts
+
+
 def _get_warped_edge_array(
     tile=None, input_file=None, indexes=None, dst_shape=None, resampling=None,
     src_nodata=None, dst_nodata=None, gdal_opts=None
@@ -385,6 +403,173 @@ def resample_from_array(
     return ma.MaskedArray(dst_data, mask=dst_data == nodataval)
 
 
+def downsample_from_array(
+    in_raster=None, in_affine=None, out_tile=None, resampling="nearest",
+    nodataval=0
+):
+    """
+    Downsample array to target tile by reducing blocks of pixels.
+
+    If the target pixel size is an integer multiple of the input pixel size
+    and both grids are aligned, e.g. when building a zoom level from the zoom
+    level below, every output pixel is calculated from its block of input
+    pixels without warping. Masked pixels are ignored. Other cases and
+    resampling methods are passed on to ``resample_from_array()``.
+
+    Parameters
+    ----------
+    in_raster : array or ReferencedRaster
+    in_affine : ``Affine``
+    out_tile : ``BufferedTile``
+    resampling : string
+        block reduce is used for nearest, average, min and max; other
+        resampling methods fall back to ``resample_from_array()``
+        (default: nearest)
+    nodataval : integer or float
+        raster nodata value (default: 0)
+
+    Returns
+    -------
+    downsampled array : MaskedArray
+    """
+    if isinstance(in_raster, ReferencedRaster):
+        in_affine = in_raster.affine
+        in_raster = in_raster.data
+    factor = _block_factor(in_affine, out_tile)
+    if resampling not in BLOCK_REDUCE_METHODS or factor is None:
+        return resample_from_array(
+            in_raster=in_raster, in_affine=in_affine, out_tile=out_tile,
+            resampling=resampling, nodataval=nodataval)
+    if not isinstance(in_raster, ma.MaskedArray):
+        in_raster = ma.masked_equal(in_raster, nodataval)
+    if in_raster.ndim == 2:
+        in_raster = ma.expand_dims(in_raster, axis=0)
+    # input window covering the output tile, padded with masked pixels
+    height, width = out_tile.shape
+    row_off = int(round((out_tile.affine.f - in_affine.f) / in_affine.e))
+    col_off = int(round((out_tile.affine.c - in_affine.c) / in_affine.a))
+    window = ma.masked_all(
+        (in_raster.shape[0], height * factor, width * factor),
+        dtype=in_raster.dtype)
+    src_rows = slice(
+        max(row_off, 0), min(row_off + height * factor, in_raster.shape[1]))
+    src_cols = slice(
+        max(col_off, 0), min(col_off + width * factor, in_raster.shape[2]))
+    if src_rows.start < src_rows.stop and src_cols.start < src_cols.stop:
+        window[
+            :,
+            src_rows.start - row_off:src_rows.stop - row_off,
+            src_cols.start - col_off:src_cols.stop - col_off
+        ] = in_raster[:, src_rows, src_cols]
+    blocks = window.reshape(
+        (window.shape[0], height, factor, width, factor))
+    if resampling == "nearest":
+        # pixel containing the output pixel center
+        reduced = blocks[:, :, factor // 2, :, factor // 2]
+    elif resampling == "average":
+        reduced = blocks.mean(axis=(2, 4))
+        if np.issubdtype(in_raster.dtype, np.integer):
+            reduced = ma.round(reduced)
+    elif resampling == "min":
+        reduced = blocks.min(axis=(2, 4))
+    elif resampling == "max":
+        reduced = blocks.max(axis=(2, 4))
+    mask = ma.getmaskarray(reduced)
+    return ma.masked_array(
+        data=np.where(mask, nodataval, reduced.data).astype(in_raster.dtype),
+        mask=mask, fill_value=nodataval)
+
+
+def _block_factor(in_affine, out_tile):
+    """Return integer downsampling factor if grids are aligned, else None."""
+    factor = out_tile.pixel_x_size / in_affine.a
+    if (
+        round(factor) < 1 or
+        abs(factor - round(factor)) > 1e-6 or
+        abs(out_tile.pixel_y_size / -in_affine.e - factor) > 1e-6
+    ):
+        return None
+    for offset in [
+        (out_tile.affine.c - in_affine.c) / in_affine.a,
+        (out_tile.affine.f - in_affine.f) / in_affine.e
+    ]:
+        if abs(offset - round(offset)) > 1e-6:
+            return None
+    return int(round(factor))
+
+
+def tile_coordinates(tile, crs):
+    """
+    Return pixel center coordinates of a tile in another CRS.
+
+    Coordinates which cannot be transformed are returned as NaN.
+
+    Parameters
+    ----------
+    tile : ``BufferedTile``
+    crs : ``rasterio.crs.CRS``
+        target CRS
+
+    Returns
+    -------
+    coordinates : tuple
+        two float64 arrays (x and y) with tile shape
+    """
+    cols = tile.affine.c + (np.arange(tile.width) + 0.5) * tile.affine.a
+    rows = tile.affine.f + (np.arange(tile.height) + 0.5) * tile.affine.e
+    xs, ys = np.meshgrid(cols, rows)
+    xs, ys = transform(tile.crs, crs, xs.ravel(), ys.ravel())
+    xs, ys = [
+        np.array(coords, dtype="float64").reshape(tile.shape)
+        for coords in (xs, ys)
+    ]
+    invalid = ~np.isfinite(xs) | ~np.isfinite(ys)
+    xs[invalid] = np.nan
+    ys[invalid] = np.nan
+    return xs, ys
+
+
+def sample_from_array(in_raster=None, in_affine=None, coordinates=None):
+    """
+    Sample array at coordinates using nearest neighbour.
+
+    Together with ``tile_coordinates()``, this reprojects an array into a
+    tile. As the coordinates can be reused, all bands are sampled at once and
+    repeated requests of the same tile do not have to transform coordinates
+    again.
+
+    Parameters
+    ----------
+    in_raster : array or ReferencedRaster
+    in_affine : ``Affine`` required if in_raster is an array
+    coordinates : tuple
+        x and y coordinate arrays in the CRS of in_raster
+
+    Returns
+    -------
+    sampled array : MaskedArray
+        array with coordinates shape, masked where coordinates are outside of
+        in_raster, invalid or where in_raster is masked
+    """
+    if isinstance(in_raster, ReferencedRaster):
+        in_affine = in_raster.affine
+        in_raster = in_raster.data
+    in_raster = ma.masked_array(in_raster, copy=False)
+    xs, ys = coordinates
+    with np.errstate(invalid="ignore"):
+        cols = np.floor((xs - in_affine.c) / in_affine.a)
+        rows = np.floor((ys - in_affine.f) / in_affine.e)
+        outside = ~(
+            (cols >= 0) & (cols < in_raster.shape[-1]) &
+            (rows >= 0) & (rows < in_raster.shape[-2])
+        )
+    cols = np.where(outside, 0, cols).astype("int64")
+    rows = np.where(outside, 0, rows).astype("int64")
+    data = in_raster.data[..., rows, cols]
+    mask = ma.getmaskarray(in_raster)[..., rows, cols] | outside
+    return ma.masked_array(data, mask=mask, fill_value=in_raster.fill_value)
+
+
 def create_mosaic(tiles, nodata=0):
     """
     Create a mosaic from tiles.
@@ -421,64 +606,257 @@ def create_mosaic(tiles, nodata=0):
 
     # assert all tiles have same properties
     pyramid, resolution, dtype = _get_tiles_properties(tiles)
+    num_bands = tiles[-1][1].shape[0] if tiles[-1][1].ndim > 2 else 1
+    # determine mosaic shape and reference
+    shift, affine, height, width = _mosaic_layout(
+        [tile for tile, _ in tiles])
+    # initialize empty mosaic
+    mosaic = _empty_mosaic((num_bands, height, width), dtype, nodata)
+    # fill mosaic array with tile data
+    for tile, data in tiles:
+        _paste_into_mosaic(
+            mosaic, affine, tile, prepare_array(data, nodata=nodata, dtype=dtype),
+            shift)
+    return ReferencedRaster(
+        data=mosaic, affine=_unshift_affine(affine, pyramid, shift))
+
+
+def read_raster_mosaic(
+    tiles_paths, count=None, dtype=None, indexes=None, resampling="nearest",
+    src_nodata=None, dst_nodata=None, gdal_opts=None, nodata=0,
+    threads=READ_THREADS
+):
+    """
+    Read raster windows of multiple tiles concurrently into one mosaic.
+
+    Every tile is read from its file using ``read_raster_window()`` on a
+    bounded thread pool and the result is written in place into a preallocated
+    mosaic array.
+
+    Parameters
+    ----------
+    tiles_paths : list
+        pairs of BufferedTile and path to the raster file covering the tile
+    count : integer
+        number of bands if indexes is not given
+    dtype : string
+        mosaic data type
+    indexes : list or int
+        a list of band numbers; None will read all.
+    resampling : string
+        one of "nearest", "average", "bilinear" or "lanczos"
+    src_nodata : int or float, optional
+        if not set, the nodata value from the source dataset will be used
+    dst_nodata : int or float, optional
+        if not set, the nodata value from the source dataset will be used
+    gdal_opts : dict
+        GDAL options passed on to rasterio.Env()
+    nodata : integer or float
+        raster nodata value to initialize the mosaic with (default: 0)
+    threads : integer
+        maximum number of concurrent reads (default: 8)
+
+    Returns
+    -------
+    mosaic : ReferencedRaster
+    """
+    if len(tiles_paths) == 0:
+        raise ValueError("tiles_paths list is empty")
+
+    def _read(tile_path):
+        tile, path = tile_path
+        return read_raster_window(
+            path, tile, indexes=indexes, resampling=resampling,
+            src_nodata=src_nodata, dst_nodata=dst_nodata, gdal_opts=gdal_opts)
+
+    def _read_prepared(tile_path):
+        return prepare_array(_read(tile_path), nodata=nodata, dtype=dtype)
+
+    # quick return if there is just one tile
+    if len(tiles_paths) == 1:
+        tile, _ = tiles_paths[0]
+        return ReferencedRaster(
+            data=_read_prepared(tiles_paths[0]), affine=tile.affine)
+
+    if isinstance(indexes, int):
+        num_bands = 1
+    elif indexes:
+        num_bands = len(indexes)
+    elif count:
+        num_bands = count
+    else:
+        raise ValueError("either indexes or count have to be provided")
+    tiles = [tile for tile, _ in tiles_paths]
+    pyramid = tiles[0].tile_pyramid
+    shift, affine, height, width = _mosaic_layout(tiles)
+    mosaic = _empty_mosaic((num_bands, height, width), dtype, nodata)
+    # pixelbuffered tiles overlap, so paste them in the order given like
+    # create_mosaic() does
+    for tile, data in zip(
+        tiles, _imap_threaded(_read_prepared, tiles_paths, threads)
+    ):
+        _paste_into_mosaic(mosaic, affine, tile, data, shift)
+    return ReferencedRaster(
+        data=mosaic, affine=_unshift_affine(affine, pyramid, shift))
+
+
+def read_aligned_raster_tiles(
+    tiles_paths, out_tile, count=None, dtype=None, indexes=None, nodata=0,
+    dst_nodata=None, gdal_opts=None, threads=READ_THREADS
+):
+    """
+    Read raster tiles sharing the pixel grid of the output tile.
+
+    Tiles have to be from a tile pyramid with the same grid, tile size and
+    zoom level as the output tile. The raw arrays and masks are read from the
+    files and placed by index into the output array, no warping or resampling
+    is done.
+
+    Parameters
+    ----------
+    tiles_paths : list
+        pairs of BufferedTile and path to the raster file covering the tile
+    out_tile : ``BufferedTile``
+        tile the output array is created for
+    count : integer
+        number of bands if indexes is not given
+    dtype : string
+        output data type
+    indexes : list or int
+        a list of band numbers; None will read all.
+    nodata : integer or float
+        raster nodata value (default: 0)
+    dst_nodata : integer or float, optional
+        value of masked pixels in output; if not set, nodata is used
+    gdal_opts : dict
+        GDAL options passed on to rasterio.Env()
+    threads : integer
+        maximum number of concurrent reads (default: 8)
+
+    Returns
+    -------
+    raster : MaskedArray
+    """
+    if isinstance(indexes, int):
+        indexes = [indexes]
+    if indexes:
+        num_bands = len(indexes)
+    elif count:
+        num_bands = count
+    else:
+        raise ValueError("either indexes or count have to be provided")
+    dst_nodata = nodata if dst_nodata is None else dst_nodata
+    out_bbox = out_tile.bbox
+    dst_data = ma.masked_array(
+        data=np.full((num_bands, ) + out_tile.shape, dst_nodata, dtype=dtype),
+        mask=True, fill_value=dst_nodata)
+
+    def _read_window(tile_path):
+        tile, path = tile_path
+        intersection = tile.bbox.intersection(out_bbox)
+        if intersection.is_empty or intersection.area == 0:
+            return None, None
+        bounds = intersection.bounds
+        with rasterio.Env(**_get_gdal_opts(path, gdal_opts)):
+            with rasterio.open(path, "r") as src:
+                window = from_bounds(
+                    *bounds, transform=src.transform
+                ).round_lengths().round_offsets()
+                # use dataset masks like read_raster_window() does
+                return bounds, ma.masked_array(
+                    data=src.read(indexes=indexes, window=window),
+                    mask=src.read_masks(indexes=indexes, window=window) == 0)
+
+    for bounds, data in _imap_threaded(_read_window, tiles_paths, threads):
+        if data is None:
+            continue
+        minrow, maxrow, mincol, maxcol = _bounds_to_ranges(
+            bounds, out_tile.affine, out_tile.shape)
+        dst_data.data[:, minrow:maxrow, mincol:maxcol] = np.where(
+            data.mask, dst_nodata, data.data)
+        dst_data.mask[:, minrow:maxrow, mincol:maxcol] = data.mask
+    return dst_data
+
+
+def _imap_threaded(func, items, threads):
+    """Yield results of function applied on items in order using threads."""
+    if len(items) == 1:
+        yield func(items[0])
+        return
+    pool = ThreadPool(max(1, min(threads, len(items))))
+    try:
+        for result in pool.imap(func, items):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _mosaic_layout(tiles):
+    """Return antimeridian shift flag, Affine, height and width of mosaic."""
+    pyramid = tiles[0].tile_pyramid
+    resolution = tiles[0].pixel_x_size
     # just handle antimeridian on global pyramid types
     shift = _shift_required(tiles)
-    # determine mosaic shape and reference
     m_left, m_bottom, m_right, m_top = None, None, None, None
-    for tile, data in tiles:
-        num_bands = data.shape[0] if data.ndim > 2 else 1
-        left, bottom, right, top = tile.bounds
-        if shift:
-            left += pyramid.x_size / 2
-            right += pyramid.x_size / 2
-            # if tile is now shifted outside pyramid bounds, move within
-            if right > pyramid.right:
-                right -= pyramid.x_size
-                left -= pyramid.x_size
+    for tile in tiles:
+        left, bottom, right, top = _shifted_bounds(tile, pyramid, shift)
         m_left = min([left, m_left]) if m_left is not None else left
         m_bottom = min([bottom, m_bottom]) if m_bottom is not None else bottom
         m_right = max([right, m_right]) if m_right is not None else right
         m_top = max([top, m_top]) if m_top is not None else top
     height = int(round((m_top - m_bottom) / resolution))
     width = int(round((m_right - m_left) / resolution))
-    # initialize empty mosaic
-    mosaic = ma.MaskedArray(
-        data=np.full(
-            (num_bands, height, width), dtype=dtype, fill_value=nodata),
-        mask=np.ones((num_bands, height, width))
-    )
-    # create Affine
     affine = Affine(resolution, 0, m_left, 0, -resolution, m_top)
-    # fill mosaic array with tile data
-    for tile, data in tiles:
-        data = prepare_array(data, nodata=nodata, dtype=dtype)
-        t_left, t_bottom, t_right, t_top = tile.bounds
-        if shift:
-            t_left += pyramid.x_size / 2
-            t_right += pyramid.x_size / 2
-            # if tile is now shifted outside pyramid bounds, move within
-            if t_right > pyramid.right:
-                t_right -= pyramid.x_size
-                t_left -= pyramid.x_size
-        minrow, maxrow, mincol, maxcol = _bounds_to_ranges(
-            (t_left, t_bottom, t_right, t_top), affine, (height, width)
-        )
-        mosaic[:, minrow:maxrow, mincol:maxcol] = data
-        mosaic.mask[:, minrow:maxrow, mincol:maxcol] = data.mask
+    return shift, affine, height, width
+
+
+def _shifted_bounds(tile, pyramid, shift):
+    left, bottom, right, top = tile.bounds
+    if shift:
+        left += pyramid.x_size / 2
+        right += pyramid.x_size / 2
+        # if tile is now shifted outside pyramid bounds, move within
+        if right > pyramid.right:
+            right -= pyramid.x_size
+            left -= pyramid.x_size
+    return left, bottom, right, top
+
+
+def _unshift_affine(affine, pyramid, shift):
     if shift:
         # shift back output mosaic
-        affine = Affine(
-            resolution, 0, m_left - pyramid.x_size / 2, 0, -resolution, m_top
-        )
-    return ReferencedRaster(data=mosaic, affine=affine)
+        return Affine(
+            affine.a, 0, affine.c - pyramid.x_size / 2, 0, affine.e, affine.f)
+    return affine
+
+
+def _empty_mosaic(shape, dtype, nodata):
+    return ma.MaskedArray(
+        data=np.full(shape, dtype=dtype, fill_value=nodata),
+        mask=np.ones(shape, dtype=bool)
+    )
+
+
+def _paste_into_mosaic(mosaic, affine, tile, data, shift):
+    left, _, _, top = _shifted_bounds(tile, tile.tile_pyramid, shift)
+    # round offsets and use tile shape to avoid floating point errors
+    minrow = int(round((top - affine.f) / affine.e))
+    mincol = int(round((left - affine.c) / affine.a))
+    maxrow, maxcol = minrow + data.shape[-2], mincol + data.shape[-1]
+    mosaic.data[:, minrow:maxrow, mincol:maxcol] = data.data
+    mosaic.mask[:, minrow:maxrow, mincol:maxcol] = data.mask
 
 
 def _bounds_to_ranges(bounds, affine, shape):
-    return map(int, itertools.chain(
-            *from_bounds(
-                *bounds, transform=affine, height=shape[-2], width=shape[-1]
-            ).round_lengths().round_offsets().toranges()
-        )
+    # round rows and columns separately to avoid floating point errors from
+    # shrinking the range
+    left, bottom, right, top = bounds
+    return (
+        int(round((top - affine.f) / affine.e)),
+        int(round((bottom - affine.f) / affine.e)),
+        int(round((left - affine.c) / affine.a)),
+        int(round((right - affine.c) / affine.a))
     )
 
 
@@ -497,9 +875,13 @@ def _get_tiles_properties(tiles):
 
 def _shift_required(tiles):
     """Determine if temporary shift is required to deal with antimeridian."""
-    if tiles[0][0].tile_pyramid.is_global:
-        # check if tiles are all connected to each other
-        bbox = cascaded_union([tile.bbox for tile, _ in tiles])
+    if tiles[0].tile_pyramid.is_global:
+        # check if tiles are all connected to each other, closing gaps from
+        # floating point errors
+        bbox = cascaded_union([
+            tile.bbox.buffer(tile.pixel_x_size / 2, join_style=2)
+            for tile in tiles
+        ])
         connected = True if bbox.geom_type != "MultiPolygon" else False
         # if tiles are not connected, shift by half the globe
         return True if not connected else False
@@ -63,7 +63,6 @@ setup(
         'cachetools',
         'tqdm'
     ] if not on_rtd else [],
-    extra_require={'contours': ['matplotlib']},
     classifiers=[
         'Development Status :: 3 - Alpha',
         'Intended Audience :: Developers',
@@ -6,6 +6,8 @@ import os
 import pytest
 import shutil
 import six
+import subprocess
+import sys
 import yaml
 
 from mapchete.cli.serve import create_app
@@ -45,6 +47,55 @@ def mp_tmpdir():
     shutil.rmtree(TEMP_DIR, ignore_errors=True)
 
 
+class RangeServer(object):
+    """HTTP server subprocess serving test data with range requests."""
+
+    def __init__(self, log_file):
+        self.log_file = log_file
+        self._process = subprocess.Popen(
+            [sys.executable, os.path.join(SCRIPT_DIR, "range_server.py"),
+             log_file],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.url = "http://127.0.0.1:%s" % int(
+            self._process.stdout.readline())
+
+    @property
+    def requests(self):
+        """Served ranges as (path, first byte, last byte)."""
+        if not os.path.isfile(self.log_file):
+            return []
+        with open(self.log_file) as src:
+            return [
+                (path, int(start), int(end))
+                for path, start, end in (line.split() for line in src)
+            ]
+
+    def clear(self):
+        """Remove logged requests."""
+        if os.path.isfile(self.log_file):
+            os.remove(self.log_file)
+
+    def set_etag(self, etag):
+        """Change ETag of served files."""
+        with open(self.log_file + ".etag", "w") as dst:
+            dst.write(etag)
+
+    def close(self):
+        """Stop server."""
+        self._process.stdin.close()
+        self._process.wait()
+
+
+# local HTTP server serving test data, it has to run in another process as
+# GDAL does not release the GIL
+@yield_fixture
+def range_server(mp_tmpdir):
+    """Start HTTP server supporting range requests."""
+    server = RangeServer(os.path.join(mp_tmpdir, "range_server.log"))
+    yield server
+    server.close()
+
+
 @pytest.fixture
 def wkt_geom():
     """Example WKT geometry."""
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+HTTP server serving test data with support for range requests.
+
+Usage: python range_server.py <log_file>
+
+The server port is written to standard output and the server runs until
+standard input is closed. Served ranges are appended to the log file, the
+ETag is read from "<log_file>.etag" if present.
+"""
+
+import os
+import re
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+import sys
+import threading
+
+TESTDATA_DIR = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), "testdata")
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def _respond(self, send_body):
+        path = os.path.join(TESTDATA_DIR, self.path.lstrip("/"))
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, "rb") as src:
+            data = src.read()
+        start, end = 0, len(data) - 1
+        match = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+        if match:
+            start, end = int(match.group(1)), min(
+                int(match.group(2)), len(data) - 1)
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", "bytes %s-%s/%s" % (start, end, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("ETag", self._etag())
+        self.end_headers()
+        if send_body:
+            with open(self.server.log_file, "a") as log:
+                log.write("%s %s %s\n" % (self.path, start, end))
+            self.wfile.write(data[start:end + 1])
+
+    def _etag(self):
+        try:
+            with open(self.server.log_file + ".etag") as src:
+                return src.read()
+        except IOError:
+            return '"1"'
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    server = _Server(("127.0.0.1", 0), _Handler)
+    server.log_file = sys.argv[1]
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    sys.stdout.write("%s\n" % server.server_port)
+    sys.stdout.flush()
+    sys.stdin.read()
+    server.shutdown()
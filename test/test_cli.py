@@ -1,11 +1,16 @@
 """Test Mapchete main module and processing."""
 
 import fiona
+import json
 import numpy as np
 import os
 import pytest
+import shutil
 from shapely import wkt
 import subprocess
+import sys
+import threading
+import time
 import rasterio
 from rasterio.io import MemoryFile
 import yaml
@@ -13,6 +18,7 @@ import yaml
 import mapchete
 from mapchete.cli.main import MapcheteCLI
 from mapchete.errors import MapcheteProcessOutputError
+from mapchete.tile import BufferedTilePyramid
 
 
 def _getstatusoutput(command):
@@ -24,6 +30,18 @@ def _getstatusoutput(command):
     return sp.returncode, sp.stdout.read()
 
 
+def test_help_imports():
+    """Subcommand modules are not imported to show help."""
+    code = (
+        "import sys; from mapchete.cli.main import main; "
+        "sys.argv = ['mapchete', '--help']\n"
+        "try:\n    main()\nexcept SystemExit:\n    pass\n"
+        "assert 'flask' not in sys.modules\n"
+        "assert 'mapchete.cli.serve' not in sys.modules"
+    )
+    assert subprocess.call([sys.executable, "-c", code]) == 0
+
+
 def test_main():
     """Main CLI."""
     for command in [
@@ -122,6 +140,24 @@ def test_execute_multiprocessing(mp_tmpdir, cleantopo_br, cleantopo_br_tif):
     MapcheteCLI(args)
 
 
+def test_execute_multiple_single_process_options(
+    mp_tmpdir, cleantopo_br, cleantopo_tl
+):
+    """Options of a single process cannot be used with multiple processes."""
+    for option in [
+        ["--tile", "5", "0", "0"],
+        ["--point", "0", "0"],
+        ["--input_file", "dummy.tif"],
+        ["--max_chunksize", "4"],
+        ["--subtrees"],
+        ["--prefetch_input"]
+    ]:
+        with pytest.raises(ValueError):
+            MapcheteCLI([
+                None, 'execute', cleantopo_br.path, cleantopo_tl.path
+            ] + option)
+
+
 def test_execute_debug(mp_tmpdir, example_mapchete):
     """Using debug output."""
     args = [
@@ -222,8 +258,12 @@ def test_pyramid_png(cleantopo_br_tif, mp_tmpdir):
 
 def test_pyramid_minmax(cleantopo_br_tif, mp_tmpdir):
     """Automatic tile pyramid creation using minmax scale."""
+    # band statistics are cached next to the input file
+    input_file = os.path.join(mp_tmpdir, "cleantopo_br.tif")
+    shutil.copy(cleantopo_br_tif, input_file)
     MapcheteCLI([
-        None, 'pyramid', cleantopo_br_tif, mp_tmpdir, "-s", "minmax_scale"])
+        None, 'pyramid', input_file, mp_tmpdir, "-s", "minmax_scale"])
+    assert os.path.isfile(input_file + ".mapchete_stats.json")
     for zoom, row, col in [(4, 15, 15), (3, 7, 7)]:
         out_file = os.path.join(
             *[mp_tmpdir, str(zoom), str(row), str(col)+".tif"])
@@ -234,6 +274,58 @@ def test_pyramid_minmax(cleantopo_br_tif, mp_tmpdir):
             assert data.mask.any()
 
 
+def test_pyramid_minmax_statistics(cleantopo_br_tif, mp_tmpdir):
+    """Band statistics are computed in chunks and cached."""
+    from mapchete.cli import pyramid
+    input_file = os.path.join(mp_tmpdir, "cleantopo_br.tif")
+    sidecar = input_file + pyramid.STATS_SIDECAR_SUFFIX
+    shutil.copy(cleantopo_br_tif, input_file)
+    with rasterio.open(input_file) as src:
+        band = src.read(1, masked=True)
+        control = ((band.min(), band.max()), )
+        # read in chunks of a few rows
+        chunk_bytes = pyramid.STATS_CHUNK_BYTES
+        try:
+            pyramid.STATS_CHUNK_BYTES = src.width * 2 * 7
+            assert pyramid.band_minmax(src, [1]) == control
+        finally:
+            pyramid.STATS_CHUNK_BYTES = chunk_bytes
+    assert os.path.isfile(sidecar)
+    # cached values are used
+    with open(sidecar) as src:
+        content = json.load(src)
+    content["bands"]["1"] = [1, 2]
+    with open(sidecar, "w") as dst:
+        json.dump(content, dst)
+    with rasterio.open(input_file) as src:
+        assert pyramid.band_minmax(src, [1]) == ((1, 2), )
+    # changed input file is read again, overviews are not used
+    with rasterio.open(input_file, "r+") as dst:
+        dst.build_overviews([2, 4])
+    with rasterio.open(input_file) as src:
+        assert pyramid.band_minmax(src, [1]) == control
+    # exact GDAL statistics are used, approximate statistics are not
+    for approximate, expected in [("NO", ((1, 2), )), ("YES", control)]:
+        with rasterio.open(input_file, "r+") as dst:
+            dst.update_tags(
+                1, STATISTICS_MINIMUM=1, STATISTICS_MAXIMUM=2,
+                STATISTICS_APPROXIMATE=approximate)
+        os.remove(sidecar)
+        with rasterio.open(input_file) as src:
+            assert pyramid.band_minmax(src, [1]) == expected
+    # bands without valid pixels
+    for dtype, expected in [("uint16", (0, 65535)), ("float32", (0., 1.))]:
+        empty_file = os.path.join(mp_tmpdir, "empty_%s.tif" % dtype)
+        with rasterio.open(
+            empty_file, "w", driver="GTiff", count=1, dtype=dtype, nodata=0,
+            width=10, height=10, crs="EPSG:4326",
+            transform=rasterio.transform.from_origin(0, 10, 1, 1)
+        ) as dst:
+            dst.write(np.zeros((1, 10, 10), dtype=dtype))
+        with rasterio.open(empty_file) as src:
+            assert pyramid.band_minmax(src, [1]) == (expected, )
+
+
 def test_pyramid_dtype(cleantopo_br_tif, mp_tmpdir):
     """Automatic tile pyramid creation using dtype scale."""
     MapcheteCLI([
@@ -293,6 +385,25 @@ def test_pyramid_zoom_maxmin(cleantopo_br_tif, mp_tmpdir):
         assert not os.path.isfile(out_file)
 
 
+def test_pyramid_cascade(cleantopo_br_tif, mp_tmpdir):
+    """Lower zoom levels are built from the zoom level below."""
+    MapcheteCLI([
+        None, 'pyramid', cleantopo_br_tif, mp_tmpdir, "-z", "3", "4",
+        "-pt", "geodetic", "-r", "average"])
+    # only one child tile intersects with the input raster
+    with rasterio.open(os.path.join(mp_tmpdir, "4", "15", "31.tif")) as src:
+        child = src.read(1, masked=True)
+    with rasterio.open(os.path.join(mp_tmpdir, "3", "7", "15.tif")) as src:
+        parent = src.read(1, masked=True)
+    blocks = child.reshape(128, 2, 128, 2).mean(axis=(1, 3)).round()
+    assert parent[:128].mask.all()
+    assert parent[:, :128].mask.all()
+    assert not parent.mask.all()
+    assert np.array_equal(parent[128:, 128:].mask, blocks.mask)
+    assert np.array_equal(
+        parent[128:, 128:].compressed(), blocks.compressed())
+
+
 # TODO pyramid specific bounds
 # TODO pyramid overwrite
 
@@ -307,6 +418,8 @@ def test_serve_cli_params(cleantopo_br):
         [None, 'serve', cleantopo_br.path],
         [None, 'serve', cleantopo_br.path, "--port", "5001"],
         [None, 'serve', cleantopo_br.path, "--internal_cache", "512"],
+        [None, 'serve', cleantopo_br.path, "--workers", "2"],
+        [None, 'serve', cleantopo_br.path, "--prefetch"],
         [None, 'serve', cleantopo_br.path, "--zoom", "5"],
         [None, 'serve', cleantopo_br.path, "--bounds", "-1", "-1", "1", "1"],
         [None, 'serve', cleantopo_br.path, "--overwrite"],
@@ -352,6 +465,237 @@ def test_serve(client, mp_tmpdir):
     assert response.status_code == 404
 
 
+def test_serve_cached_tiles(client, mp_tmpdir, monkeypatch):
+    """Encoded tiles are cached and conditional requests return 304."""
+    from mapchete.cli import serve
+    tile_url = '/wmts_simple/1.0.0/cleantopo_br/default/WGS84/5/31/63.png'
+    response = client.get(tile_url)
+    assert response.status_code == 200
+    etag = response.headers["ETag"].strip('"')
+    assert "no-cache" in response.headers["Cache-Control"]
+    content = response.get_data()
+    other = client.get(tile_url.replace("63.png", "62.png"))
+
+    # no data is read or processed for cached tiles
+    def _fail(*args):
+        raise AssertionError("tile content generated again")
+    monkeypatch.setattr(serve, "_tile_content", _fail)
+    response = client.get(tile_url)
+    assert response.headers["ETag"].strip('"') == etag
+    assert response.get_data() == content
+    # ETag depends on tile
+    assert other.headers["ETag"].strip('"') != etag
+    # conditional request
+    response = client.get(tile_url, headers={"If-None-Match": '"%s"' % etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"].strip('"') == etag
+    assert not response.get_data()
+    # unknown process
+    response = client.get(tile_url.replace("cleantopo_br", "unknown"))
+    assert response.status_code == 404
+
+
+def test_serve_output_version(mp_tmpdir, cleantopo_br):
+    """ETag changes if stored output is rewritten by another run."""
+    from mapchete.cli.serve import create_app
+    tile = (5, 31, 63)
+    tile_url = "/wmts_simple/1.0.0/cleantopo_br/default/WGS84/%s/%s/%s.png" % (
+        tile)
+    for mode in ["continue", "readonly"]:
+        with mapchete.open(cleantopo_br.path, mode="overwrite") as mp:
+            web_tile = BufferedTilePyramid("geodetic").tile(*tile)
+            mp.get_raw_output(web_tile)
+            path = mp.config.output.get_path(
+                mp.config.output_pyramid.intersecting(web_tile)[0])
+        client = create_app(
+            mapchete_files=[cleantopo_br.path], mode=mode).test_client()
+        etag = client.get(tile_url).headers["ETag"]
+        response = client.get(tile_url, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        # output rewritten by another run
+        mtime = os.path.getmtime(path) + 10
+        os.utime(path, (mtime, mtime))
+        response = client.get(tile_url, headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+
+
+def test_serve_readonly_passthrough(mp_tmpdir, dem_to_hillshade):
+    """Existing PNG output tiles are sent from disk in readonly mode."""
+    from mapchete.cli.serve import create_app
+    tile = (5, 31, 63)
+    with mapchete.open(dem_to_hillshade.path, zoom=5) as mp:
+        mp.get_raw_output(tile)
+        path = mp.config.output.get_path(mp.config.output_pyramid.tile(*tile))
+    with open(path, "rb") as src:
+        stored = src.read()
+    tile_url = "/wmts_simple/1.0.0/dem_to_hillshade/default/WGS84/%s/%s/%s" % (
+        tile)
+    client = create_app(
+        mapchete_files=[dem_to_hillshade.path], mode="readonly"
+    ).test_client()
+    response = client.get(tile_url + ".png")
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "image/png"
+    assert response.get_data() == stored
+    etag = response.headers["ETag"]
+    response = client.get(tile_url + ".png", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    # tiles not available on disk are rendered as usual
+    response = client.get(tile_url.replace("63", "62") + ".png")
+    assert response.status_code == 200
+    with MemoryFile(response.get_data()) as memfile:
+        with memfile.open() as dataset:
+            assert not dataset.read().any()
+
+
+def test_serve_readonly_passthrough_area(
+    mp_tmpdir, dem_to_hillshade, monkeypatch
+):
+    """Files outside of process zoom levels or bounds are not sent."""
+    from mapchete.cli import serve
+    tile = (5, 31, 63)
+    with mapchete.open(dem_to_hillshade.path, zoom=5) as mp:
+        mp.get_raw_output(tile)
+    tile_url = "/wmts_simple/1.0.0/dem_to_hillshade/default/WGS84/%s/%s/%s" % (
+        tile)
+
+    def _fail(*args):
+        raise AssertionError("file sent from disk")
+    monkeypatch.setattr(serve, "_file_response", _fail)
+    for kwargs in [dict(zoom=[0, 4]), dict(bounds=[-180, -90, 0, 0])]:
+        client = serve.create_app(
+            mapchete_files=[dem_to_hillshade.path], mode="readonly", **kwargs
+        ).test_client()
+        response = client.get(tile_url + ".png")
+        assert response.status_code == 200
+
+
+def test_serve_workers(mp_tmpdir, cleantopo_br):
+    """Execute process tiles in worker processes."""
+    from mapchete.cli.serve import create_app, close_app
+    tile_url = '/wmts_simple/1.0.0/cleantopo_br/default/WGS84/5/31/63.png'
+    responses = []
+    for workers in [None, 2]:
+        app = create_app(
+            mapchete_files=[cleantopo_br.path], mode="memory", workers=workers)
+        pool = app.extensions["mapchete_pool"]
+        try:
+            response = app.test_client().get(tile_url)
+            assert response.status_code == 200
+            responses.append(response.get_data())
+        finally:
+            close_app(app)
+        if workers:
+            # worker processes are stopped
+            assert not any(p.is_alive() for p in pool._pool)
+    assert responses[0] == responses[1]
+
+
+def test_serve_scheduler():
+    """Waiting tile requests are ordered by zoom and recency."""
+    from mapchete.cli.serve import _TileScheduler, _Ticket, _Cancelled
+    scheduler = _TileScheduler(slots=1, max_queued=3)
+    release = threading.Event()
+    order = []
+
+    def _request(name, zoom, **kwargs):
+        try:
+            scheduler.run(zoom, lambda: order.append(name), **kwargs)
+        except _Cancelled:
+            order.append("cancelled " + name)
+
+    def _wait_queued(n):
+        while len(scheduler.queued) != n:
+            time.sleep(0.01)
+
+    blocking = threading.Thread(
+        target=scheduler.run, args=(5, release.wait))
+    blocking.start()
+    while not scheduler.running:
+        time.sleep(0.01)
+    threads = []
+    for name, zoom in [("a", 5), ("b", 6), ("c", 5)]:
+        threads.append(threading.Thread(target=_request, args=(name, zoom)))
+        threads[-1].start()
+        _wait_queued(len(threads))
+    # too many waiting requests: oldest request of another zoom level is
+    # dropped, then the disconnected client
+    _request("d", 5, is_disconnected=lambda: True)
+    assert order == ["cancelled b", "cancelled d"]
+    release.set()
+    for thread in [blocking] + threads:
+        thread.join()
+    # most recent first
+    assert order == ["cancelled b", "cancelled d", "c", "a"]
+    assert scheduler.idle()
+    # cancelling a ticket again does not fail
+    ticket = _Ticket(5, 0, False)
+    with scheduler._condition:
+        scheduler.queued.append(ticket)
+        scheduler._cancel(ticket)
+        scheduler._cancel(ticket)
+    assert ticket.cancelled
+    assert scheduler.idle()
+
+
+def test_serve_prefetch_vector(mp_tmpdir, geojson, monkeypatch):
+    """Vector tiles are prefetched outside of requests."""
+    from mapchete.cli import serve
+    encoded = []
+    errors = []
+    encode = serve._encode
+
+    def _encode(*args):
+        try:
+            result = encode(*args)
+        except Exception as e:
+            errors.append(e)
+            raise
+        encoded.append(result)
+        return result
+
+    monkeypatch.setattr(serve, "_encode", _encode)
+    client = serve.create_app(
+        mapchete_files=[geojson.path], mode="memory", prefetch=True
+    ).test_client()
+    tile_url = '/wmts_simple/1.0.0/geojson/default/WGS84/4/5/10.geojson'
+    assert client.get(tile_url).status_code == 200
+    # requested tile, parent and eight neighbors
+    for _ in range(500):
+        if len(encoded) + len(errors) == 10:
+            break
+        time.sleep(0.01)
+    assert not errors
+    assert len(encoded) == 10
+
+    # prefetched tiles are served from cache
+    def _fail(*args):
+        raise AssertionError("tile content generated again")
+    monkeypatch.setattr(serve, "_tile_content", _fail)
+    response = client.get(tile_url.replace("10.geojson", "11.geojson"))
+    assert response.status_code == 200
+    assert isinstance(json.loads(response.get_data().decode("utf-8")), list)
+
+
+def test_serve_prefetcher():
+    """Parent and neighbor tiles are prefetched."""
+    from mapchete.cli.serve import _Prefetcher, _TileScheduler
+    prefetched = []
+    web_pyramid = BufferedTilePyramid("geodetic")
+    prefetcher = _Prefetcher(
+        _TileScheduler(slots=1), web_pyramid,
+        lambda *args: prefetched.append(args))
+    prefetcher.add("process", web_pyramid.tile(5, 0, 0), "png")
+    for _ in range(100):
+        if len(prefetched) == 6:
+            break
+        time.sleep(0.01)
+    tile_ids = set(tile.id for _, tile, _ in prefetched)
+    assert tile_ids == set([
+        (4, 0, 0), (5, 0, 1), (5, 1, 0), (5, 1, 1), (5, 0, 63), (5, 1, 63)])
+
+
 def test_index_geojson(mp_tmpdir, cleantopo_br):
     # execute process at zoom 3
     MapcheteCLI([None, 'execute', cleantopo_br.path, '-z', '3', '--debug'])
@@ -4,10 +4,15 @@
 import os
 import numpy as np
 import numpy.ma as ma
-from shapely.geometry import Point, GeometryCollection
+import pytest
+from shapely.geometry import Point, GeometryCollection, shape
+import pickle
+import subprocess
+import sys
 
 import mapchete
 from mapchete import MapcheteProcess
+from mapchete.tile import BufferedTilePyramid
 
 
 def test_clip(geojson):
@@ -55,6 +60,62 @@ def test_clip(geojson):
             assert not clipped.mask.all()
 
 
+def test_vector_clipper(geojson):
+    """Clip arrays with prepared geometries and cached masks."""
+    from mapchete.commons.clip import VectorClipper
+    with mapchete.open(geojson.path) as mp:
+        tile = next(mp.get_process_tiles(zoom=4))
+        tile_process = MapcheteProcess(tile, params=mp.config.params_at_zoom(4))
+        with tile_process.open("file1") as vector_file:
+            features = vector_file.read()
+        test_array = ma.masked_array(np.ones(tile_process.tile.shape))
+        clipper = VectorClipper(features)
+        for inverted in [False, True]:
+            expected = tile_process.clip(
+                test_array, features, inverted=inverted)
+            # cached masks are not changed by subsequent calls
+            for _ in range(2):
+                clipped = tile_process.clip(
+                    test_array, clipper, inverted=inverted)
+                assert np.array_equal(clipped.mask, expected.mask)
+        # 3D array
+        clipped = tile_process.clip(
+            ma.masked_array(np.ones((2, ) + tile_process.tile.shape)), clipper)
+        assert np.array_equal(clipped.mask[1], ~expected.mask)
+        with pytest.raises(ValueError):
+            tile_process.clip(test_array, clipper, clip_buffer=1)
+        # tiles completely inside or outside are not rasterized
+        inside = VectorClipper([dict(geometry=tile.bbox.buffer(1))])
+        assert not inside.clip(test_array, tile.affine).mask.any()
+        assert inside.clip(test_array, tile.affine, inverted=True).mask.all()
+        outside = VectorClipper(
+            [dict(geometry=tile.bbox.centroid.buffer(0.1))])
+        pyramid = mp.config.process_pyramid
+        far_tile = pyramid.tile(tile.zoom, 0, 0)
+        if far_tile.bbox.intersects(tile.bbox):
+            far_tile = pyramid.tile(
+                tile.zoom, pyramid.matrix_height(tile.zoom) - 1,
+                pyramid.matrix_width(tile.zoom) - 1)
+        assert outside.clip(
+            test_array, far_tile.affine, cache_key=far_tile.id).mask.all()
+        assert outside._cache[
+            (far_tile.id, far_tile.shape, tuple(far_tile.affine))] is True
+        # empty clipper
+        assert VectorClipper([]).mask(tile.shape, tile.affine).all()
+        # pickle
+        assert pickle.loads(pickle.dumps(clipper)).geometries
+
+
+def test_lazy_import():
+    """Commons modules are not imported with mapchete."""
+    code = (
+        "import sys, mapchete; "
+        "assert 'matplotlib' not in sys.modules; "
+        "assert 'mapchete.commons.contours' not in sys.modules"
+    )
+    assert subprocess.call([sys.executable, "-c", code]) == 0
+
+
 def test_contours(cleantopo_tl):
     """Extract contours from array."""
     with mapchete.open(cleantopo_tl.path) as mp:
@@ -76,6 +137,35 @@ def test_contours(cleantopo_tl):
             assert contours
 
 
+def test_contours_synthetic():
+    """Extract contours from a cone with masked nodata area."""
+    from mapchete.commons.contours import extract_contours
+    from mapchete.tile import BufferedTilePyramid
+    tile = BufferedTilePyramid("geodetic", tile_size=100).tile(5, 5, 5)
+    rows, cols = np.mgrid[0:100, 0:100]
+    cone = 100 - np.hypot(rows - 50, cols - 50)
+    # closed rings around peak
+    contours = extract_contours(cone, tile, interval=20)
+    assert set(c["properties"]["elev"] for c in contours) == set(
+        [40, 60, 80])
+    for contour in contours:
+        assert shape(contour["geometry"]).within(tile.bbox)
+        if contour["properties"]["elev"] > 40:
+            coords = contour["geometry"]["coordinates"]
+            assert coords[0] == coords[-1]
+    # masked pixels split lines and are left out
+    masked = ma.masked_array(cone, mask=np.zeros(cone.shape, dtype=bool))
+    masked.mask[:, :50] = True
+    contours = extract_contours(masked, tile, interval=20)
+    assert contours
+    for contour in contours:
+        coords = contour["geometry"]["coordinates"]
+        assert coords[0] != coords[-1]
+        assert min(x for x, _ in coords) >= (tile.affine * (50, 0))[0]
+    # all masked
+    assert extract_contours(ma.masked_all((10, 10)), tile) == []
+
+
 def test_hillshade(cleantopo_tl):
     """Render hillshade from array."""
     with mapchete.open(cleantopo_tl.path) as mp:
@@ -84,3 +174,161 @@ def test_hillshade(cleantopo_tl):
         with tile_process.open("file1") as dem:
             shade = tile_process.hillshade(dem.read())
             assert isinstance(shade, np.ndarray)
+
+
+def test_hillshade_float64():
+    """Compare float32 hillshade with former float64 implementation."""
+    from mapchete.commons.hillshade import hillshade
+    from mapchete.tile import BufferedTilePyramid
+    tile = BufferedTilePyramid(
+        "geodetic", metatiling=8, pixelbuffer=1).tile(10, 0, 0)
+    rows, cols = np.mgrid[0:tile.height, 0:tile.width] / 100.
+    elevation = 1000 + 400 * np.sin(cols) * np.cos(rows)
+    elevation += np.random.RandomState(0).normal(0, 2, tile.shape)
+    elevation = ma.masked_array(
+        elevation.astype("float32"), mask=np.zeros(tile.shape, dtype=bool))
+    # former kernel using nine shifted windows in float64
+    height, width = tile.height - 2, tile.width - 2
+    window = [
+        elevation.data[row:(row + height), col:(col + width)].astype("float64")
+        for row in range(3) for col in range(3)
+    ]
+    x = (
+        (window[0] + window[3] + window[3] + window[6]) -
+        (window[2] + window[5] + window[5] + window[8])
+    ) / (8.0 * tile.pixel_x_size)
+    y = (
+        (window[6] + window[7] + window[7] + window[8]) -
+        (window[0] + window[1] + window[1] + window[2])
+    ) / (8.0 * -tile.pixel_y_size)
+    slope = np.pi / 2 - np.arctan(np.sqrt(x * x + y * y))
+    aspect = np.arctan2(x, y)
+    altitude, azimuth = np.radians(45.), np.radians(315. - 90.)
+    shaded = (
+        np.sin(altitude) * np.sin(slope) +
+        np.cos(altitude) * np.cos(slope) * np.cos(azimuth - aspect)
+    )
+    expected = (((shaded + 1.) / 2) * -255.).astype("uint8")
+    diff = np.abs(
+        hillshade(elevation, MapcheteProcess(tile)).data[1:-1, 1:-1].astype(
+            "int16") - expected.astype("int16"))
+    # float32 rounding only changes pixels with almost flat gradients
+    assert diff.max() <= 8
+    assert (diff > 1).sum() <= 10
+    assert (diff > 0).mean() < 0.001
+
+
+def test_hillshades(cleantopo_tl):
+    """Render hillshades from multiple directions."""
+    with mapchete.open(cleantopo_tl.path) as mp:
+        tile = next(mp.get_process_tiles(zoom=4))
+        tile_process = MapcheteProcess(tile, params=mp.config.params_at_zoom(4))
+        with tile_process.open("file1") as dem:
+            elevation = dem.read()
+        azimuths = [270., 315., 45.]
+        shades = tile_process.hillshades(elevation, azimuths=azimuths)
+        assert len(shades) == 3
+        for azimuth, shade in zip(azimuths, shades):
+            assert ma.allequal(
+                shade, tile_process.hillshade(elevation, azimuth=azimuth))
+        # blending with one light source is equal to hillshade
+        assert ma.allequal(
+            tile_process.multidirectional_hillshade(
+                elevation, azimuths=[315.], weights=[2.]),
+            shades[1])
+        blended = tile_process.multidirectional_hillshade(
+            elevation, azimuths=azimuths, weights=[1, 2, 1])
+        assert blended.shape == elevation.shape
+        assert blended.dtype == "uint8"
+        with pytest.raises(ValueError):
+            tile_process.multidirectional_hillshade(
+                elevation, azimuths=azimuths, weights=[1])
+
+
+def test_slope_aspect():
+    """Slope and aspect of inclined plane."""
+    from mapchete.commons.hillshade import calculate_slope_aspect
+    elevation = np.tile(np.arange(10, dtype="uint16") * 10, (8, 1))
+    slope, aspect = calculate_slope_aspect(elevation, 2., 2.)
+    assert slope.shape == aspect.shape == (6, 8)
+    assert slope.dtype == "float32"
+    assert np.allclose(slope, np.pi / 2 - np.arctan(5.))
+    assert np.allclose(aspect, -np.pi / 2)
+
+
+def test_focal():
+    """Focal operations ignore masked pixels and array borders."""
+    from mapchete.commons import focal
+    data = np.arange(30, dtype="float64").reshape(5, 6)
+    mask = np.zeros(data.shape, dtype=bool)
+    mask[2, 3] = True
+    array = ma.masked_array(data, mask=mask)
+
+    def _reference(func, size):
+        radius = size // 2
+        out = np.zeros(data.shape)
+        for row in range(data.shape[0]):
+            for col in range(data.shape[1]):
+                window = array[
+                    max(row - radius, 0):row + radius + 1,
+                    max(col - radius, 0):col + radius + 1
+                ]
+                if window.count():
+                    out[row, col] = func(window.compressed())
+        return out
+
+    for size in [1, 3, 5]:
+        for func, reference in [
+            (focal.focal_mean, np.mean),
+            (focal.focal_median, np.median),
+            (focal.focal_min, np.min),
+            (focal.focal_max, np.max),
+        ]:
+            result = func(array, size=size)
+            assert isinstance(result, ma.MaskedArray)
+            assert result.shape == data.shape
+            assert np.array_equal(result.mask, mask)
+            assert np.allclose(
+                result[~mask], _reference(reference, size)[~mask])
+    # keep dtype for minimum and maximum, e.g. for boolean masks
+    dilated = focal.focal_max(np.eye(4, dtype=bool))
+    assert dilated.dtype == bool
+    assert dilated.sum() == 14
+    # 3D arrays are processed per band
+    assert focal.focal_mean(np.stack([data, data]), size=3).shape == (2, 5, 6)
+    # TPI of inclined plane is zero except at borders
+    tpi = focal.tpi(data, size=3)
+    assert np.allclose(tpi[1:-1, 1:-1], 0)
+    with pytest.raises(ValueError):
+        focal.focal_mean(data, size=2)
+    with pytest.raises(ValueError):
+        focal.focal_mean(data[0], size=3)
+
+
+def test_focal_process(cleantopo_tl, caplog):
+    """Focal operations and slope from within process."""
+    with mapchete.open(cleantopo_tl.path) as mp:
+        tile = next(mp.get_process_tiles(zoom=4))
+        tile_process = MapcheteProcess(tile, params=mp.config.params_at_zoom(4))
+        with tile_process.open("file1") as dem:
+            arr = dem.read()
+            for operation in ["mean", "median", "min", "max", "tpi"]:
+                result = tile_process.focal(arr, operation=operation)
+                assert result.shape == arr.shape
+            with pytest.raises(ValueError):
+                tile_process.focal(arr, operation="mode")
+            slope = tile_process.slope(arr)
+            assert slope.shape == arr.shape
+            assert slope.dtype == "float32"
+            assert slope.min() >= 0
+            assert slope.max() <= 90
+            # outermost pixels are copied from their inner neighbours
+            assert np.array_equal(slope[0, 1:-1], slope[1, 1:-1])
+            assert np.array_equal(slope[:, -1], slope[:, -2])
+        assert "pixelbuffer" not in caplog.text
+        # without pixelbuffer, results differ along tile borders
+        unbuffered = MapcheteProcess(
+            BufferedTilePyramid("geodetic").tile(*tile.id),
+            params=mp.config.params_at_zoom(4))
+        unbuffered.slope(np.zeros(unbuffered.tile.shape))
+        assert "pixelbuffer 0" in caplog.text
@@ -3,6 +3,7 @@
 
 import pytest
 import os
+import pickle
 from shapely.geometry import Polygon
 from shapely.wkt import loads
 from copy import deepcopy
@@ -216,3 +217,50 @@ def test_abstract_input(abstract_input):
 def test_init_zoom(cleantopo_br):
     with mapchete.open(cleantopo_br.dict, zoom=[3, 5]) as mp:
         assert mp.config.init_zoom_levels == range(3, 6)
+
+
+def test_load_process_module(mp_tmpdir, example_mapchete):
+    """Each configuration loads its own process module."""
+    process_file = os.path.join(mp_tmpdir, "reloaded_process.py")
+    with open(process_file, "w") as dst:
+        dst.write("def execute(mp):\n    return 1\n")
+    config = deepcopy(example_mapchete.dict)
+    config.update(process_file=process_file)
+    first = MapcheteConfig(config)
+    second = MapcheteConfig(config)
+    assert first.process_func is not second.process_func
+    # functions of both configurations can be pickled
+    for process_config in [first, second]:
+        assert pickle.loads(
+            pickle.dumps(process_config.process_func)
+        ) is process_config.process_func
+    # edited process file does not change loaded configurations
+    with open(process_file, "w") as dst:
+        dst.write("def execute(mp):\n    return 2\n")
+    assert MapcheteConfig(config).process_func(None) == 2
+    assert first.process_func(None) == 1
+
+
+def test_output_driver_errors(example_mapchete, monkeypatch):
+    """Only unknown output formats raise MapcheteConfigError."""
+    config = deepcopy(example_mapchete.dict)
+    config["output"].update(format="invalid_format")
+    with pytest.raises(MapcheteConfigError):
+        MapcheteConfig(config).output
+
+    def _broken_writer(output_params):
+        raise MapcheteDriverError("broken driver")
+
+    monkeypatch.setattr("mapchete.config.load_output_writer", _broken_writer)
+    with pytest.raises(MapcheteDriverError):
+        MapcheteConfig(example_mapchete.dict).output
+
+
+def test_output_driver_lazy(example_mapchete, monkeypatch):
+    """Only the requested output driver is imported."""
+    import mapchete.formats
+    monkeypatch.setattr(mapchete.formats, "_LOADED_DRIVERS", {})
+    config = deepcopy(example_mapchete.dict)
+    config.update(input=None)
+    assert MapcheteConfig(config).output.METADATA["driver_name"] == "GTiff"
+    assert list(mapchete.formats._LOADED_DRIVERS) == ["gtiff"]
@@ -62,10 +62,6 @@ def test_get_raw_output(example_mapchete):
         # wrong tile type
         with pytest.raises(TypeError):
             mp.get_raw_output("invalid")
-        # not matching CRSes
-        tile = BufferedTilePyramid("mercator").tile(7, 1, 1)
-        with pytest.raises(NotImplementedError):
-            mp.get_raw_output(tile)
 
 
 def test_process_tile_write(example_mapchete):
@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 """Test Mapchete default formats."""
 
+from copy import deepcopy
+import numpy as np
+import os
 import pytest
 from tilematrix import TilePyramid
 from rasterio.crs import CRS
@@ -9,7 +12,7 @@ import mapchete
 from mapchete import MapcheteProcess, errors
 from mapchete.formats import (
     available_input_formats, available_output_formats, driver_from_file, base,
-    load_output_writer, load_input_reader
+    load_output_writer, load_input_reader, _driver_entry_points, _drivers
 )
 
 
@@ -25,6 +28,14 @@ def test_available_output_formats():
         set(available_output_formats()))
 
 
+def test_driver_registry():
+    """Entry points are collected once and likely drivers are tried first."""
+    assert _driver_entry_points() is _driver_entry_points()
+    for driver_name in ["GTiff", "PNG_hillshade", "TileDirectory"]:
+        assert next(_drivers(driver_name)).METADATA["driver_name"] == (
+            driver_name)
+
+
 def test_filename_to_driver():
     """Check converting file names to driver."""
     for filename in [
@@ -69,6 +80,32 @@ def test_mapchete_input(mapchete_input):
         assert not mp_input.is_empty()
 
 
+def test_mapchete_input_memory(mp_tmpdir, mapchete_input, zoom_mapchete):
+    """Mapchete process as input run on demand in memory mode."""
+    conf = deepcopy(mapchete_input.dict)
+    conf["input"]["file2"] = dict(
+        format="Mapchete", path="zoom.mapchete", mode="memory")
+    with mapchete.open(conf) as mp:
+        input_data = mp.config.params_at_zoom(5)["input"]["file2"]
+        assert input_data.mode == "memory"
+        assert input_data.bbox()
+        tiles = list(mp.get_process_tiles(5))
+        fused = [input_data.open(tile).read() for tile in tiles]
+        # output is cached instead of written
+        assert input_data.process.process_tile_cache
+        assert not os.listdir(mp_tmpdir)
+    # compare with output of input process
+    with mapchete.open(zoom_mapchete.path, mode="memory") as mp:
+        for tile, fused_data in zip(tiles, fused):
+            control = mp.get_raw_output(tile)[0]
+            assert np.array_equal(control.mask, fused_data.mask)
+            assert np.array_equal(control.filled(0), fused_data.filled(0))
+    # invalid mode
+    conf["input"]["file2"].update(mode="continue")
+    with pytest.raises(errors.MapcheteDriverError):
+        mapchete.open(conf)
+
+
 def test_base_format_classes():
     """Base format classes."""
     # InputData
@@ -141,6 +178,36 @@ def test_read_from_raster_file(cleantopo_br):
             assert f.read().shape == f.read([1]).shape == f.read(1).shape
 
 
+def test_prefetch_input(cleantopo_br, geojson):
+    """Return input read in advance."""
+    for example in [cleantopo_br, geojson]:
+        with mapchete.open(example.path) as mp:
+            process_tile = next(mp.get_process_tiles(
+                max(mp.config.zoom_levels)))
+            process = MapcheteProcess(
+                config=mp.config, tile=process_tile,
+                params=mp.config.params_at_zoom(process_tile.zoom)
+            )
+            input_data = process.params["input"]["file1"]
+            with process.open("file1") as f:
+                read = f.read()
+            input_data.prefetch(process_tile)
+            assert len(input_data._prefetched) == 1
+            with process.open("file1") as f:
+                prefetched = f.read()
+            assert len(input_data._prefetched) == 0
+            if isinstance(read, list):
+                assert prefetched == read
+            else:
+                assert np.array_equal(prefetched, read)
+            # other parameters are read again
+            if example is cleantopo_br:
+                input_data.prefetch(process_tile)
+                with process.open("file1", resampling="bilinear") as f:
+                    f.read()
+                assert len(input_data._prefetched) == 1
+
+
 def test_invalid_input_type(example_mapchete):
     """Raise MapcheteDriverError."""
     # invalid input type
@@ -53,4 +53,8 @@ def test_output_data(mp_tmpdir):
     empty = output.empty(tile)
     assert isinstance(empty, ma.MaskedArray)
     assert not empty.any()
+    # empty tiles have as many bands as read tiles
+    assert empty.shape == data.shape
+    output = png.OutputData(dict(output_params, bands=1))
+    assert output.empty(tile).shape == data.shape
     # TODO for_web
@@ -1,6 +1,7 @@
 """Test Mapchete default formats."""
 
 from copy import deepcopy
+import numpy as np
 import os
 import pytest
 import six
@@ -74,6 +75,42 @@ def _run_tiledir_process_raster(conf_dict, metatiling, bounds):
             for tile in mp.get_process_tiles(4)])
 
 
+def test_read_raster_data_same_grid(
+    mp_tmpdir, cleantopo_br, cleantopo_br_tiledir
+):
+    """Read raster data from tiles on the same grid without resampling."""
+    # prepare data
+    with mapchete.open(cleantopo_br.path) as mp:
+        bounds = mp.config.bounds_at_zoom()
+        mp.batch_process(zoom=4)
+    masked = 0
+    for metatiling in [1, 2, 4, 8]:
+        conf = deepcopy(cleantopo_br_tiledir.dict)
+        conf["pyramid"].update(metatiling=metatiling)
+        with mapchete.open(conf, mode="overwrite", bounds=bounds) as mp:
+            for tile in mp.get_process_tiles(4):
+                input_tile = next(six.itervalues(mp.config.input)).open(tile)
+                assert input_tile._same_grid
+                direct = input_tile.read()
+                # compare with resampled output
+                input_tile._same_grid = False
+                resampled = input_tile.read()
+                assert direct.shape == resampled.shape
+                assert direct.dtype == resampled.dtype
+                assert np.array_equal(direct.mask, resampled.mask)
+                assert np.array_equal(direct.filled(0), resampled.filled(0))
+                # masked pixels carry dst_nodata
+                input_tile._same_grid = True
+                direct = input_tile.read(dst_nodata=255)
+                input_tile._same_grid = False
+                resampled = input_tile.read(dst_nodata=255)
+                assert np.array_equal(direct.mask, resampled.mask)
+                assert np.array_equal(direct.filled(0), resampled.filled(0))
+                assert (direct.data[direct.mask] == 255).all()
+                masked += direct.mask.sum()
+    assert masked
+
+
 def test_read_remote_raster_data(mp_tmpdir, cleantopo_remote):
     """Read raster data."""
     with mapchete.open(cleantopo_remote.path) as mp:
@@ -1,8 +1,11 @@
 #!/usr/bin/env python
 """Test Mapchete io module."""
 
+import os
 import pytest
 import shutil
+import subprocess
+import sys
 import rasterio
 import tempfile
 import numpy as np
@@ -13,6 +16,8 @@ from shapely.ops import unary_union
 from rasterio.enums import Compression
 from rasterio.crs import CRS
 from itertools import product
+from six.moves.urllib.error import HTTPError
+from six.moves.urllib.request import urlopen
 
 from mapchete.config import MapcheteConfig
 from mapchete.tile import BufferedTilePyramid
@@ -20,7 +25,11 @@ from mapchete.io import get_best_zoom_level
 from mapchete.io.raster import (
     read_raster_window, write_raster_window, extract_from_array,
     resample_from_array, create_mosaic, ReferencedRaster, prepare_array,
-    RasterWindowMemoryFile)
+    RasterWindowMemoryFile, read_raster_mosaic, read_aligned_raster_tiles,
+    downsample_from_array)
+from mapchete.io.range_cache import (
+    RangeCache, RangeCacheServer, RANGE_CACHE_PATH_ENV, cached_path,
+    _encode_url)
 from mapchete.io.vector import (
     read_vector_window, reproject_geometry, clean_geometry_type,
     segmentize_geometry)
@@ -333,6 +342,48 @@ def test_resample_from_array():
         resample_from_array(in_data, in_tile.affine, out_tile)
 
 
+def test_downsample_from_array():
+    """Downsample array by reducing blocks of pixels."""
+    pyramid = BufferedTilePyramid("geodetic", pixelbuffer=2)
+    out_tile = pyramid.tile(5, 5, 5)
+    # mosaic of child tiles without pixelbuffer
+    children = [
+        BufferedTilePyramid("geodetic").tile(*child.id)
+        for child in out_tile.get_children()
+    ]
+    mosaic = create_mosaic([
+        (child, np.full((1, ) + child.shape, i + 1, dtype="uint8"))
+        for i, child in enumerate(children)
+    ])
+    data = mosaic.data.copy()
+    data.mask[0, :2, :2] = True
+    data[0, 2, 2] = 100
+    for resampling, value in [
+        ("nearest", 1), ("average", 26), ("min", 1), ("max", 100)
+    ]:
+        out = downsample_from_array(
+            data, mosaic.affine, out_tile, resampling=resampling)
+        assert out.shape == (1, ) + out_tile.shape
+        assert out.dtype == data.dtype
+        # pixelbuffer is not covered by children
+        assert out.mask[:, :2].all()
+        assert out.mask[:, :, -2:].all()
+        # pixel covering masked block
+        assert out.mask[0, 2, 2]
+        # pixel covering one partly masked block
+        assert out[0, 3, 3] == value
+        assert not out.mask[:, 2:-2, 2:-2][0, 1:].any()
+    # matches GDAL nearest resampling
+    assert np.array_equal(
+        downsample_from_array(mosaic, out_tile=out_tile),
+        resample_from_array(mosaic, out_tile=out_tile))
+    # not aligned
+    out_tile = BufferedTilePyramid("geodetic", tile_size=200).tile(5, 5, 5)
+    assert np.array_equal(
+        downsample_from_array(mosaic, out_tile=out_tile),
+        resample_from_array(mosaic, out_tile=out_tile))
+
+
 def test_create_mosaic_errors():
     """Check error handling of create_mosaic()."""
     tp_geo = BufferedTilePyramid("geodetic")
@@ -427,6 +478,95 @@ def test_create_mosaic_antimeridian():
     assert mosaic.data[0][0][-1] == 1
 
 
+def test_create_mosaic_float_errors():
+    """Paste and extract adjacent tiles despite floating point errors."""
+    tp = BufferedTilePyramid("mercator")
+    tiles = [tp.tile(7, row, col) for row in [7, 8] for col in [9, 10]]
+    mosaic = create_mosaic([
+        (tile, np.ones((1, ) + tile.shape, dtype="uint8")) for tile in tiles])
+    assert mosaic.data.shape == (1, 512, 512)
+    assert not mosaic.data.mask.any()
+    for tile in tiles:
+        extracted = extract_from_array(mosaic.data, mosaic.affine, tile)
+        assert extracted.shape == (1, ) + tile.shape
+    # tiny gaps between tile bounding boxes are no antimeridian crossing
+    tiles = [tp.tile(6, row, col) for row in [7, 8] for col in [9, 10]]
+    mosaic = create_mosaic([
+        (tile, np.ones((1, ) + tile.shape, dtype="uint8")) for tile in tiles])
+    assert mosaic.data.shape == (1, 512, 512)
+    assert not mosaic.data.mask.any()
+
+
+def test_read_raster_mosaic(cleantopo_br_tif):
+    """Read tiles concurrently into mosaic."""
+    tp = BufferedTilePyramid("geodetic", pixelbuffer=5)
+    with rasterio.open(cleantopo_br_tif) as src:
+        bbox = reproject_geometry(box(*src.bounds), src.crs, tp.crs)
+    tiles = list(tp.tiles_from_geom(bbox, 6))
+    assert len(tiles) > 1
+    tiles_paths = [(tile, cleantopo_br_tif) for tile in tiles]
+    # equals mosaic created from serially read tiles
+    control = create_mosaic([
+        (tile, read_raster_window(cleantopo_br_tif, tile))
+        for tile in tiles
+    ], nodata=0)
+    for threads in [1, 4]:
+        mosaic = read_raster_mosaic(
+            tiles_paths, count=1, dtype="uint16", threads=threads)
+        assert isinstance(mosaic, ReferencedRaster)
+        assert mosaic.affine == control.affine
+        assert np.array_equal(mosaic.data.filled(0), control.data.filled(0))
+        assert np.array_equal(mosaic.data.mask, control.data.mask)
+    # quick return if there is just one tile
+    mosaic = read_raster_mosaic(tiles_paths[:1], dtype="float32")
+    assert mosaic.affine == tiles[0].affine
+    # data type is applied like for multiple tiles
+    assert mosaic.data.dtype == "float32"
+    window = read_raster_window(cleantopo_br_tif, tiles[0])
+    assert np.array_equal(mosaic.data.mask, window.mask)
+    assert np.array_equal(
+        mosaic.data.compressed(), window.compressed().astype("float32"))
+    # errors
+    with pytest.raises(ValueError):
+        read_raster_mosaic([])
+    with pytest.raises(ValueError):
+        read_raster_mosaic(tiles_paths)
+
+
+def test_read_aligned_raster_tiles(mp_tmpdir):
+    """Read tiles sharing the output grid using their masks."""
+    tp = BufferedTilePyramid("geodetic", tile_size=16)
+    out_tile = BufferedTilePyramid(
+        "geodetic", tile_size=16, pixelbuffer=2).tile(5, 3, 3)
+    tiles_paths = []
+    for tile, nodata in [(tp.tile(5, 3, 3), None), (tp.tile(5, 3, 4), 1)]:
+        path = os.path.join(mp_tmpdir, "%s_%s.tif" % tile.id[1:])
+        data = np.zeros((1, ) + tile.shape, dtype="uint8")
+        data[:, :, ::2] = 1
+        with rasterio.open(
+            path, "w", driver="GTiff", count=1, dtype="uint8", crs=tile.crs,
+            transform=tile.affine, width=tile.width, height=tile.height,
+            nodata=nodata
+        ) as dst:
+            dst.write(data)
+        tiles_paths.append((tile, path))
+    data = read_aligned_raster_tiles(
+        tiles_paths, out_tile, count=1, dtype="uint8", nodata=0,
+        dst_nodata=255)
+    assert data.shape == (1, ) + out_tile.shape
+    # tile without nodata value is not masked
+    assert not data.mask[:, 2:-2, 2:-2].any()
+    assert np.array_equal(
+        data[0, 2:-2, 2:-2], np.tile([1, 0] * 8, (16, 1)))
+    # nodata pixels of neighbour tile are masked
+    assert np.array_equal(data.mask[0, 2:-2, -2:], np.tile([1, 0], (16, 1)))
+    assert (data.data[0, 2:-2, -2:][data.mask[0, 2:-2, -2:]] == 255).all()
+    # area not covered by tiles
+    assert data.mask[:, :2].all()
+    assert data.mask[:, :, :2].all()
+    assert (data.data[data.mask] == 255).all()
+
+
 def test_prepare_array_iterables():
     """Convert iterable data into a proper array."""
     # input is iterable
@@ -645,3 +785,99 @@ def test_clean_geometry_type():
 
 # TODO write_vector_window()
 # TODO extract_from_tile()
+
+
+def test_range_cache(mp_tmpdir, range_server, cleantopo_br_tif, monkeypatch):
+    """Read remote raster windows through the range cache."""
+    url = range_server.url + "/" + os.path.basename(cleantopo_br_tif)
+    tp = BufferedTilePyramid("geodetic")
+    with rasterio.open(cleantopo_br_tif) as src:
+        tile = next(tp.tiles_from_bounds(src.bounds, 6))
+    expected = read_raster_window(cleantopo_br_tif, tile)
+    monkeypatch.setenv(
+        RANGE_CACHE_PATH_ENV, os.path.join(mp_tmpdir, "range_cache"))
+    assert cached_path(url) != url
+    assert cached_path(cleantopo_br_tif) == cleantopo_br_tif
+    # GDAL options for authentication, headers or proxies are not applied
+    # by the range cache, so files are read directly
+    assert cached_path(url, dict(GDAL_HTTP_USERPWD="user:password")) == url
+    with rasterio.Env(GDAL_HTTP_PROXY="proxy:8080"):
+        assert cached_path(url) == url
+    monkeypatch.setenv("GDAL_HTTP_HEADER_FILE", "headers.txt")
+    assert cached_path(url) == url
+    monkeypatch.delenv("GDAL_HTTP_HEADER_FILE")
+    read = read_raster_window(url, tile)
+    assert np.array_equal(read, expected)
+    assert range_server.requests
+    assert len(RangeCache(1024 * 1024, os.path.join(mp_tmpdir, "range_cache")))
+
+    # cached blocks are reused by other processes and runs
+    size = os.path.getsize(cleantopo_br_tif)
+    with open(cleantopo_br_tif, "rb") as src:
+        data = src.read()
+    range_server.clear()
+    cache = RangeCache(1024 * 1024, os.path.join(mp_tmpdir, "blocks"), 1024)
+    assert cache.read(url, 100, 3000) == data[100:3001]
+    assert range_server.requests == [("/cleantopo_br.tif", 0, 3071)]
+    cache = RangeCache(1024 * 1024, os.path.join(mp_tmpdir, "blocks"), 1024)
+    assert cache.read(url, 1024, 2047) == data[1024:2048]
+    assert cache.read(url, size - 10, size + 10) == data[-10:]
+    assert len(range_server.requests) == 2
+    assert cache.hits == 1
+
+    # changed files are fetched again
+    range_server.set_etag('"2"')
+    cache = RangeCache(1024 * 1024, os.path.join(mp_tmpdir, "blocks"), 1024)
+    assert cache.read(url, 1024, 2047) == data[1024:2048]
+    assert len(range_server.requests) == 3
+
+    # least recently used blocks are removed
+    cache = RangeCache(4096, os.path.join(mp_tmpdir, "small"), 1024)
+    for start in range(0, 8192, 1024):
+        assert cache.read(url, start, start + 1023) == data[
+            start:start + 1024]
+    assert cache.currsize <= 4096
+    assert cache.evictions
+
+
+def test_range_cache_server(
+    mp_tmpdir, range_server, cleantopo_br_tif, monkeypatch
+):
+    """Only answer requests for registered remote URLs."""
+    url = range_server.url + "/" + os.path.basename(cleantopo_br_tif)
+    server = RangeCacheServer(os.path.join(mp_tmpdir, "range_cache"), 1024)
+    try:
+        local_url = server.register(url)
+        assert local_url != url
+        with open(cleantopo_br_tif, "rb") as src:
+            assert urlopen(local_url).read() == src.read()
+        # unregistered URLs and other schemes are not read
+        for other in [url + ".aux.xml", "file://" + cleantopo_br_tif]:
+            with pytest.raises(HTTPError) as e:
+                urlopen("http://127.0.0.1:%s/%s/%s" % (
+                    server.port, _encode_url(other), "cleantopo_br.tif"))
+            assert e.value.code == 404
+        # remote files are read directly if the server stopped
+        server._process.kill()
+        server._process.wait()
+        assert server.register(url + "?other") == url + "?other"
+        assert server.port is None
+    finally:
+        server.close()
+
+    # remote files are read directly if the server cannot be started
+    monkeypatch.setattr("sys.executable", "false")
+    server = RangeCacheServer(os.path.join(mp_tmpdir, "range_cache"), 1024)
+    assert server.port is None
+    assert server.register(url) == url
+
+
+def test_range_cache_import():
+    """Import range cache only if enabled."""
+    env = dict(os.environ)
+    env.pop(RANGE_CACHE_PATH_ENV, None)
+    subprocess.check_call([
+        sys.executable, "-c",
+        "import sys; import mapchete.io.raster; "
+        "assert 'mapchete.io.range_cache' not in sys.modules"
+    ], env=env)
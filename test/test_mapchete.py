@@ -4,21 +4,29 @@
 import pytest
 import os
 import shutil
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
 import rasterio
 import numpy as np
 import numpy.ma as ma
 import pkg_resources
+import yaml
 try:
-    from cPickle import dumps
+    from cPickle import dumps, loads
 except ImportError:
-    from pickle import dumps
+    from pickle import dumps, loads
 from functools import partial
 from multiprocessing import Pool
 from shapely.geometry import shape
 
 import mapchete
 from mapchete.io.raster import create_mosaic
-from mapchete.errors import MapcheteProcessOutputError
+from mapchete.tile import BufferedTilePyramid
+from mapchete.errors import MapcheteProcessOutputError, MapcheteConfigError
 
 
 def test_empty_execute(mp_tmpdir, cleantopo_br):
@@ -116,6 +124,237 @@ def test_get_raw_output_memory(mp_tmpdir, cleantopo_tl):
         assert not mp.get_raw_output((5, 0, 0)).mask.all()
 
 
+def test_get_raw_output_memory_multiple_process_tiles(mp_tmpdir, cleantopo_tl):
+    """Get raw output of tile covering more than one process tile."""
+    with mapchete.open(cleantopo_tl.path, mode="memory") as mp:
+        process_tile = mp.config.process_pyramid.tile(5, 1, 1)
+        # tile with bigger pixelbuffer than process tiles
+        tile = BufferedTilePyramid(
+            mp.config.process_pyramid.grid,
+            metatiling=mp.config.process_pyramid.metatiling,
+            pixelbuffer=mp.config.process_pyramid.pixelbuffer + 10
+        ).tile(*process_tile.id)
+        data = mp.get_raw_output(tile)
+        assert data.shape[-2:] == tile.shape
+        assert len(mp.process_tile_cache) == 9
+        # center equals output of process tile
+        assert np.array_equal(
+            data[:, 10:-10, 10:-10].filled(0),
+            mp.get_raw_output(process_tile).filled(0))
+
+
+def test_process_tile_cache(mp_tmpdir, cleantopo_tl):
+    """Process tile cache is limited by size of cached output."""
+    from mapchete._cache import ProcessTileCache
+    config = cleantopo_tl.dict
+    with mapchete.open(config, mode="memory") as mp:
+        # default size limits
+        assert mp.process_tile_cache.maxsize == 1024 * 1024 * 1024
+        mp.get_raw_output(mp.config.process_pyramid.tile(5, 0, 0))
+        stats = mp.process_tile_cache.stats()
+        assert stats["misses"] == 1
+        assert stats["tiles"] == 1
+        assert stats["currsize"] > 0
+    config.update(process_cache=dict(max_bytes=1000))
+    with mapchete.open(config, mode="memory") as mp:
+        assert mp.process_tile_cache.maxsize == 1000
+    for process_cache in [dict(max_bytes=0), dict(max_size=1), "1GB"]:
+        config.update(process_cache=process_cache)
+        with pytest.raises(MapcheteConfigError):
+            mapchete.open(config, mode="memory")
+
+    # raster output is measured in bytes
+    cache = ProcessTileCache("raster", max_bytes=500)
+    for i in range(8):
+        cache[i] = np.zeros((100, ), dtype="uint8")
+    assert cache.stats() == dict(
+        hits=0, misses=0, evictions=3, tiles=5, currsize=500, maxsize=500)
+    assert 7 in cache
+    cache[7]
+    with pytest.raises(KeyError):
+        cache[0]
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    # masked arrays, bands and output with metadata
+    cache.clear()
+    cache[0] = ma.masked_array(np.zeros((100, ), dtype="uint8"), mask=False)
+    cache[1] = ([np.zeros((50, ), dtype="uint8")] * 2, dict(tags=None))
+    assert cache.currsize == 300
+    # output larger than cache is not cached
+    cache[2] = np.zeros((501, ), dtype="uint8")
+    assert 2 not in cache
+    # vector output is measured in features
+    cache = ProcessTileCache("vector", max_features=3)
+    cache[0] = [dict(properties={})] * 2
+    cache[1] = [dict(properties={})] * 2
+    assert 0 not in cache
+    assert cache.currsize == 2
+    with pytest.raises(ValueError):
+        ProcessTileCache("foo")
+
+
+def test_process_tile_cache_disk(mp_tmpdir, cleantopo_tl):
+    """Evicted process output is spilled to disk."""
+    from mapchete._cache import ProcessTileCache
+    cache = ProcessTileCache(
+        "raster", max_bytes=400, disk_max_bytes=2000, disk_path=mp_tmpdir)
+    assert cache.disk.path.startswith(mp_tmpdir)
+    arrays = {
+        (5, 0, i): ma.masked_array(
+            np.full((100, ), i, dtype="uint8"), mask=np.arange(100) < i)
+        for i in range(4)
+    }
+    for key, array in arrays.items():
+        cache[key] = array
+    assert len(cache.disk) == 2
+    # read spilled output from disk and move it back into memory
+    for key, array in arrays.items():
+        assert key in cache
+        cached = cache[key]
+        assert isinstance(cached, ma.MaskedArray)
+        assert np.array_equal(cached.data, array.data)
+        assert np.array_equal(cached.mask, array.mask)
+    stats = cache.stats()
+    assert stats["disk"]["hits"] >= 2
+    # arrays read from disk can be modified without changing the cache
+    cached = cache[(5, 0, 0)]
+    cached[:] = 9
+    cache.clear()
+    assert not cache[(5, 0, 0)].any()
+    # least recently used files are removed
+    for i in range(20):
+        cache[(6, 0, i)] = np.zeros((100, ), dtype="uint8")
+    assert cache.disk.currsize <= 2000
+    assert cache.disk.stats()["evictions"]
+    assert (6, 0, 19) in cache
+    assert (5, 0, 0) not in cache
+    # other output is pickled
+    cache[(7, 0, 0)] = ([np.zeros((500, ), dtype="uint8")], dict(tags=None))
+    data, tags = cache[(7, 0, 0)]
+    assert data[0].shape == (500, )
+    cache.close()
+    assert not os.path.exists(cache.disk.path)
+
+    # use from process
+    config = cleantopo_tl.dict
+    config.update(process_cache=dict(
+        max_bytes=1, disk_max_bytes=1024 * 1024 * 1024, disk_path="tmp"))
+    with mapchete.open(config, mode="memory") as mp:
+        disk = mp.process_tile_cache.disk
+        assert disk.path.startswith(os.path.join(config["config_dir"], "tmp"))
+        tile = mp.config.process_pyramid.tile(5, 0, 0)
+        output = mp.get_raw_output(tile)
+        assert len(disk) == 1
+        assert np.array_equal(output, mp.get_raw_output(tile))
+        assert disk.stats()["hits"] == 1
+    assert not os.path.exists(disk.path)
+
+
+def test_process_tile_cache_shared(mp_tmpdir, cleantopo_tl):
+    """Process output is shared between processes using the same directory."""
+    from mapchete._cache import SharedDiskCache
+    config = cleantopo_tl.dict
+    config.update(process_cache=dict(
+        disk_max_bytes=1024 * 1024 * 1024, disk_path="tmp/shared",
+        disk_shared=True))
+    tile = (5, 0, 0)
+    # e.g. two preforked server workers
+    with mapchete.open(config, mode="memory") as first:
+        with mapchete.open(config, mode="memory") as second:
+            first_disk = first.process_tile_cache.disk
+            second_disk = second.process_tile_cache.disk
+            assert isinstance(first_disk, SharedDiskCache)
+            assert first_disk.path == second_disk.path
+            output = first.get_raw_output(tile)
+            assert len(second_disk) == 1
+            assert np.array_equal(output, second.get_raw_output(tile))
+            assert second_disk.stats()["hits"] == 1
+    # shared cache is kept after closing
+    assert os.path.isdir(first_disk.path)
+    # other process configuration uses other directory
+    config.update(some_parameter=1)
+    with mapchete.open(config, mode="memory") as other:
+        assert other.process_tile_cache.disk.path != first_disk.path
+    config.update(process_cache=dict(disk_shared=True))
+    with pytest.raises(MapcheteConfigError):
+        mapchete.open(config, mode="memory")
+
+    # least recently used entries are removed
+    cache = SharedDiskCache(1000, os.path.join(mp_tmpdir, "cache"))
+    for i in range(4):
+        cache[(5, 0, i)] = ma.masked_array(
+            np.zeros((100, ), dtype="uint8"), mask=True)
+    assert cache.currsize <= 1000
+    assert (5, 0, 3) in cache
+    assert (5, 0, 0) not in cache
+    assert cache[(5, 0, 3)].mask.all()
+    cache[(5, 0, 4)] = [dict(properties={})]
+    assert cache[(5, 0, 4)] == [dict(properties={})]
+    # lock entry for other processes
+    order = []
+
+    def _locked(name):
+        with cache.lock((5, 0, 5)):
+            order.append(name)
+            time.sleep(0.1)
+            order.append(name)
+
+    threads = [threading.Thread(target=_locked, args=(i, )) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert order[0] == order[1] and order[2] == order[3]
+
+
+def test_shared_disk_cache_trim_throttle(mp_tmpdir):
+    """Directory is only scanned after writing a part of max_bytes."""
+    from mapchete._cache import SharedDiskCache
+    cache = SharedDiskCache(1024 * 1024, os.path.join(mp_tmpdir, "cache"))
+    scans = []
+    _scan = cache._scan
+
+    def _counted_scan():
+        scans.append(None)
+        return _scan()
+
+    cache._scan = _counted_scan
+    for i in range(100):
+        cache[(5, 0, i)] = ma.masked_array(
+            np.zeros((100, ), dtype="uint8"), mask=True)
+    # first write and every 64 KB written
+    assert len(scans) == 1
+    for i in range(100, 300):
+        cache[(5, 0, i)] = ma.masked_array(
+            np.zeros((100, ), dtype="uint8"), mask=True)
+    assert 1 < len(scans) < 10
+
+
+def test_shared_disk_cache_stale_lock(mp_tmpdir):
+    """Locks of dead processes are removed without waiting for timeout."""
+    from mapchete._cache import SharedDiskCache, _file_name
+    cache = SharedDiskCache(1000, os.path.join(mp_tmpdir, "cache"))
+    dead = subprocess.Popen([sys.executable, "-c", ""])
+    dead.wait()
+    lock_path = os.path.join(cache.path, _file_name((5, 0, 0)) + ".lock")
+    with open(lock_path, "w") as dst:
+        dst.write("%s %s" % (socket.gethostname(), dead.pid))
+    start = time.time()
+    with cache.lock((5, 0, 0)):
+        with open(lock_path) as src:
+            assert src.read() == "%s %s" % (socket.gethostname(), os.getpid())
+    assert time.time() - start < 5
+    assert not os.path.exists(lock_path)
+    # locks of running processes are kept until timeout
+    with open(lock_path, "w") as dst:
+        dst.write("%s %s" % (socket.gethostname(), os.getpid()))
+    start = time.time()
+    with cache.lock((5, 0, 0), timeout=0.5):
+        pass
+    assert time.time() - start >= 0.5
+
+
 def test_get_raw_output_readonly(mp_tmpdir, cleantopo_tl):
     """Get raw process output using readonly flag."""
     tile = (5, 0, 0)
@@ -158,15 +397,48 @@ def test_get_raw_output_continue_vector(mp_tmpdir, geojson):
         assert mp.get_raw_output(tile)
 
 
-def test_get_raw_output_reproject(mp_tmpdir, cleantopo_tl):
+def test_get_raw_output_reproject(mp_tmpdir, cleantopo_tl, geojson):
     """Get process output from a different CRS."""
-    try:
-        with mapchete.open(cleantopo_tl.path) as mp:
-            assert mp.config.mode == "continue"
-            # TODO implement function
-            mp.get_raw_output((5, 0, 0))
-    except NotImplementedError:
-        pass
+    mercator = BufferedTilePyramid("mercator")
+    # raster data
+    tile = mercator.tile(5, 3, 0)
+    with mapchete.open(cleantopo_tl.path, mode="memory") as mp:
+        output = mp.get_raw_output(tile)
+        assert isinstance(output, ma.masked_array)
+        assert output.shape == (1, ) + tile.shape
+        assert not output.mask.all()
+        # warp grid is cached and reused
+        warp_grid = mp._warp_grid(tile)
+        assert warp_grid.zoom == 4
+        assert len(mp._warp_grids) == 1
+        assert np.array_equal(mp.get_raw_output(tile), output)
+        assert mp._warp_grid(tile) is warp_grid
+        # compare with nearest process pixels
+        xs, ys = warp_grid.coordinates
+        for row, col in [(0, 0), (100, 200), (255, 255)]:
+            process_tile = mp.config.output_pyramid.tile(
+                *next(mp.config.output_pyramid.tiles_from_bounds(
+                    (xs[row, col], ys[row, col]) * 2, 4)).id)
+            affine = process_tile.affine
+            assert output[0, row, col] == mp.get_raw_output(process_tile)[
+                0,
+                int((ys[row, col] - affine.f) // affine.e),
+                int((xs[row, col] - affine.c) // affine.a)
+            ]
+        # pixelbuffered tile covers the same pixels
+        buffered = BufferedTilePyramid("mercator", pixelbuffer=2).tile(5, 3, 0)
+        assert np.array_equal(
+            mp.get_raw_output(buffered)[:, 2:-2, 2:-2], output)
+        # no matching process zoom level
+        assert mp.get_raw_output(mercator.tile(7, 14, 1)).mask.all()
+        assert mp._warp_grid(mercator.tile(7, 14, 1)) is None
+    # vector data
+    tile = mercator.tile(5, 20, 31)
+    with mapchete.open(geojson.path, mode="memory") as mp:
+        output = mp.get_raw_output(tile)
+        assert output
+        for feature in output:
+            assert shape(feature["geometry"]).intersects(tile.bbox)
 
 
 def test_baselevels(mp_tmpdir, baselevels):
@@ -194,6 +466,208 @@ def test_baselevels(mp_tmpdir, baselevels):
         ])
 
 
+def test_baselevels_children_in_memory(mp_tmpdir, baselevels):
+    """Build lower zoom levels from written output kept in memory."""
+    config = baselevels.dict
+    config["baselevels"].update(lower="average")
+    with mapchete.open(config, mode="overwrite") as mp:
+        mp.batch_process(zoom=[4, 5], multi=1)
+        # used children are removed from memory
+        assert not [
+            key for key in mapchete._core._baselevel_children
+            if key[1][0] == 5
+        ]
+        # same output as when reading children from disk
+        tiles = list(mp.get_process_tiles(4))
+        assert tiles
+        for tile in tiles:
+            written = mp.config.output.read(tile)
+            assert not written.mask.all()
+            from_disk = mp.execute(tile)
+            assert np.array_equal(written.mask, from_disk.mask)
+            assert np.allclose(written.compressed(), from_disk.compressed())
+
+
+def test_baselevels_sources_cache(mp_tmpdir, baselevels):
+    """Read output used for baselevel interpolation only once per process."""
+    with mapchete.open(baselevels.dict, mode="overwrite") as mp:
+        parent = next(mp.get_process_tiles(6))
+        mp.write(parent, mp.execute(parent))
+        children = parent.get_children()
+        key = (mp.config.output.path, parent.id)
+        first = mp.execute(children[0])
+        assert key in mapchete._core._baselevel_sources
+        cached = mapchete._core._baselevel_sources[key]
+        for child in children[1:]:
+            # cache is kept when process is pickled, e.g. for pool tasks
+            loads(dumps(mp)).execute(child)
+            assert mapchete._core._baselevel_sources[key] is cached
+        # rewritten output is read again
+        mp.write(parent, mp.execute(parent))
+        assert key not in mapchete._core._baselevel_sources
+        assert np.array_equal(mp.execute(children[0]), first)
+    # output read by an earlier process is read again
+    with mapchete.open(baselevels.dict, mode="continue") as mp:
+        assert key not in mapchete._core._baselevel_sources
+        mp.execute(children[0])
+        assert key in mapchete._core._baselevel_sources
+    # pool workers start with an empty cache
+    mapchete._core._worker_initializer()
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    assert key not in mapchete._core._baselevel_sources
+
+
+def test_batch_process_subtrees(mp_tmpdir, baselevels, monkeypatch):
+    """Process subtrees of tiles with the same result as per zoom level."""
+    # use subtrees from zoom 3 even if there are not enough for all workers
+    monkeypatch.setattr(mapchete._core, "SUBTREES_PER_WORKER", 0)
+    config = baselevels.dict
+    config["baselevels"].update(lower="average")
+    with mapchete.open(config, mode="overwrite") as mp:
+        mp.batch_process(zoom=[3, 6], multi=2)
+        expected = {
+            tile.id: mp.config.output.read(tile)
+            for zoom in range(3, 7)
+            for tile in mp.get_process_tiles(zoom)
+        }
+    for multi in [1, 2]:
+        with mapchete.open(config, mode="overwrite") as mp:
+            processed = [
+                result["process_tile"].id
+                for result in mp.batch_processor(
+                    zoom=[3, 6], multi=multi, subtrees=True)
+            ]
+            # every tile is processed exactly once
+            assert len(processed) == len(set(processed))
+            assert set(processed) == set(expected)
+            # children are processed before their parents
+            for tile_id in processed:
+                if tile_id[0] < 6:
+                    assert all(
+                        processed.index(child.id) < processed.index(tile_id)
+                        for child in mp.config.process_pyramid.tile(
+                            *tile_id).get_children()
+                        if child.id in expected
+                    )
+            for tile_id, data in expected.items():
+                written = mp.config.output.read(
+                    mp.config.process_pyramid.tile(*tile_id))
+                assert np.array_equal(written.mask, data.mask)
+                assert np.allclose(written.compressed(), data.compressed())
+
+
+def test_batch_process_subtrees_report(mp_tmpdir, baselevels, monkeypatch):
+    """Tiles of subtrees are reported as soon as they are processed."""
+    process_worker = mapchete._core._process_worker
+    failing = []
+
+    def _process_worker(process, process_tile):
+        if process_tile.id in failing:
+            raise RuntimeError("failed")
+        return process_worker(process, process_tile)
+
+    # replaced function is inherited by forked pool workers
+    monkeypatch.setattr(mapchete._core, "_process_worker", _process_worker)
+    # use subtrees from zoom 5 even if there are not enough for all workers
+    monkeypatch.setattr(mapchete._core, "SUBTREES_PER_WORKER", 0)
+    with mapchete.open(baselevels.dict, mode="overwrite") as mp:
+        root = next(mp.get_process_tiles(5))
+        failing.append(root.id)
+        descendants = [
+            child.id for child in root.get_children()
+            if child.id in [tile.id for tile in mp.get_process_tiles(6)]
+        ]
+        assert descendants
+        processed = []
+        with pytest.raises(RuntimeError):
+            for result in mp.batch_processor(
+                zoom=[5, 6], multi=2, subtrees=True
+            ):
+                processed.append(result["process_tile"].id)
+        # descendants of failed tile are reported
+        assert set(descendants).issubset(processed)
+        assert root.id not in processed
+
+
+def test_batch_process_prefetch(mp_tmpdir, cleantopo_tl):
+    """Read input of next tiles in advance with the same result."""
+    config = cleantopo_tl.dict
+    config["pyramid"].update(metatiling=1)
+    with mapchete.open(config, mode="overwrite") as mp:
+        mp.batch_process(zoom=5, multi=1)
+        expected = {
+            tile.id: mp.config.output.read(tile)
+            for tile in mp.get_process_tiles(5)
+        }
+    for multi in [1, 2]:
+        with mapchete.open(config, mode="overwrite") as mp:
+            processed = [
+                result["process_tile"].id
+                for result in mp.batch_processor(
+                    zoom=5, multi=multi, max_chunksize=4, prefetch=True)
+            ]
+            assert sorted(processed) == sorted(expected)
+            for tile_id, data in expected.items():
+                written = mp.config.output.read(
+                    mp.config.process_pyramid.tile(*tile_id))
+                assert np.array_equal(written, data)
+
+
+def test_batch_process_prefetch_skipped(mp_tmpdir, cleantopo_tl, monkeypatch):
+    """Do not read input of existing tiles or of single tile chunks."""
+    from mapchete.formats.default import raster_file
+    config = cleantopo_tl.dict
+    config["pyramid"].update(metatiling=1)
+    with mapchete.open(config, mode="overwrite") as mp:
+        mp.batch_process(zoom=5, multi=1)
+    prefetched = []
+    monkeypatch.setattr(
+        raster_file.InputData, "prefetch",
+        lambda self, tile: prefetched.append(tile.id))
+    # existing tiles are not processed again in continue mode
+    with mapchete.open(config, mode="continue") as mp:
+        mp.batch_process(zoom=5, multi=1, prefetch=True)
+    assert not prefetched
+    # workers are queued enough tiles to read input in advance
+    chunk_sizes = []
+    chunks = mapchete._core._chunks
+
+    def _chunks(iterable, size):
+        chunk_sizes.append(size)
+        return chunks(iterable, size)
+    monkeypatch.setattr(mapchete._core, "_chunks", _chunks)
+    with mapchete.open(config, mode="overwrite") as mp:
+        mp.batch_process(zoom=5, multi=2, max_chunksize=1, prefetch=True)
+    assert chunk_sizes == [mapchete._prefetch.PREFETCH_TILES + 1]
+
+
+def test_baselevels_children_per_process(mp_tmpdir, baselevels):
+    """Keep children per process and not in workers of per zoom pools."""
+    config = baselevels.dict
+    config["baselevels"].update(lower="average")
+    with mapchete.open(config, mode="overwrite") as mp:
+        tile = next(mp.get_process_tiles(5))
+        key = (mp.config.output.path, tile.id)
+        mp.write(tile, mp.execute(tile))
+        assert key in mapchete._core._baselevel_children
+        # kept output is not pickled with the process
+        assert "_baselevel_children" not in loads(dumps(mp)).__dict__
+        try:
+            # per zoom pool workers do not keep children
+            mapchete._core._worker_initializer(False)
+            assert key not in mapchete._core._baselevel_children
+            mp.write(tile, mp.execute(tile))
+            assert key not in mapchete._core._baselevel_children
+        finally:
+            mapchete._core._worker_initializer()
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+        mp.write(tile, mp.execute(tile))
+        assert key in mapchete._core._baselevel_children
+    # output kept by an earlier process is not used
+    with mapchete.open(config, mode="continue"):
+        assert key not in mapchete._core._baselevel_children
+
+
 def test_baselevels_buffer(mp_tmpdir, baselevels):
     """Baselevel interpolation using buffers."""
     config = baselevels.dict
@@ -361,6 +835,70 @@ def test_batch_process(mp_tmpdir, cleantopo_tl):
         mp.batch_process(zoom=2, multi=1)
 
 
+def test_process_graph(mp_tmpdir, cleantopo_tl):
+    """Process chained processes using ProcessGraph."""
+    upstream_file = os.path.join(mp_tmpdir, "upstream.mapchete")
+    downstream_file = os.path.join(mp_tmpdir, "downstream.mapchete")
+    upstream_config = dict(
+        cleantopo_tl.dict,
+        process_file=os.path.join(
+            cleantopo_tl.dict["config_dir"], cleantopo_tl.dict["process_file"]),
+        input=dict(
+            file1=os.path.join(
+                cleantopo_tl.dict["config_dir"],
+                cleantopo_tl.dict["input"]["file1"])),
+        output=dict(
+            cleantopo_tl.dict["output"],
+            path=os.path.join(mp_tmpdir, "upstream")),
+        zoom_levels=dict(min=0, max=3))
+    upstream_config.pop("config_dir")
+    downstream_config = dict(
+        upstream_config,
+        process_file=os.path.join(
+            cleantopo_tl.dict["config_dir"], "write_rasterfile_tags.py"),
+        input=dict(file1=upstream_file),
+        output=dict(
+            upstream_config["output"],
+            path=os.path.join(mp_tmpdir, "downstream")),
+        pyramid=dict(upstream_config["pyramid"], metatiling=4))
+    for path, config in [
+        (upstream_file, upstream_config), (downstream_file, downstream_config)
+    ]:
+        with open(path, "w") as dst:
+            dst.write(yaml.dump(config))
+    with mapchete.open(upstream_file, mode="overwrite") as upstream:
+        with mapchete.open(downstream_file, mode="overwrite") as downstream:
+            for multi in [1, 2]:
+                # order of processes does not matter
+                graph = mapchete.ProcessGraph([downstream, upstream])
+                for (index, _), dependencies in graph.dependencies.items():
+                    if index == 0:
+                        assert dependencies
+                        assert all(i == 1 for i, _ in dependencies)
+                    else:
+                        assert not dependencies
+                processed = set()
+                for result in graph.batch_processor(multi=multi):
+                    node = (
+                        graph.process_names.index(result["process_name"]),
+                        result["process_tile"].id)
+                    assert graph.dependencies[node].issubset(processed)
+                    processed.add(node)
+                assert processed == set(graph.dependencies.keys())
+    # downstream output equals upstream output
+    with mapchete.open(upstream_file, mode="readonly") as up:
+        with mapchete.open(downstream_file, mode="readonly") as down:
+            for tile in down.get_process_tiles(3):
+                assert np.array_equal(
+                    up.get_raw_output(tile), down.get_raw_output(tile))
+    # invalid mode
+    with mapchete.open(upstream_file, mode="readonly") as mp:
+        with pytest.raises(ValueError):
+            mapchete.ProcessGraph([mp])
+    with pytest.raises(ValueError):
+        mapchete.ProcessGraph([])
+
+
 def test_custom_grid(mp_tmpdir, custom_grid):
     """Cutom grid processing."""
     # process and save